@@ -14,6 +14,7 @@
 
 import codecs
 import collections.abc
+import concurrent.futures
 import json
 import logging
 import os
@@ -40,6 +41,103 @@ def _load_json(file_name):
     return None
 
 
+def split_populate_tree(source, aside, mounts):
+    """Split the built tree into one tree per file system
+
+    Everything below a nested mount point is moved out of ``source``
+    into ``aside`` (leaving the empty mount point directory behind),
+    so each file system can be filled from its own directory.
+
+    :param source: the built tree
+    :param aside: directory to move the nested trees to
+    :param mounts: list of (mount point, mkfs node name) tuples
+    :return: dict of mkfs node name to the directory with its content
+    """
+    sources = {}
+    exec_sudo(['mkdir', '-p', aside])
+    # Children sort after their parents, so going backwards moves
+    # e.g. /var/log out before /var.
+    for mount_point, name in sorted(mounts, reverse=True):
+        if not mount_point.startswith('/'):
+            # swap
+            continue
+        if mount_point == '/':
+            sources[name] = source
+            continue
+        path = os.path.join(source, mount_point[1:])
+        dest = os.path.join(aside, name)
+        if os.path.isdir(path):
+            exec_sudo(['mv', path, dest])
+            exec_sudo(['mkdir', path])
+        else:
+            exec_sudo(['mkdir', '-p', path, dest])
+        sources[name] = dest
+    return sources
+
+
+def run_nodes(nodes, edges, method, workers=1):
+    """Call a method of all nodes, in parallel where possible
+
+    A node is called once the nodes with an edge to it are done.
+    Nodes with ``parallel_safe`` set run at the same time as other
+    such nodes; any other node runs on its own, in the given order.
+
+    After a failure no more nodes are started; the first exception
+    is raised once the running nodes are finished.
+
+    :param nodes: list of nodes, in an order satisfying the edges
+    :param edges: list of (from, to) node names
+    :param method: name of the :class:`NodeBase` method to call
+    :param workers: maximum number of nodes running at the same time;
+      with 1 the nodes are simply called in order
+    """
+    if workers <= 1:
+        for node in nodes:
+            getattr(node, method)()
+        return
+
+    names = set(node.name for node in nodes)
+    requires = dict((name, set()) for name in names)
+    for edge_from, edge_to in edges:
+        if edge_from in names and edge_to in names:
+            requires[edge_to].add(edge_from)
+
+    pending = list(nodes)
+    running = {}
+    done = set()
+    error = None
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        while pending or running:
+            while error is None and pending and len(running) < workers:
+                if any(not n.parallel_safe for n in running.values()):
+                    break
+                node = next((n for n in pending if n.parallel_safe and
+                             requires[n.name] <= done), None)
+                if node is None:
+                    # A node that must run alone waits for the
+                    # running ones, and runs in order
+                    if running:
+                        break
+                    node = pending[0]
+                pending.remove(node)
+                logger.debug("Calling %s() of [%s]", method, node.name)
+                running[pool.submit(getattr(node, method))] = node
+            if not running:
+                break
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                node = running.pop(future)
+                done.add(node.name)
+                try:
+                    future.result()
+                except Exception as e:
+                    if error is None:
+                        error = e
+    if error is not None:
+        raise error
+
+
 class BlockDeviceState(collections.abc.MutableMapping):
     """The global state singleton
 
@@ -93,6 +191,10 @@ class BlockDeviceState(collections.abc.MutableMapping):
     def __len__(self):
         return len(self.state)
 
+    def setdefault(self, key, default=None):
+        # atomic, for nodes running in parallel
+        return self.state.setdefault(key, default)
+
     def save_state(self, filename):
         """Persist the state to disk
 
@@ -134,7 +236,9 @@ class BlockDevice(object):
        device is set up, filesystems are created and are mounted at
        the correct position.
        After this call it is possible to copy / install all the needed
-       files into the appropriate directories.
+       files into the appropriate directories.  If the 'populate-from'
+       parameter is set, the file systems are already filled from
+       that tree (ext file systems by mkfs itself).
 
     cmd_writefstab: creates the (complete) fstab for the system.
 
@@ -239,6 +343,12 @@ class BlockDevice(object):
             = os.path.join(self.state_dir, "config.json")
         self.node_pickle_file_name \
             = os.path.join(self.state_dir, "nodes.pickle")
+        self.edges_json_file_name \
+            = os.path.join(self.state_dir, "edges.json")
+
+        # Number of nodes to run at the same time
+        self.workers = int(os.environ.get('DIB_BLOCK_DEVICE_WORKERS',
+                                          os.cpu_count() or 1))
 
         self.config = _load_json(self.config_json_file_name)
 
@@ -290,31 +400,34 @@ class BlockDevice(object):
                     return v
         assert False
 
-    def cmd_getval(self, symbol):
-        """Retrieve value from block device level
+    def _split_populate_tree(self):
+        mounts = []
+        for entry in self.config:
+            for k, v in entry.items():
+                if k == 'mount':
+                    mounts.append((v['mount_point'], v['base']))
+        return split_populate_tree(
+            self.params['populate-from'],
+            os.path.join(self.params['build-dir'], 'populate'),
+            mounts)
 
-        The value of SYMBOL is printed to stdout.  This is intended to
-        be captured into bash-variables for backward compatibility
-        (non python) access to internal configuration.
+    def _getval(self, symbol, state):
+        """Return the value of SYMBOL, None if it is not known
 
-        Arguments:
-        :param symbol: the symbol to get
+        :param state: callable returning the state dumped by
+          cmd_create()
         """
-        logger.info("Getting value for [%s]", symbol)
-
         if symbol == "root-label":
             root_mount = self._config_get_mount("/")
             root_fs = self._config_get_mkfs(root_mount['base'])
             logger.debug("root-label [%s]", root_fs['label'])
-            print("%s" % root_fs['label'])
-            return 0
+            return "%s" % root_fs['label']
 
         if symbol == "root-fstype":
             root_mount = self._config_get_mount("/")
             root_fs = self._config_get_mkfs(root_mount['base'])
             logger.debug("root-fstype [%s]", root_fs['type'])
-            print("%s" % root_fs['type'])
-            return 0
+            return "%s" % root_fs['type']
 
         if symbol == "boot-label":
             try:
@@ -327,44 +440,70 @@ class BlockDevice(object):
             except AssertionError:
                 boot_label = ''
             logger.debug("boot-label [%s]", boot_label)
-            print("%s" % boot_label)
-            return 0
+            return "%s" % boot_label
 
         if symbol == 'mount-points':
             mount_points = self._config_get_all_mount_points()
             # we return the mountpoints joined by a pipe, because it is not
             # a valid char in directories, so it is a safe separator for the
             # mountpoints list
-            print("%s" % "|".join(mount_points))
-            return 0
+            return "%s" % "|".join(mount_points)
 
         # the following symbols all come from the global state
         # dictionary.  They can only be accessed after the state has
         # been dumped; i.e. after cmd_create() called.
-        state = BlockDeviceState(self.state_json_file_name)
 
         # The path to the .raw file for conversion
         if symbol == 'image-path':
-            print("%s" % state['blockdev']['image0']['image'])
-            return 0
+            return "%s" % state()['blockdev']['image0']['image']
 
         # This is the loopback device where the above image is setup
         if symbol == 'image-block-device':
-            print("%s" % state['blockdev']['image0']['device'])
-            return 0
+            return "%s" % state()['blockdev']['image0']['device']
 
         # Full list of created devices by name.  Some bootloaders, for
         # example, want to be able to see their boot partitions to
         # copy things in.  Intended to be read into a bash array
         if symbol == 'image-block-devices':
             out = ""
-            for k, v in state['blockdev'].items():
+            for k, v in state()['blockdev'].items():
                 out += " [%s]=%s " % (k, v['device'])
-            print(out)
-            return 0
+            return out
+
+        return None
 
-        logger.error("Invalid symbol [%s] for getval", symbol)
-        return 1
+    def cmd_getval(self, *symbols):
+        """Retrieve values from block device level
+
+        The value of each SYMBOL is printed to stdout, one per line in
+        the order given.  This is intended to be captured into
+        bash-variables for backward compatibility (non python) access
+        to internal configuration.
+
+        Arguments:
+        :param symbols: the symbols to get
+        """
+        logger.info("Getting value for %s", ", ".join(
+            "[%s]" % s for s in symbols))
+
+        loaded = []
+
+        def state():
+            if not loaded:
+                loaded.append(BlockDeviceState(self.state_json_file_name))
+            return loaded[0]
+
+        values = []
+        for symbol in symbols:
+            value = self._getval(symbol, state)
+            if value is None:
+                logger.error("Invalid symbol [%s] for getval", symbol)
+                return 1
+            values.append(value)
+
+        for value in values:
+            print(value)
+        return 0
 
     def cmd_writefstab(self):
         """Creates the fstab"""
@@ -401,7 +540,12 @@ class BlockDevice(object):
                                % (diskid, mp, fs_val['fstype'],
                                   options, dump_freq, fsck_passno))
 
-        target_etc_dir = os.path.join(self.params['build-dir'], 'built', 'etc')
+        if 'populate' in state:
+            # the tree has already been written to the file systems
+            target_etc_dir = os.path.join(self.params['mount-base'], 'etc')
+        else:
+            target_etc_dir = os.path.join(self.params['build-dir'],
+                                          'built', 'etc')
         exec_sudo(['mkdir', '-p', target_etc_dir])
         exec_sudo(['cp', tmp_fstab, os.path.join(target_etc_dir, "fstab")])
 
@@ -417,8 +561,9 @@ class BlockDevice(object):
         state = BlockDeviceState()
         try:
             dg, call_order = create_graph(self.config, self.params, state)
-            for node in call_order:
-                node.create()
+            if 'populate-from' in self.params:
+                state['populate'] = self._split_populate_tree()
+            run_nodes(call_order, dg.edges(), 'create', self.workers)
         except Exception:
             logger.exception("Create failed; rollback initiated")
             reverse_order = reversed(call_order)
@@ -435,10 +580,25 @@ class BlockDevice(object):
         #      at this stage.  might they?
         state.save_state(self.state_json_file_name)
         pickle.dump(call_order, open(self.node_pickle_file_name, 'wb'))
+        with open(self.edges_json_file_name, "w") as fd:
+            json.dump(list(dg.edges()), fd)
 
         logger.info("create() finished")
         return 0
 
+    def _run_reverse(self, call_order, method):
+        """Call a method of the nodes in reverse order of creation"""
+        edges = _load_json(self.edges_json_file_name)
+        if edges is None:
+            # without the graph only one after the other
+            workers = 1
+            edges = []
+        else:
+            workers = self.workers
+        run_nodes(list(reversed(call_order)),
+                  [(edge_to, edge_from) for edge_from, edge_to in edges],
+                  method, workers)
+
     def cmd_umount(self):
         """Unmounts the blockdevice and cleanup resources"""
 
@@ -450,10 +610,7 @@ class BlockDevice(object):
             return 0
 
         call_order = pickle.load(open(self.node_pickle_file_name, 'rb'))
-        reverse_order = reversed(call_order)
-
-        for node in reverse_order:
-            node.umount()
+        self._run_reverse(call_order, 'umount')
 
         return 0
 
@@ -466,10 +623,7 @@ class BlockDevice(object):
         except IOError:
             raise BlockDeviceSetupException("Pickle file not found")
 
-        reverse_order = reversed(call_order)
-
-        for node in reverse_order:
-            node.cleanup()
+        self._run_reverse(call_order, 'cleanup')
 
         logger.info("Removing temporary state dir [%s]", self.state_dir)
         shutil.rmtree(self.state_dir)
@@ -484,10 +638,7 @@ class BlockDevice(object):
             call_order = pickle.load(open(self.node_pickle_file_name, 'rb'))
         except IOError:
             raise BlockDeviceSetupException("Pickle file not found")
-        reverse_order = reversed(call_order)
-
-        for node in reverse_order:
-            node.delete()
+        self._run_reverse(call_order, 'delete')
 
         logger.info("Removing temporary state dir [%s]", self.state_dir)
         shutil.rmtree(self.state_dir)
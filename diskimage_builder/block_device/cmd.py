@@ -13,24 +13,89 @@
 # under the License.
 
 import argparse
+import contextlib
+import io
+import json
 import logging
 import os
+import socket
 import sys
 import yaml
 
-from diskimage_builder.block_device.blockdevice import BlockDevice
+from diskimage_builder.block_device.utils import start_sudo_helper
+from diskimage_builder.block_device.utils import stop_sudo_helper
 from diskimage_builder import logging_config
 
 logger = logging.getLogger(__name__)
 
+# How often the server checks that the process that started it (the
+# build script) is still there, in seconds
+SERVER_POLL_INTERVAL = 5
+
+
+def _recv_line(conn):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _command(argv):
+    """The sub-command of a command line"""
+    args = iter(argv)
+    for arg in args:
+        if arg == '--params':
+            next(args, None)
+        elif not arg.startswith('-'):
+            return arg
+    return None
+
+
+def call_server(socket_path, argv):
+    """Run a dib-block-device command in the server
+
+    :param socket_path: the socket of the server
+    :param argv: the command line arguments
+    :return: (return code, stdout of the command), or None if the
+             server is not running
+    """
+    request = {'argv': argv, 'env': dict(os.environ)}
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            conn.connect(socket_path)
+        except OSError:
+            return None
+        # The command may have been started; it must not be run again
+        # if the server goes away.
+        try:
+            conn.sendall(json.dumps(request).encode() + b'\n')
+            response = _recv_line(conn)
+        except OSError as e:
+            logger.error("Block device server failed: %s", e)
+            return 1, ''
+    finally:
+        conn.close()
+    if not response:
+        logger.error("Block device server exited")
+        return 1, ''
+    response = json.loads(response.decode())
+    return response['returncode'], response['stdout']
+
 
 class BlockDeviceCmd(object):
 
+    def __init__(self):
+        self.bd = None
+
     def cmd_init(self):
         self.bd.cmd_init()
 
     def cmd_getval(self):
-        self.bd.cmd_getval(self.args.symbol)
+        return self.bd.cmd_getval(*self.args.symbol)
 
     def cmd_create(self):
         self.bd.cmd_create()
@@ -47,9 +112,7 @@ class BlockDeviceCmd(object):
     def cmd_writefstab(self):
         self.bd.cmd_writefstab()
 
-    def main(self):
-        logging_config.setup()
-
+    def _parser(self):
         parser = argparse.ArgumentParser(description="DIB Block Device helper")
         parser.add_argument('--params', required=False,
                             help="YAML file containing parameters for "
@@ -69,29 +132,40 @@ class BlockDeviceCmd(object):
                                            help='Retrieve information about '
                                            'internal state')
         cmd_getval.set_defaults(func=self.cmd_getval)
-        cmd_getval.add_argument('symbol', help='symbol to print')
+        cmd_getval.add_argument('symbol', nargs='+',
+                                help='symbols to print, one per line')
 
         cmd_create = subparsers.add_parser('create',
                                            help='Create the block device')
-        cmd_create.set_defaults(func=self.cmd_create)
+        cmd_create.set_defaults(func=self.cmd_create, sudo=True)
 
         cmd_umount = subparsers.add_parser('umount',
                                            help='Unmount blockdevice and '
                                            'cleanup resources')
-        cmd_umount.set_defaults(func=self.cmd_umount)
+        cmd_umount.set_defaults(func=self.cmd_umount, sudo=True)
 
         cmd_cleanup = subparsers.add_parser('cleanup', help='Final cleanup')
-        cmd_cleanup.set_defaults(func=self.cmd_cleanup)
+        cmd_cleanup.set_defaults(func=self.cmd_cleanup, sudo=True)
 
         cmd_delete = subparsers.add_parser('delete', help='Error cleanup')
-        cmd_delete.set_defaults(func=self.cmd_delete)
+        cmd_delete.set_defaults(func=self.cmd_delete, sudo=True)
 
         cmd_writefstab = subparsers.add_parser('writefstab',
                                                help='Create fstab for system')
         cmd_writefstab.set_defaults(func=self.cmd_writefstab)
 
-        self.args = parser.parse_args()
+        cmd_serve = subparsers.add_parser(
+            'serve', help='Run the commands given over the socket '
+            'DIB_BLOCK_DEVICE_SOCKET in one long-lived process')
+        cmd_serve.set_defaults(func=None)
+
+        cmd_shutdown = subparsers.add_parser(
+            'shutdown', help='Stop the server started with "serve"')
+        cmd_shutdown.set_defaults(func=None)
+
+        return parser
 
+    def _load_params(self, parser):
         # Find, open and parse the parameters file
         if not self.args.params:
             if 'DIB_BLOCK_DEVICE_PARAMS_YAML' in os.environ:
@@ -109,10 +183,161 @@ class BlockDeviceCmd(object):
             logger.exception("Failed to open parameter YAML")
             sys.exit(1)
 
-        # Setup main BlockDevice object from args
-        self.bd = BlockDevice(self.params)
+    def run(self, argv, server=False):
+        """Run a command
+
+        :param argv: the command line arguments
+        :param server: keep the BlockDevice object and the sudo
+          helper between the calls; a new BlockDevice is only set up
+          by "init" or if the parameters change
+        :return: the exit code
+        """
+        # Only imported here, so calls forwarded to the server do not
+        # need to load the graph libraries.
+        from diskimage_builder.block_device.blockdevice import BlockDevice
+
+        parser = self._parser()
+        self.args = parser.parse_args(argv)
+
+        self._load_params(parser)
+        if self.bd is None or self.args.command == 'init' or \
+           self.params != self.bd.params:
+            # Setup main BlockDevice object from args
+            self.bd = BlockDevice(self.params)
+
+        # The commands running many privileged commands use a single
+        # sudo helper process for all of them
+        if getattr(self.args, 'sudo', False) and \
+           os.environ.get('DIB_BLOCK_DEVICE_SUDO_HELPER', '1') == '1':
+            start_sudo_helper()
+        try:
+            return self.args.func() or 0
+        finally:
+            if not server:
+                stop_sudo_helper()
+
+    def _serve_request(self, conn):
+        request = json.loads(_recv_line(conn).decode())
+        argv = request['argv']
+        if _command(argv) == 'shutdown':
+            conn.sendall(json.dumps({'returncode': 0,
+                                     'stdout': ''}).encode() + b'\n')
+            return False
+
+        # The nodes read some settings from the environment of the
+        # call (e.g. DIB_BLOCK_SIZE)
+        environ = dict(os.environ)
+        os.environ.clear()
+        os.environ.update(request['env'])
+        stdout = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(stdout):
+                returncode = self.run(argv, server=True)
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            logger.exception("Command [%s] failed", " ".join(argv))
+            returncode = 1
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+        conn.sendall(json.dumps({'returncode': returncode,
+                                 'stdout': stdout.getvalue()}).encode()
+                     + b'\n')
+        return True
+
+    def serve(self, socket_path):
+        """Answer commands over a Unix socket
+
+        The socket is listening when this returns in the parent; the
+        server continues in a child process until it is sent
+        "shutdown", or the calling process goes away.
+        """
+        # Load everything before forking, so a broken installation
+        # fails here.
+        from diskimage_builder.block_device.blockdevice \
+            import BlockDevice  # noqa: F401
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(socket_path)
+        except OSError as e:
+            logger.error("Can not listen on [%s]: %s", socket_path, e)
+            return 1
+        listener.listen(4)
+        caller = os.getppid()
+
+        if os.fork():
+            listener.close()
+            return 0
+
+        # Do not hold the output pipe of a $(...) in the caller open
+        devnull = os.open(os.devnull, os.O_RDWR)
+        os.dup2(devnull, 0)
+        os.dup2(devnull, 1)
+        os.close(devnull)
+        os.setsid()
+        listener.settimeout(SERVER_POLL_INTERVAL)
+        logger.info("Block device server listening on [%s]", socket_path)
+        try:
+            while True:
+                try:
+                    conn, _ = listener.accept()
+                except socket.timeout:
+                    try:
+                        os.kill(caller, 0)
+                    except OSError:
+                        logger.warning("Caller gone, stopping block device "
+                                       "server")
+                        break
+                    continue
+                with conn:
+                    conn.settimeout(None)
+                    try:
+                        if not self._serve_request(conn):
+                            break
+                    except Exception:
+                        logger.exception("Bad block device server request")
+        finally:
+            listener.close()
+            os.unlink(socket_path)
+            stop_sudo_helper()
+        os._exit(0)
+
+    def main(self, argv=None):
+        if argv is None:
+            argv = sys.argv[1:]
+        socket_path = os.environ.get('DIB_BLOCK_DEVICE_SOCKET')
+
+        command = _command(argv)
+
+        # Hand the command to a running server; this avoids the
+        # startup of a new process loading the configuration, graph
+        # and plugins for every call.
+        if socket_path and command != 'serve':
+            result = call_server(socket_path, argv)
+            if result is not None:
+                returncode, stdout = result
+                sys.stdout.write(stdout)
+                sys.stdout.flush()
+                return returncode
+            if command == 'shutdown':
+                return 0
+            # fall back to running it here
+
+        logging_config.setup()
+
+        if command == 'serve':
+            if not socket_path:
+                logger.error("DIB_BLOCK_DEVICE_SOCKET not set")
+                return 1
+            return self.serve(socket_path)
+        if command == 'shutdown':
+            return 0
 
-        self.args.func()
+        return self.run(argv)
 
 
 def main():
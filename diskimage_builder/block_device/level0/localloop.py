@@ -38,16 +38,18 @@ def image_delete(filename):
     os.remove(filename)
 
 
-def loopdev_attach(filename, block_size):
+def loopdev_attach(filename, block_size, partscan=False):
     if str(block_size) not in ['512', '4096']:
         logger.warning("Block device size is set to %s, only 512 and "
                        "4096 has been tested.", block_size)
     logger.info("loopdev attach")
-    log_msg = ("Calling [sudo losetup --sector-size %s --show -f %s]"
-               % (str(block_size), filename))
-    logger.debug(log_msg)
-    block_device = exec_sudo(["losetup", "--sector-size", str(block_size),
-                              "--show", "-f", filename])
+    cmd = ["losetup", "--sector-size", str(block_size)]
+    if partscan:
+        # let the kernel create the partition devices (/dev/loopXpN)
+        cmd.append("--partscan")
+    cmd.extend(["--show", "-f", filename])
+    logger.debug("Calling [sudo %s]", " ".join(cmd))
+    block_device = exec_sudo(cmd)
     # [:-1]: Cut of the newline
     block_device = block_device[:-1]
     logger.info("New block device [%s]", block_device)
@@ -97,6 +99,17 @@ class LocalLoopNode(NodeBase):
             self.block_size = config['block_size']
         else:
             self.block_size = 512
+        # Use the kernel partition scanning of the loop device rather
+        # than kpartx (see Partitioning.create())
+        if 'DIB_LOOP_PARTSCAN' in os.environ:
+            self.partscan = os.environ['DIB_LOOP_PARTSCAN'] == '1'
+        else:
+            self.partscan = bool(config.get('partscan', False))
+        if self.partscan and os.path.exists("/.dockerenv"):
+            # The partition device nodes are created by udev, which
+            # is not working inside Docker.
+            logger.info("Not using loop partition scanning in Docker")
+            self.partscan = False
         self.filename = os.path.join(self.image_dir, self.name + ".raw")
 
     def get_edges(self):
@@ -110,14 +123,18 @@ class LocalLoopNode(NodeBase):
         self.add_rollback(image_delete, self.filename)
         image_create(self.filename, self.size)
 
-        block_device = loopdev_attach(self.filename, self.block_size)
+        block_device = loopdev_attach(self.filename, self.block_size,
+                                      self.partscan)
         self.add_rollback(loopdev_detach, block_device)
 
         if 'blockdev' not in self.state:
             self.state['blockdev'] = {}
 
         self.state['blockdev'][self.name] = {"device": block_device,
-                                             "image": self.filename}
+                                             "image": self.filename,
+                                             "block_size":
+                                             int(self.block_size),
+                                             "partscan": self.partscan}
         logger.debug("Created loop  name [%s] device [%s] image [%s]",
                      self.name, block_device, self.filename)
         return
@@ -0,0 +1,234 @@
+# Copyright 2026 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+import os
+import uuid
+import zlib
+
+from struct import pack
+
+from diskimage_builder.block_device.exception import \
+    BlockDeviceSetupException
+
+
+logger = logging.getLogger(__name__)
+
+
+# Partition types by the two byte codes used by sgdisk (and
+# previously passed straight to it).  A full type GUID can be given
+# instead.
+GPT_TYPE_CODES = {
+    '0700': 'EBD0A0A2-B9E5-4433-87C0-68B6B72699C7',  # Microsoft basic data
+    '0C01': 'E3C9E316-0B5C-4DB8-817D-F92DF00215AE',  # Microsoft reserved
+    '4100': '9E1A2D38-C612-4316-AA26-8B49521E5A8B',  # PowerPC PReP boot
+    '8200': '0657FD6D-A4AB-43C4-84E5-0933C84B4F4F',  # Linux swap
+    '8300': '0FC63DAF-8483-4772-8E79-3D69D8477DE4',  # Linux filesystem
+    '8301': '8DA63339-0007-60C0-C436-083AC8230908',  # Linux reserved
+    '8302': '933AC7E1-2EB4-4F13-B844-0E14E2AEF915',  # Linux /home
+    '8303': '44479540-F297-41B2-9AF7-D131D5F0458A',  # Linux x86 root
+    '8304': '4F68BCE3-E8CD-4DB1-96E7-FBCAF984B709',  # Linux x86-64 root
+    '8305': 'B921B045-1DF0-41C3-AF44-4C6F280D3FAE',  # Linux ARM64 root
+    '8306': '3B8F8425-20E0-4F3B-907F-1A25A76F98E8',  # Linux /srv
+    '8307': '69DAD710-2CE4-4E3C-B16C-21A1D49ABED3',  # Linux ARM32 root
+    '8308': '7FFEC5C9-2D00-49B7-8941-3EA10A5586B7',  # Linux dm-crypt
+    '8309': 'CA7D7CCB-63ED-4C53-861C-1742536059CC',  # Linux LUKS
+    '8E00': 'E6D6D379-F507-44C2-A23C-238F2A3DF928',  # Linux LVM
+    'EA00': 'BC13C2FF-59E6-4262-A352-B275FD6F7172',  # Linux extended boot
+    'EF00': 'C12A7328-F81F-11D2-BA4B-00A0C93EC93B',  # EFI system
+    'EF01': '024DEE41-33E7-11D3-9D69-0008C781F39F',  # MBR partition scheme
+    'EF02': '21686148-6449-6E6F-744E-656564454649',  # BIOS boot
+    'FD00': 'A19D880F-05FC-4D3B-A006-743F0F84911E',  # Linux RAID
+}
+
+
+def gpt_type_guid(ptype):
+    """Return the type GUID for a sgdisk type code or GUID string"""
+    code = str(ptype).upper()
+    if code.startswith('0X'):
+        code = code[2:]
+    if code in GPT_TYPE_CODES:
+        return uuid.UUID(GPT_TYPE_CODES[code])
+    try:
+        return uuid.UUID(str(ptype))
+    except ValueError:
+        raise BlockDeviceSetupException(
+            "Unknown GPT partition type [%s]" % ptype)
+
+
+class GPT(object):
+    """GPT Disk / Partition Table Layout
+
+    The counterpart of :class:`MBR` for GUID partition tables: the
+    partition table is written directly into the image file, no
+    partitioning tool (or root privileges) are needed.
+
+    The layout is the same sgdisk creates by default:
+
+    ============== ==========================================
+    LBA             Description
+    ============== ==========================================
+     0              Protective MBR
+     1              Primary GPT header
+     2 ...          Partition entries (128 entries * 128 bytes)
+     (aligned)      Partitions
+     -33 (-5)       Backup partition entries
+     -1             Backup GPT header
+    ============== ==========================================
+
+    (the backup entries start 33 blocks before the end with 512 byte
+    sectors, 5 blocks with 4096 byte sectors).  Partitions are placed
+    one after another, each starting at the next multiple of the
+    alignment.
+
+    The table is written when the context is left.
+    """
+
+    signature = b'EFI PART'
+    revision = 0x00010000
+    header_size = 92
+    number_of_entries = 128
+    entry_size = 128
+    MBR_offset_first_partition_table_entry = 446
+    MBR_offset_signature = 510
+    MBR_partition_type_protective = 0xEE
+    MBR_signature = 0xAA55
+
+    def __init__(self, name, disk_size, alignment, sector_size=512):
+        """Initialize a disk partitioning GPT object.
+
+        The name is the (existing) name of the disk image.  The
+        disk_size is the (used) size of the disk; it must be a
+        multiple of the sector_size, which can be 512 or 4096.
+        """
+        logger.info("Create GPT disk partitioning object")
+
+        if sector_size not in (512, 4096):
+            raise BlockDeviceSetupException(
+                "Unsupported sector size [%s]" % sector_size)
+        assert disk_size % sector_size == 0
+
+        self.name = name
+        self.sector_size = sector_size
+        self.disk_size = disk_size
+        self.disk_size_in_blocks = disk_size // sector_size
+        self.alignment_blocks = max(1, alignment // sector_size)
+
+        self.entries_blocks = (GPT.number_of_entries * GPT.entry_size
+                               + sector_size - 1) // sector_size
+        self.first_usable = 2 + self.entries_blocks
+        self.last_usable = self.disk_size_in_blocks - 2 - self.entries_blocks
+
+        self.disk_guid = uuid.uuid4()
+        self.partitions = []
+        self.next_free = self.align(self.first_usable)
+
+    def __enter__(self):
+        # Open existing file for writing (r+)
+        self.image_fd = open(self.name, "r+b")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.write()
+        self.image_fd.flush()
+        os.fsync(self.image_fd.fileno())
+        self.image_fd.close()
+
+    def align(self, blockno):
+        """Align the blockno to next alignment count"""
+        return -(-blockno // self.alignment_blocks) * self.alignment_blocks
+
+    def free(self):
+        """Returns the free (not yet partitioned) size"""
+        return max(0, self.last_usable + 1 - self.next_free) \
+            * self.sector_size
+
+    def add_partition(self, name, size, ptype):
+        """Adds a partition with the given name, size and type
+
+        The size is rounded down to the alignment.
+
+        :return: the partition number
+        """
+        if len(self.partitions) == GPT.number_of_entries:
+            raise BlockDeviceSetupException("Too many GPT partitions")
+        if len(name) > 36:
+            raise BlockDeviceSetupException(
+                "GPT partition name [%s] longer than 36 characters" % name)
+        type_guid = gpt_type_guid(ptype)
+
+        blocks = size // self.sector_size
+        if blocks > self.alignment_blocks:
+            blocks -= blocks % self.alignment_blocks
+        first = self.next_free
+        last = first + blocks - 1
+        if blocks <= 0 or last > self.last_usable:
+            raise BlockDeviceSetupException(
+                "Partition [%s] of size [%d] does not fit on the disk"
+                % (name, size))
+
+        logger.info("Add partition [%s] start [%d] end [%d] type [%s]",
+                    name, first, last, type_guid)
+        self.partitions.append((type_guid, uuid.uuid4(), first, last, name))
+        self.next_free = self.align(last + 1)
+        return len(self.partitions)
+
+    def _entries(self):
+        entries = b''
+        for type_guid, part_guid, first, last, name in self.partitions:
+            entries += pack("<16s16sQQQ72s", type_guid.bytes_le,
+                            part_guid.bytes_le, first, last, 0,
+                            name.encode('utf-16-le'))
+        return entries.ljust(GPT.number_of_entries * GPT.entry_size,
+                             b'\0')
+
+    def _header(self, my_lba, alternate_lba, entries_lba, entries_crc):
+        def header(crc):
+            return pack("<8sIIIIQQQQ16sQIII", GPT.signature, GPT.revision,
+                        GPT.header_size, crc, 0, my_lba, alternate_lba,
+                        self.first_usable, self.last_usable,
+                        self.disk_guid.bytes_le, entries_lba,
+                        GPT.number_of_entries, GPT.entry_size, entries_crc)
+        crc = zlib.crc32(header(0)) & 0xFFFFFFFF
+        return header(crc).ljust(self.sector_size, b'\0')
+
+    def _protective_mbr(self):
+        size = min(self.disk_size_in_blocks - 1, 0xFFFFFFFF)
+        entry = pack("<B3sB3sII", 0, b'\x00\x02\x00',
+                     GPT.MBR_partition_type_protective, b'\xff\xff\xff',
+                     1, size)
+        mbr = b'\0' * GPT.MBR_offset_first_partition_table_entry + entry
+        mbr = mbr.ljust(GPT.MBR_offset_signature, b'\0')
+        mbr += pack("<H", GPT.MBR_signature)
+        return mbr.ljust(self.sector_size, b'\0')
+
+    def write(self):
+        """Write protective MBR, both headers and entry arrays"""
+        entries = self._entries()
+        entries_crc = zlib.crc32(entries) & 0xFFFFFFFF
+        last_lba = self.disk_size_in_blocks - 1
+        backup_entries_lba = last_lba - self.entries_blocks
+
+        blocks = [
+            (0, self._protective_mbr()),
+            (1, self._header(1, last_lba, 2, entries_crc)),
+            (2, entries),
+            (backup_entries_lba, entries),
+            (last_lba, self._header(last_lba, 1, backup_entries_lba,
+                                    entries_crc)),
+        ]
+        for lba, data in blocks:
+            self.image_fd.seek(lba * self.sector_size)
+            self.image_fd.write(data)
@@ -17,6 +17,7 @@ import os
 
 from diskimage_builder.block_device.exception import \
     BlockDeviceSetupException
+from diskimage_builder.block_device.level1.gpt import GPT
 from diskimage_builder.block_device.level1.mbr import MBR
 from diskimage_builder.block_device.level1.partition import PartitionNode
 from diskimage_builder.block_device.plugin import PluginBase
@@ -93,6 +94,25 @@ class Partitioning(PluginBase):
             fd.seek(0, 2)
             return fd.tell()
 
+    def _add_partition_device(self, part, part_no):
+        """Fill the state with the device of a partition
+
+        With kpartx (see create() below) the device this partition
+        will be seen at becomes "/dev/mapper/loop0pX"; with the
+        partition scanning of the loop device it is "/dev/loop0pX".
+        """
+        assert self.device_path[:5] == "/dev/"
+        device_name = "%sp%d" % (self.device_path[5:], part_no)
+        if self.partscan:
+            device_path = "/dev/%s" % device_name
+        else:
+            device_path = "/dev/mapper/%s" % device_name
+            part.add_rollback(remove_device, device_name)
+        self.state['blockdev'][part.get_name()] = {'device': device_path}
+        if part_no > self.last_part_no:
+            self.last_part_no = part_no
+            self.last_part_device = device_path
+
     def _create_mbr(self):
         """Create partitions with MBR"""
         # NOTE(TheJulia): This is funcitonally incompatible with block/sector
@@ -116,71 +136,33 @@ class Partitioning(PluginBase):
                 logger.debug("Create partition [%s] [%d]",
                              part_name, part_no)
 
-                # We're going to mount all partitions with kpartx
-                # below once we're done.  So the device this partition
-                # will be seen at becomes "/dev/mapper/loop0pX"
-                assert self.device_path[:5] == "/dev/"
-                device_name = "%sp%d" % (self.device_path[5:], part_no)
-                device_path = "/dev/mapper/%s" % device_name
-                self.state['blockdev'][part_name] \
-                    = {'device': device_path}
-                part_cfg.add_rollback(remove_device, device_name)
+                self._add_partition_device(part_cfg, part_no)
 
     def _create_gpt(self):
         """Create partitions with GPT"""
 
-        # Use the loopback via device_path, as using the file means the
-        # partitioning is exposed to sector sizing of the OS, not of the
-        # underlying "device" provided by the loopback.
-        cmd = ['sgdisk', self.device_path]
-
-        # This padding gives us a little room for rounding so we don't
-        # go over the end of the disk
-        disk_free = self.disk_size - (2048 * 1024)
-        pnum = 1
-
-        for p in self.partitions:
-            args = {}
-            args['pnum'] = pnum
-            args['name'] = '%s' % p.get_name()
-            args['type'] = '%s' % p.get_type()
-
-            # convert from a relative/string size to bytes
-            size = parse_rel_size_spec(p.get_size(), disk_free)[1]
-
-            # We keep track in bytes, but specify things to sgdisk in
-            # megabytes so it can align on sensible boundaries. And
-            # create partitions right after previous so no need to
-            # calculate start/end - just size.
-            if not size <= disk_free:
-                logger.error('The requested size of the image is smaller '
-                             'than the block device configuration.')
-            assert size <= disk_free
-            args['size'] = size // (1024 * 1024)
-
-            new_cmd = ("-n", "{pnum}:0:+{size}M".format(**args),
-                       "-t", "{pnum}:{type}".format(**args),
-                       # Careful with this one, as {name} could have spaces
-                       "-c", "{pnum}:{name}".format(**args))
-            cmd.extend(new_cmd)
-
-            # Fill the state; we mount all partitions with kpartx
-            # below once we're done.  So the device this partition
-            # will be seen at becomes "/dev/mapper/loop0pX"
-            assert self.device_path[:5] == "/dev/"
-            device_name = "%sp%d" % (self.device_path[5:], pnum)
-            device_path = "/dev/mapper/%s" % device_name
-            self.state['blockdev'][p.get_name()] \
-                = {'device': device_path}
-
-            disk_free = disk_free - size
-            pnum = pnum + 1
-            logger.debug("Partition %s added, %s remaining in disk",
-                         pnum, disk_free)
-            p.add_rollback(remove_device, device_name)
-
-        logger.debug("cmd: %s", ' '.join(cmd))
-        exec_sudo(cmd)
+        # The table is written for the sector size of the loop device
+        # the image is attached with, not the one of the host.
+        sector_size = self.state['blockdev'][self.base].get('block_size',
+                                                            512)
+        with GPT(self.image_path, self.disk_size, self.align,
+                 sector_size) as part_impl:
+            for p in self.partitions:
+                part_name = p.get_name()
+                part_free = part_impl.free()
+                logger.debug("Not partitioned space [%d]", part_free)
+                # convert from a relative/string size to bytes
+                size = parse_rel_size_spec(p.get_size(), part_free)[1]
+                if not size <= part_free:
+                    logger.error('The requested size of the image is '
+                                 'smaller than the block device '
+                                 'configuration.')
+                assert size <= part_free
+                pnum = part_impl.add_partition(part_name, size,
+                                               p.get_type())
+                logger.debug("Create partition [%s] [%d]", part_name, pnum)
+
+                self._add_partition_device(p, pnum)
 
     # not this is NOT a node and this is not called directly!  The
     # create() calls in the partition nodes this plugin has
@@ -201,6 +183,14 @@ class Partitioning(PluginBase):
         self.device_path = self.state['blockdev'][self.base]['device']
         # underlying size
         self.disk_size = self._size_of_block_dev(self.image_path)
+        # the kernel creates the partition devices
+        self.partscan = self.state['blockdev'][self.base].get('partscan',
+                                                              False)
+
+        # the highest numbered partition and its device, which the
+        # kernel creates last
+        self.last_part_no = 0
+        self.last_part_device = None
 
         logger.info("Creating partition on [%s] [%s]",
                     self.base, self.image_path)
@@ -215,9 +205,18 @@ class Partitioning(PluginBase):
         # "saftey sync" to make sure the partitions are written
         exec_sudo(["sync"])
 
-        # now all the partitions are created, get device-mapper to
-        # mount them
-        if not os.path.exists("/.dockerenv"):
+        # now all the partitions are created, get the kernel or
+        # device-mapper to map them
+        if self.partscan:
+            # The loop device was scanned (empty) when attached; have
+            # the kernel read the new table and wait for udev to
+            # create the partition devices.  Only wait for the last of
+            # them, a plain settle waits for the events of every other
+            # device on the host (e.g. concurrent builds) too.
+            exec_sudo(["blockdev", "--rereadpt", self.device_path])
+            exec_sudo(["udevadm", "settle",
+                       "--exit-if-exists=%s" % self.last_part_device])
+        elif not os.path.exists("/.dockerenv"):
             exec_sudo(["kpartx", "-uvs", self.device_path])
         else:
             # If running inside Docker, make our nodes manually,
@@ -236,6 +235,9 @@ class Partitioning(PluginBase):
         # we know this is the very last partition
         self.number_of_partitions -= 1
         if self.number_of_partitions == 0:
+            # The partitions of a scanned loop device go away with it
+            if self.state['blockdev'][self.base].get('partscan', False):
+                return
             exec_sudo(["kpartx", "-d",
                        self.state['blockdev'][self.base]['device']])
 
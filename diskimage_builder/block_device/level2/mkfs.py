@@ -40,6 +40,9 @@ file_system_max_label_length = {
 
 class FilesystemNode(NodeBase):
 
+    # file systems on different devices are created in parallel
+    parallel_safe = True
+
     def __init__(self, config, state):
         logger.debug("Create filesystem object; config [%s]", config)
         super(FilesystemNode, self).__init__(config['name'], state)
@@ -56,6 +59,10 @@ class FilesystemNode(NodeBase):
             setattr(self, pname,
                     config[pname] if pname in config else None)
 
+        # Fill the file system from the built tree when creating it
+        # (only possible for ext filesystems; see create())
+        self.populate = config.get('populate', True)
+
         if self.label is None:
             self.label = self.name
 
@@ -127,20 +134,29 @@ class FilesystemNode(NodeBase):
         if self.type in ('ext2', 'ext3', 'ext4', 'xfs'):
             cmd.append('-q')
 
-        if 'blockdev' not in self.state:
-            self.state['blockdev'] = {}
-        device = self.state['blockdev'][self.base]['device']
+        # If the block device layer was asked to populate the file
+        # systems, mke2fs can write the tree for this file system
+        # while creating it.  This saves mounting the empty file
+        # system and copying everything in through the loop device.
+        # Other file systems are filled by the mount point after
+        # mounting (see MountPointNode.create()).
+        populated = False
+        source = self.state.get('populate', {}).get(self.name)
+        if source and self.populate and \
+           self.type in ('ext2', 'ext3', 'ext4'):
+            cmd.extend(['-d', source])
+            populated = True
+
+        device = self.state.setdefault('blockdev', {})[self.base]['device']
         cmd.append(device)
 
         logger.debug("Creating fs command [%s]", cmd)
         exec_sudo(cmd)
 
-        if 'filesys' not in self.state:
-            self.state['filesys'] = {}
-        self.state['filesys'][self.name] \
+        self.state.setdefault('filesys', {})[self.name] \
             = {'uuid': self.uuid, 'label': self.label,
                'fstype': self.type, 'opts': self.opts,
-               'device': device}
+               'device': device, 'populated': populated}
 
 
 class Mkfs(PluginBase):
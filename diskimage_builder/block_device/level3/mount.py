@@ -87,6 +87,7 @@ class MountPointNode(NodeBase):
             logger.info("Mounting [%s] to [%s]", self.name, mount_point)
             exec_sudo(["mount", self.state['filesys'][self.base]['device'],
                       mount_point])
+            self._populate(mount_point)
 
         if 'mount' not in self.state:
             self.state['mount'] = {}
@@ -97,6 +98,20 @@ class MountPointNode(NodeBase):
             self.state['mount_order'] = []
         self.state['mount_order'].append(self.mount_point)
 
+    def _populate(self, mount_point):
+        """Fill the file system from its part of the built tree"""
+        source = self.state.get('populate', {}).get(self.base)
+        if not source:
+            return
+        if self.state['filesys'][self.base].get('populated'):
+            # mkfs wrote the content, but the root directory of the
+            # new file system needs the mode and owner of the source
+            exec_sudo(['chown', '--reference', source, mount_point])
+            exec_sudo(['chmod', '--reference', source, mount_point])
+        else:
+            logger.info("Copying [%s] to [%s]", source, mount_point)
+            exec_sudo(['cp', '-a', os.path.join(source, '.'), mount_point])
+
     def umount(self):
         if (self.state['filesys'][self.base]['fstype'] == 'swap'):
             # Swap not mounted/activated during image build.
@@ -22,6 +22,9 @@ logger = logging.getLogger(__name__)
 
 
 class FstabNode(NodeBase):
+
+    parallel_safe = True
+
     def __init__(self, config, state):
         super(FstabNode, self).__init__(config['name'], state)
         self.base = config['base']
@@ -37,13 +40,10 @@ class FstabNode(NodeBase):
     def create(self):
         logger.debug("fstab create called [%s]", self.name)
 
-        if 'fstab' not in self.state:
-            self.state['fstab'] = {}
-
         swap = 'none' in self.state['mount'] and \
             self.state['mount']['none']['name'] == self.base
 
-        self.state['fstab'][self.base] = {
+        self.state.setdefault('fstab', {})[self.base] = {
             'name': self.name,
             'base': self.base,
             'options': 'sw' if swap else self.options,
@@ -41,7 +41,16 @@ class NodeBase(object, metaclass=abc.ABCMeta):
            def __init__(name, arg1, ...):
                super(FooNode, self).__init__(name)
 
+    Nodes setting ``parallel_safe`` may have their methods called at
+    the same time as those of other such nodes, in different threads,
+    once the nodes they depend on are done.  They must only add their
+    own entries to the shared state (use ``state.setdefault()`` for
+    the top level dictionaries).  Other nodes are always called on
+    their own.
     """
+
+    parallel_safe = False
+
     def __init__(self, name, state):
         self.name = name
         self.state = state
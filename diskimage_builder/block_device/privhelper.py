@@ -0,0 +1,123 @@
+# Copyright 2026 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Privileged helper process for exec_sudo
+
+This is started once under sudo (see utils.SudoHelper) and runs the
+commands sent to it, so that not every command has to go through
+sudo (with its PAM session and audit logging) again.
+
+The protocol is JSON lines: a request on stdin is
+
+  {"id": 1, "cmds": [["mount", "/dev/loop0p1", "/mnt"], ...]}
+
+and the answer on stdout
+
+  {"id": 1, "results": [{"returncode": 0, "output": "...",
+                         "start": 1700000000.1, "stop": 1700000000.2,
+                         "rusage": {"utime": 0.01, ...}}, ...]}
+
+(start, stop and rusage are for the build trace, see
+diskimage_builder/trace.py).
+
+The commands of a request are run in order, stopping at the first
+one failing.  Requests are run concurrently, answers are written as
+they finish.  The first line written is {"ready": true}.
+
+This file is run as a script by the python of the caller; it must
+only use the standard library.
+"""
+
+import json
+import locale
+import os
+import subprocess
+import sys
+import threading
+import time
+
+
+def run_command(cmd):
+    """Run a command, with its times and resource usage"""
+    result = {'start': time.time()}
+    try:
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+    except OSError as e:
+        # what sudo does for a command it can not run
+        result.update({'returncode': 1, 'stop': time.time(),
+                       'output': "sudo: %s: %s\n" % (cmd[0], e.strerror)})
+        return result
+    with proc.stdout:
+        output = proc.stdout.read()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    result.update({
+        'returncode': proc.returncode,
+        'output': output.decode(
+            encoding=locale.getpreferredencoding(False),
+            errors='backslashreplace'),
+        'stop': time.time(),
+        'rusage': {'utime': rusage.ru_utime, 'stime': rusage.ru_stime,
+                   'maxrss': rusage.ru_maxrss,
+                   'inblock': rusage.ru_inblock,
+                   'oublock': rusage.ru_oublock},
+    })
+    return result
+
+
+def run_commands(cmds):
+    """Run a list of commands, stopping at the first failure"""
+    results = []
+    for cmd in cmds:
+        results.append(run_command(cmd))
+        if results[-1]['returncode']:
+            break
+    return results
+
+
+def main():
+    lock = threading.Lock()
+    out = sys.stdout
+
+    def reply(message):
+        with lock:
+            out.write(json.dumps(message) + "\n")
+            out.flush()
+
+    def handle(request):
+        reply({'id': request['id'],
+               'results': run_commands(request['cmds'])})
+
+    reply({'ready': True})
+    threads = []
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        thread = threading.Thread(target=handle, args=(json.loads(line),))
+        thread.start()
+        threads.append(thread)
+        threads = [t for t in threads if t.is_alive()]
+    # the caller closed the pipe; finish what is running
+    for thread in threads:
+        thread.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
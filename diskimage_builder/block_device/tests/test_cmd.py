@@ -0,0 +1,106 @@
+# Copyright 2026 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import io
+import os
+import subprocess
+import sys
+import time
+
+import fixtures
+
+import diskimage_builder.block_device.blockdevice as bd
+from diskimage_builder.block_device import cmd
+import diskimage_builder.block_device.tests.test_base as tb
+
+CONFIG = """\
+- local_loop:
+    name: image0
+
+- partitioning:
+    base: image0
+    label: mbr
+    partitions:
+      - name: root
+        size: 100%
+        mkfs:
+          name: mkfs_root
+          mount:
+            mount_point: /
+"""
+
+
+class TestBlockDeviceCmd(tb.TestBase):
+
+    def setUp(self):
+        super(TestBlockDeviceCmd, self).setUp()
+        self.build_dir = self.useFixture(fixtures.TempDir()).path
+        config = os.path.join(self.build_dir, "config.yaml")
+        with open(config, "w") as f:
+            f.write(CONFIG)
+        self.params = os.path.join(self.build_dir, "params.yaml")
+        with open(self.params, "w") as f:
+            f.write("config: %s\nbuild-dir: %s\nroot-fs-type: ext4\n"
+                    "root-label: null\n" % (config, self.build_dir))
+
+    def test_getval_multiple(self):
+        bd_obj = bd.BlockDevice({'build-dir': self.build_dir,
+                                 'config': os.path.join(self.build_dir,
+                                                        "config.yaml"),
+                                 'root-fs-type': 'ext4',
+                                 'root-label': None})
+        bd_obj.cmd_init()
+        stdout = self.useFixture(fixtures.StringStream('stdout')).stream
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', stdout))
+        self.assertEqual(0, bd_obj.cmd_getval('root-label', 'boot-label',
+                                              'root-fstype', 'mount-points'))
+        self.assertEqual(1, bd_obj.cmd_getval('root-label', 'nothing'))
+        stdout.seek(0)
+        self.assertEqual("cloudimg-rootfs\n\next4\n/\n", stdout.read())
+
+    def test_server(self):
+        socket_path = os.path.join(self.build_dir, "server.sock")
+        self.useFixture(fixtures.EnvironmentVariable(
+            'DIB_BLOCK_DEVICE_PARAMS_YAML', self.params))
+        self.useFixture(fixtures.EnvironmentVariable(
+            'DIB_BLOCK_DEVICE_SOCKET', socket_path))
+
+        # "serve" returns once the server is listening
+        subprocess.check_call([sys.executable, '-m',
+                               'diskimage_builder.block_device.cmd',
+                               'serve'])
+        self.addCleanup(cmd.call_server, socket_path, ['shutdown'])
+
+        self.assertEqual((0, ''), cmd.call_server(socket_path, ['init']))
+        self.assertEqual((0, 'cloudimg-rootfs\n/\n'),
+                         cmd.call_server(socket_path,
+                                         ['getval', 'root-label',
+                                          'mount-points']))
+        # argument errors of a single call do not stop the server
+        self.assertEqual((2, ''), cmd.call_server(socket_path, ['bad']))
+
+        # the client side forwards the calls
+        stdout = io.StringIO()
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', stdout))
+        self.assertEqual(
+            0, cmd.BlockDeviceCmd().main(['getval', 'root-fstype']))
+        self.assertEqual("ext4\n", stdout.getvalue())
+
+        self.assertEqual((0, ''), cmd.call_server(socket_path,
+                                                  ['shutdown']))
+        for i in range(50):
+            if not os.path.exists(socket_path):
+                break
+            time.sleep(0.1)
+        self.assertIsNone(cmd.call_server(socket_path, ['init']))
@@ -13,14 +13,21 @@
 import fixtures
 import logging
 import os
+import struct
+import subprocess
 from unittest import mock
+import uuid
+import zlib
 
 import diskimage_builder.block_device.tests.test_config as tc
 
 from diskimage_builder.block_device.blockdevice import BlockDeviceState
 from diskimage_builder.block_device.config import config_tree_to_graph
 from diskimage_builder.block_device.config import create_graph
+from diskimage_builder.block_device.exception import \
+    BlockDeviceSetupException
 from diskimage_builder.block_device.level0.localloop import image_create
+from diskimage_builder.block_device.level1.gpt import GPT
 from diskimage_builder.block_device.level1.partition import PartitionNode
 
 logger = logging.getLogger(__name__)
@@ -39,12 +46,8 @@ class TestGPT(tc.TestGraphGeneration):
         graph, call_order = create_graph(config, self.fake_default_config,
                                          state)
 
-        # Create a fake temp backing file (we check the size of it,
-        # etc).
-        # TODO(ianw): exec_sudo is generically mocked out, thus the
-        # actual creation is mocked out ... but we could do this
-        # without root and use parted to create the partitions on this
-        # for slightly better testing.  An exercise for another day...
+        # Create a temp backing file, the partition table is written
+        # into it.
         self.tmp_dir = fixtures.TempDir()
         self.useFixture(self.tmp_dir)
         self.image_path = os.path.join(self.tmp_dir.path, "image.raw")
@@ -62,19 +65,23 @@ class TestGPT(tc.TestGraphGeneration):
             if isinstance(node, PartitionNode):
                 node.create()
 
-        # check the parted call looks right
-        parted_cmd = ['sgdisk', '/dev/loopX',
-                      '-n', '1:0:+8M', '-t', '1:EF00', '-c', '1:ESP',
-                      '-n', '2:0:+8M', '-t', '2:EF02', '-c', '2:BSP',
-                      '-n', '3:0:+1006M', '-t', '3:8300', '-c', '3:Root Part']
+        # the partition table is written directly into the image
         cmd_sequence = [
-            mock.call(parted_cmd),
             mock.call(['sync']),
             mock.call(['kpartx', '-uvs', '/dev/loopX'])
         ]
         self.assertEqual(mock_exec_sudo.call_count, len(cmd_sequence))
         mock_exec_sudo.assert_has_calls(cmd_sequence)
 
+        output = subprocess.check_output(
+            ['partx', '--raw', '--output', 'NR,START,END,TYPE,NAME',
+             '-g', '-b', '-', self.image_path]).decode('ascii')
+        self.assertEqual(
+            "1 2048 18431 c12a7328-f81f-11d2-ba4b-00a0c93ec93b ESP\n"
+            "2 18432 34815 21686148-6449-6e6f-744e-656564454649 BSP\n"
+            "3 34816 2095103 0fc63daf-8483-4772-8e79-3d69d8477de4 "
+            "Root\\x20Part\n", output)
+
         # Check two new partitions appear in state correctly
         self.assertDictEqual(state['blockdev']['ESP'],
                              {'device': '/dev/mapper/loopXp1'})
@@ -82,3 +89,120 @@ class TestGPT(tc.TestGraphGeneration):
                              {'device': '/dev/mapper/loopXp2'})
         self.assertDictEqual(state['blockdev']['Root Part'],
                              {'device': '/dev/mapper/loopXp3'})
+
+
+class TestGPTTable(tc.TestGraphGeneration):
+
+    def setUp(self):
+        super(TestGPTTable, self).setUp()
+        self.tmp_dir = self.useFixture(fixtures.TempDir()).path
+        self.image_path = os.path.join(self.tmp_dir, "image.raw")
+        self.disk_size = 64 * 1024 * 1024
+        image_create(self.image_path, self.disk_size)
+
+    def _read_header(self, image, lba, sector_size):
+        image.seek(lba * sector_size)
+        raw = image.read(92)
+        fields = list(struct.unpack("<8sIIIIQQQQ16sQIII", raw))
+        crc = fields[3]
+        fields[3] = 0
+        self.assertEqual(
+            crc,
+            zlib.crc32(struct.pack("<8sIIIIQQQQ16sQIII", *fields))
+            & 0xFFFFFFFF)
+        return fields
+
+    def _check_table(self, sector_size):
+        with GPT(self.image_path, self.disk_size, 1024 * 1024,
+                 sector_size) as gpt:
+            self.assertEqual(1, gpt.add_partition('ESP', 8 * 1024 * 1024,
+                                                  'EF00'))
+            self.assertEqual(2, gpt.add_partition('root', gpt.free(),
+                                                  '0x8300'))
+
+        last_lba = self.disk_size // sector_size - 1
+        with open(self.image_path, 'rb') as image:
+            # protective MBR
+            image.seek(446)
+            entry = struct.unpack("<B3sB3sII", image.read(16))
+            self.assertEqual(0xEE, entry[2])
+            self.assertEqual((1, last_lba), entry[4:])
+            self.assertEqual(b'\x55\xaa', image.read(50)[-2:])
+
+            primary = self._read_header(image, 1, sector_size)
+            backup = self._read_header(image, last_lba, sector_size)
+            self.assertEqual(b'EFI PART', primary[0])
+            self.assertEqual((1, last_lba), tuple(primary[5:7]))
+            self.assertEqual((last_lba, 1), tuple(backup[5:7]))
+            # same disk GUID and entries in both
+            self.assertEqual(primary[9], backup[9])
+            self.assertEqual(primary[13], backup[13])
+
+            image.seek(backup[10] * sector_size)
+            entries = image.read(128 * 128)
+            self.assertEqual(primary[13],
+                             zlib.crc32(entries) & 0xFFFFFFFF)
+            type_guid, _, first, last, _, name = struct.unpack(
+                "<16s16sQQQ72s", entries[128:256])
+            self.assertEqual(
+                uuid.UUID('0fc63daf-8483-4772-8e79-3d69d8477de4'),
+                uuid.UUID(bytes_le=type_guid))
+            self.assertEqual('root',
+                             name.decode('utf-16-le').rstrip('\0'))
+            return first, last, primary[8]
+
+    def test_gpt_512(self):
+        first, last, last_usable = self._check_table(512)
+        self.assertEqual(2048 + 8 * 2048, first)
+        self.assertLessEqual(last, last_usable)
+        self.assertEqual(self.disk_size // 512 - 34, last_usable)
+
+    def test_gpt_4096(self):
+        first, last, last_usable = self._check_table(4096)
+        self.assertEqual(256 + 8 * 256, first)
+        self.assertLessEqual(last, last_usable)
+        self.assertEqual(self.disk_size // 4096 - 6, last_usable)
+
+    def test_gpt_bad_type(self):
+        with GPT(self.image_path, self.disk_size, 1024 * 1024) as gpt:
+            self.assertRaises(BlockDeviceSetupException,
+                              gpt.add_partition, 'data', 1024 * 1024,
+                              'XYZ')
+            self.assertRaises(BlockDeviceSetupException,
+                              gpt.add_partition, 'data',
+                              self.disk_size, '8300')
+
+    @mock.patch('diskimage_builder.block_device.level1.partitioning.exec_sudo')
+    def test_gpt_partscan(self, mock_exec_sudo):
+        # With a loop device attached with partition scanning the
+        # kernel creates the partition devices
+        tree = self.load_config_file('gpt_efi.yaml')
+        config = config_tree_to_graph(tree)
+        state = BlockDeviceState()
+        graph, call_order = create_graph(config, self.fake_default_config,
+                                         state)
+        image_path = os.path.join(self.tmp_dir, "partscan.raw")
+        image_create(image_path, 1024 * 1024 * 1024)
+        state['blockdev'] = {
+            'image0': {'image': image_path, 'device': '/dev/loopX',
+                       'partscan': True}}
+
+        partitions = [n for n in call_order if isinstance(n, PartitionNode)]
+        for node in partitions:
+            node.create()
+
+        self.assertEqual([mock.call(['sync']),
+                          mock.call(['blockdev', '--rereadpt', '/dev/loopX']),
+                          mock.call(['udevadm', 'settle',
+                                     '--exit-if-exists=/dev/loopXp3'])],
+                         mock_exec_sudo.call_args_list)
+        self.assertDictEqual(state['blockdev']['ESP'],
+                             {'device': '/dev/loopXp1'})
+        self.assertDictEqual(state['blockdev']['Root Part'],
+                             {'device': '/dev/loopXp3'})
+        # nothing to roll back or unmap, the partitions go away with
+        # the loop device
+        for node in partitions:
+            self.assertEqual([], node.rollbacks)
+            node.umount()
+        self.assertEqual(3, mock_exec_sudo.call_count)
@@ -11,12 +11,20 @@
 # under the License.
 
 import logging
+import os
+import subprocess
+from unittest import mock
+
+import fixtures
 
 import diskimage_builder.block_device.tests.test_config as tc
 
+from diskimage_builder.block_device.blockdevice import split_populate_tree
 from diskimage_builder.block_device.config import create_graph
 from diskimage_builder.block_device.exception import \
     BlockDeviceSetupException
+from diskimage_builder.block_device.level2.mkfs import FilesystemNode
+from diskimage_builder.block_device.level3.mount import MountPointNode
 
 
 logger = logging.getLogger(__name__)
@@ -41,3 +49,80 @@ class TestMkfs(tc.TestGraphGeneration):
                                "too long for filesystem",
                                create_graph, config,
                                self.fake_default_config, {})
+
+    @mock.patch('diskimage_builder.block_device.level3.mount.exec_sudo')
+    @mock.patch('diskimage_builder.block_device.level2.mkfs.exec_sudo')
+    def test_populate(self, mock_exec_sudo_mkfs, mock_exec_sudo_mount):
+        config = self.load_config_file('multiple_partitions_graph.yaml')
+        config[2]['mkfs']['type'] = 'ext4'
+        state = {}
+        graph, call_order = create_graph(config, self.fake_default_config,
+                                         state)
+        state['blockdev'] = {}
+        state['blockdev']['root'] = {'device': '/dev/loopXp1/root'}
+        state['blockdev']['var'] = {'device': '/dev/loopXp2/var'}
+        state['blockdev']['var_log'] = {'device': '/dev/loopXp3/var_log'}
+        state['blockdev']['swap'] = {'device': '/dev/loopXp4/swap'}
+        state['populate'] = {'mkfs_root': '/built',
+                             'mkfs_var': '/populate/mkfs_var',
+                             'mkfs_var_log': '/populate/mkfs_var_log'}
+
+        for node in call_order:
+            if isinstance(node, (FilesystemNode, MountPointNode)):
+                node.create()
+
+        # only the ext4 root is written by mkfs
+        mock_exec_sudo_mkfs.assert_any_call(
+            ['mkfs', '-t', 'ext4', '-L', 'mkfs_root',
+             '-U', 'root-uuid-1234', '-q', '-d', '/built',
+             '/dev/loopXp1/root'])
+        mock_exec_sudo_mkfs.assert_any_call(
+            ['mkfs', '-t', 'xfs', '-L', 'mkfs_var',
+             '-m', 'uuid=var-uuid-1234', '-q', '/dev/loopXp2/var'])
+        self.assertTrue(state['filesys']['mkfs_root']['populated'])
+        self.assertFalse(state['filesys']['mkfs_var']['populated'])
+
+        self.assertListEqual([
+            mock.call(['mkdir', '-p', '/fake/']),
+            mock.call(['mount', '/dev/loopXp1/root', '/fake/']),
+            mock.call(['chown', '--reference', '/built', '/fake/']),
+            mock.call(['chmod', '--reference', '/built', '/fake/']),
+            mock.call(['mkdir', '-p', '/fake/var']),
+            mock.call(['mount', '/dev/loopXp2/var', '/fake/var']),
+            mock.call(['cp', '-a', '/populate/mkfs_var/.', '/fake/var']),
+            mock.call(['mkdir', '-p', '/fake/var/log']),
+            mock.call(['mount', '/dev/loopXp3/var_log', '/fake/var/log']),
+            mock.call(['cp', '-a', '/populate/mkfs_var_log/.',
+                       '/fake/var/log']),
+        ], mock_exec_sudo_mount.call_args_list)
+
+    @mock.patch('diskimage_builder.block_device.blockdevice.exec_sudo',
+                side_effect=lambda cmd: subprocess.check_call(cmd))
+    def test_split_populate_tree(self, mock_exec_sudo):
+        tmp = self.useFixture(fixtures.TempDir()).path
+        built = os.path.join(tmp, 'built')
+        aside = os.path.join(tmp, 'populate')
+        os.makedirs(os.path.join(built, 'var', 'log', 'journal'))
+        os.makedirs(os.path.join(built, 'etc'))
+
+        sources = split_populate_tree(
+            built, aside,
+            [('/', 'mkfs_root'), ('/var', 'mkfs_var'),
+             ('/var/log', 'mkfs_var_log'), ('/boot', 'mkfs_boot'),
+             ('none', 'mkfs_swap')])
+
+        self.assertEqual({'mkfs_root': built,
+                          'mkfs_var': os.path.join(aside, 'mkfs_var'),
+                          'mkfs_var_log': os.path.join(aside,
+                                                       'mkfs_var_log'),
+                          'mkfs_boot': os.path.join(aside, 'mkfs_boot')},
+                         sources)
+        # each tree only has its own content, with empty directories
+        # left for the nested mount points
+        self.assertEqual(['boot', 'etc', 'var'], sorted(os.listdir(built)))
+        self.assertEqual([], os.listdir(os.path.join(built, 'var')))
+        self.assertEqual(['log'], os.listdir(sources['mkfs_var']))
+        self.assertEqual([], os.listdir(
+            os.path.join(sources['mkfs_var'], 'log')))
+        self.assertEqual(['journal'], os.listdir(sources['mkfs_var_log']))
+        self.assertEqual([], os.listdir(sources['mkfs_boot']))
@@ -15,6 +15,7 @@ import fixtures
 import json
 import logging
 import os
+import threading
 
 from stevedore import extension
 from testtools.matchers import FileExists
@@ -150,3 +151,63 @@ class TestState(TestStateBase):
         self.assertListEqual(state['rollback_test'],
                              ['never', 'gonna', 'give', 'you', 'up',
                               'never', 'gonna', 'let', 'you', 'down'])
+
+
+class _Node(object):
+    def __init__(self, name, log, parallel_safe=False, barrier=None,
+                 fail=False):
+        self.name = name
+        self.log = log
+        self.parallel_safe = parallel_safe
+        self.barrier = barrier
+        self.fail = fail
+
+    def create(self):
+        self.log.append(('start', self.name))
+        if self.barrier is not None:
+            # only passes if the other nodes run at the same time
+            self.barrier.wait()
+        if self.fail:
+            raise RuntimeError(self.name)
+        self.log.append(('end', self.name))
+
+
+class TestRunNodes(tb.TestBase):
+
+    def test_parallel(self):
+        log = []
+        barrier = threading.Barrier(2, timeout=10)
+        nodes = [_Node('image', log),
+                 _Node('fs1', log, True, barrier),
+                 _Node('fs2', log, True, barrier),
+                 _Node('mount', log)]
+        edges = [('image', 'fs1'), ('image', 'fs2'), ('fs1', 'mount'),
+                 ('fs2', 'mount')]
+        bd.run_nodes(nodes, edges, 'create', workers=4)
+        self.assertEqual([('start', 'image'), ('end', 'image')], log[:2])
+        self.assertEqual(set([('start', 'fs1'), ('start', 'fs2')]),
+                         set(log[2:4]))
+        self.assertEqual([('start', 'mount'), ('end', 'mount')], log[-2:])
+
+    def test_alone(self):
+        # nodes not parallel_safe run on their own, in order; the
+        # independent parallel_safe node does not wait for them
+        log = []
+        nodes = [_Node('a', log), _Node('b', log, True), _Node('c', log)]
+        bd.run_nodes(nodes, [], 'create', workers=4)
+        self.assertEqual([('start', 'b'), ('end', 'b'),
+                          ('start', 'a'), ('end', 'a'),
+                          ('start', 'c'), ('end', 'c')], log)
+
+    def test_failure(self):
+        log = []
+        barrier = threading.Barrier(2, timeout=10)
+        nodes = [_Node('fs1', log, True, barrier, fail=True),
+                 _Node('fs2', log, True, barrier),
+                 _Node('mount', log)]
+        edges = [('fs1', 'mount'), ('fs2', 'mount')]
+        self.assertRaisesRegex(RuntimeError, 'fs1', bd.run_nodes,
+                               nodes, edges, 'create', 4)
+        # the running node finished, the next was not started
+        self.assertIn(('end', 'fs2'), log)
+        self.assertNotIn(('start', 'mount'), log)
@@ -12,12 +12,22 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import fixtures
 import logging
+import os
+import sys
+import threading
+from unittest import mock
 
 import diskimage_builder.block_device.tests.test_base as tb
 
+from diskimage_builder.block_device.exception import \
+    BlockDeviceSetupException
+from diskimage_builder.block_device import privhelper
+from diskimage_builder.block_device import utils
 from diskimage_builder.block_device.utils import parse_abs_size_spec
 from diskimage_builder.block_device.utils import parse_rel_size_spec
+from diskimage_builder import trace
 
 
 logger = logging.getLogger(__name__)
@@ -62,3 +72,88 @@ class TestBlockDeviceUtils(tb.TestBase):
              ["2.4T", 2.4 * 1000**4],
              ["512B", 512],
              ["364", 364]])
+
+
+class TestSudoHelper(tb.TestBase):
+    """Tests of exec_sudo through the privileged helper
+
+    The helper is run without sudo.
+    """
+
+    def setUp(self):
+        super(TestSudoHelper, self).setUp()
+        helper = utils.SudoHelper([sys.executable, privhelper.__file__])
+        self.assertTrue(helper.start())
+        self.addCleanup(helper.stop)
+        self.useFixture(fixtures.MockPatchObject(utils, '_sudo_helper',
+                                                 helper))
+
+    @mock.patch('subprocess.Popen')
+    def test_exec_sudo(self, mock_popen):
+        self.assertEqual("hello\n", utils.exec_sudo(["echo", "hello"]))
+        e = self.assertRaises(BlockDeviceSetupException, utils.exec_sudo,
+                              ["sh", "-c", "echo failed; exit 3"])
+        self.assertEqual(3, e.returncode)
+        self.assertEqual("sudo sh -c echo failed; exit 3", e.cmd)
+        self.assertEqual("failed\n", e.output)
+        e = self.assertRaises(BlockDeviceSetupException, utils.exec_sudo,
+                              ["/does/not/exist"])
+        self.assertEqual(1, e.returncode)
+        # no sudo for each command
+        mock_popen.assert_not_called()
+
+    def test_exec_sudo_batch(self):
+        self.assertEqual(["1\n", "2\n"],
+                         utils.exec_sudo_batch([["echo", "1"],
+                                                ["echo", "2"]]))
+        # the batch stops at the first failure
+        e = self.assertRaises(BlockDeviceSetupException,
+                              utils.exec_sudo_batch,
+                              [["true"], ["false"], ["touch", "/x"]])
+        self.assertEqual("sudo false", e.cmd)
+        results = utils._sudo_helper.run([["false"], ["true"]])
+        self.assertEqual([(1, "")], results)
+
+    def test_trace(self):
+        trace_file = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'trace.jsonl')
+        self.useFixture(fixtures.EnvironmentVariable('DIB_TRACE_FILE',
+                                                     trace_file))
+        self.assertRaises(BlockDeviceSetupException, utils.exec_sudo_batch,
+                          [["true"], ["sh", "-c", "exit 2"]])
+        records = trace.read_trace(trace_file)
+        self.assertEqual([('true', 0), ('sh -c exit 2', 2)],
+                         [(r['name'], r['returncode']) for r in records])
+        self.assertEqual('sudo', records[0]['type'])
+        self.assertIn('maxrss', records[0])
+
+    def test_bad_response(self):
+        # a helper answering garbage fails the pending and later
+        # requests instead of leaving them waiting
+        helper = utils.SudoHelper([
+            sys.executable, "-c",
+            "import sys\n"
+            "print('{\"ready\": true}', flush=True)\n"
+            "sys.stdin.readline()\n"
+            "print('garbage', flush=True)\n"
+            "sys.stdin.read()\n"])
+        self.assertTrue(helper.start())
+        self.addCleanup(helper.stop)
+        e = self.assertRaises(BlockDeviceSetupException, helper.run,
+                              [["true"]])
+        self.assertIn("Invalid response", str(e))
+        helper.reader.join()
+        e = self.assertRaises(BlockDeviceSetupException, helper.run,
+                              [["true"]])
+        self.assertIn("not running", str(e))
+
+    def test_concurrent(self):
+        # a long command does not block the others
+        outs = []
+        slow = threading.Thread(
+            target=lambda: outs.append(utils.exec_sudo(
+                ["sh", "-c", "sleep 0.5; echo slow"])))
+        slow.start()
+        outs.append(utils.exec_sudo(["echo", "fast"]))
+        slow.join()
+        self.assertEqual(["fast\n", "slow\n"], outs)
@@ -12,13 +12,21 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import concurrent.futures
+import json
 import locale
 import logging
+import os
 import re
 import subprocess
+import sys
+import threading
+import time
 
 from diskimage_builder.block_device.exception import \
     BlockDeviceSetupException
+from diskimage_builder.block_device import privhelper
+from diskimage_builder import trace
 
 logger = logging.getLogger(__name__)
 
@@ -91,6 +99,175 @@ def parse_rel_size_spec(size_spec, abs_size):
     return False, parse_abs_size_spec(size_spec)
 
 
+class SudoHelper(object):
+    """A long-lived privileged process running commands
+
+    Starting sudo for every command is expensive on hosts with PAM
+    session and audit modules.  The helper (see privhelper.py) is
+    started under sudo once and runs the commands sent to it over a
+    pipe.  Requests from several threads are run concurrently.
+
+    :param cmd: command starting the helper; by default privhelper.py
+                run by this python under sudo
+    """
+
+    def __init__(self, cmd=None):
+        if cmd is None:
+            cmd = ["sudo", sys.executable, privhelper.__file__]
+        self.cmd = cmd
+        self.proc = None
+        self.reader = None
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.next_id = 0
+        self.closed = True
+
+    def start(self):
+        """Start the helper
+
+        :return: True if the helper is running, False if it could not
+                 be started
+        """
+        logger.debug("Starting privileged helper [%s]", " ".join(self.cmd))
+        try:
+            self.proc = subprocess.Popen(self.cmd, stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE)
+        except OSError as e:
+            logger.warning("Can not start privileged helper: %s", e)
+            return False
+        line = self.proc.stdout.readline()
+        try:
+            ready = json.loads(line.decode()).get('ready')
+        except ValueError:
+            ready = False
+        if not ready:
+            logger.warning("Privileged helper did not start; running "
+                           "every command with sudo")
+            self.proc.stdin.close()
+            self.proc.wait()
+            return False
+        self.closed = False
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+        return True
+
+    def _read(self):
+        error = None
+        try:
+            for line in self.proc.stdout:
+                response = json.loads(line.decode())
+                with self.lock:
+                    future = self.pending.pop(response['id'])
+                future.set_result(response['results'])
+        except Exception as e:
+            logger.error("Invalid response from privileged helper: %s", e)
+            error = BlockDeviceSetupException(
+                "Invalid response from privileged helper: %s" % e)
+        finally:
+            # whatever happened, nobody may wait for a response
+            # that will never come
+            with self.lock:
+                self.closed = True
+                if error is None:
+                    error = BlockDeviceSetupException(
+                        "Privileged helper exited with [%s]"
+                        % self.proc.wait())
+                for future in self.pending.values():
+                    future.set_exception(error)
+                self.pending.clear()
+
+    def run(self, cmds):
+        """Run a batch of commands, stopping at the first failure
+
+        :param cmds: list of command lists
+        :return: list of (returncode, output) of the commands run
+        """
+        return [(r['returncode'], r['output'])
+                for r in self.run_results(cmds)]
+
+    def run_results(self, cmds):
+        """Like :meth:`run`, returning the results of privhelper.py
+
+        :return: list of dicts of the commands run
+        """
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.closed:
+                raise BlockDeviceSetupException(
+                    "Privileged helper is not running")
+            self.next_id += 1
+            self.pending[self.next_id] = future
+            request = json.dumps({'id': self.next_id, 'cmds': cmds})
+            self.proc.stdin.write(request.encode() + b'\n')
+            self.proc.stdin.flush()
+        return future.result()
+
+    def stop(self):
+        """Stop the helper once the running commands are done"""
+        if self.proc is None:
+            return
+        with self.lock:
+            self.proc.stdin.close()
+        self.proc.wait()
+        if self.reader is not None:
+            self.reader.join()
+        self.proc = None
+
+
+_sudo_helper = None
+
+
+def start_sudo_helper():
+    """Run the following exec_sudo() calls by a privileged helper"""
+    global _sudo_helper
+    if _sudo_helper is not None:
+        return
+    helper = SudoHelper()
+    if helper.start():
+        _sudo_helper = helper
+
+
+def stop_sudo_helper():
+    global _sudo_helper
+    if _sudo_helper is not None:
+        _sudo_helper.stop()
+        _sudo_helper = None
+
+
+def _exec_sudo_failed(sudo_cmd, returncode, out):
+    e = BlockDeviceSetupException("exec_sudo failed: %s" % out)
+    e.returncode = returncode
+    e.cmd = ' '.join(sudo_cmd)
+    e.output = out
+    return e
+
+
+def _exec_sudo_popen(sudo_cmd):
+    start = time.time()
+    proc = subprocess.Popen(sudo_cmd,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+
+    out = ""
+    with proc.stdout:
+        for line in iter(proc.stdout.readline, b''):
+            line = line.decode(encoding=locale.getpreferredencoding(False),
+                               errors='backslashreplace')
+            out += line
+            logger.debug("exec_sudo: %s", line.rstrip())
+    # wait4, for the resource usage in the build trace
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = trace.exit_code(status)
+    trace.write_record(trace.make_record(
+        'sudo', ' '.join(sudo_cmd[1:]), start, time.time(),
+        proc.returncode, pid=proc.pid, rusage=rusage))
+
+    if proc.returncode:
+        raise _exec_sudo_failed(sudo_cmd, proc.returncode, out)
+
+    return out
+
+
 def exec_sudo(cmd):
     """Run a command under sudo
 
@@ -110,39 +287,51 @@ def exec_sudo(cmd):
     * ``cmd`` : the command run
     * ``output`` : stdout+stderr output
     """
-    assert isinstance(cmd, list)
-    sudo_cmd = ["sudo"]
-    sudo_cmd.extend(cmd)
-    try:
-        logger.info("Calling [%s]", " ".join(sudo_cmd))
-    except TypeError:
-        # Popen actually doesn't care, but we've managed to get mixed
-        # str and bytes in argument lists which causes errors logging
-        # commands.  Give a clue as to what's going on.
-        logger.exception("Ensure all arguments are str type!")
-        raise
+    return exec_sudo_batch([cmd])[0]
 
-    proc = subprocess.Popen(sudo_cmd,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.STDOUT)
 
-    out = ""
-    with proc.stdout:
-        for line in iter(proc.stdout.readline, b''):
-            line = line.decode(encoding=locale.getpreferredencoding(False),
-                               errors='backslashreplace')
-            out += line
-            logger.debug("exec_sudo: %s", line.rstrip())
-    proc.wait()
+def exec_sudo_batch(cmds):
+    """Run several commands under sudo
 
-    if proc.returncode:
-        e = BlockDeviceSetupException("exec_sudo failed: %s" % out)
-        e.returncode = proc.returncode
-        e.cmd = ' '.join(sudo_cmd)
-        e.output = out
-        raise e
+    The commands are run in order, stopping at the first failing one,
+    which raises like :func:`exec_sudo`.  When the privileged helper
+    is running, the whole batch is a single request to it.
 
-    return out
+    :param cmds: list of str command lists
+    :return: list of the stdout+stderr of the commands
+    """
+    sudo_cmds = []
+    for cmd in cmds:
+        assert isinstance(cmd, list)
+        sudo_cmd = ["sudo"]
+        sudo_cmd.extend(cmd)
+        try:
+            logger.info("Calling [%s]", " ".join(sudo_cmd))
+        except TypeError:
+            # Popen actually doesn't care, but we've managed to get mixed
+            # str and bytes in argument lists which causes errors logging
+            # commands.  Give a clue as to what's going on.
+            logger.exception("Ensure all arguments are str type!")
+            raise
+        sudo_cmds.append(sudo_cmd)
+
+    if _sudo_helper is None:
+        return [_exec_sudo_popen(sudo_cmd) for sudo_cmd in sudo_cmds]
+
+    outs = []
+    results = _sudo_helper.run_results(cmds)
+    for cmd, sudo_cmd, result in zip(cmds, sudo_cmds, results):
+        returncode = result['returncode']
+        out = result['output']
+        trace.write_record(trace.make_record(
+            'sudo', ' '.join(cmd), result['start'], result['stop'],
+            returncode, **result.get('rusage', {})))
+        for line in out.splitlines():
+            logger.debug("exec_sudo: %s", line)
+        if returncode:
+            raise _exec_sudo_failed(sudo_cmd, returncode, out)
+        outs.append(out)
+    return outs
 
 
 def remove_device(device_name):
@@ -0,0 +1,544 @@
+# Copyright 2026 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Download URLs into a local cache
+
+This is the implementation of the cache-url element's ``cache-url``.
+A cached file is revalidated with the ETag and Last-Modified the server
+sent for it, which are kept in a hidden metadata file next to it
+(``.<name>.cache-url``); a cache without metadata is revalidated with
+its modification time.  A download goes to ``.<name>.part`` and is
+only renamed over the cached file when complete; if it is interrupted
+the next attempt continues it with a Range request, as long as the
+server copy has not changed (If-Range).  Failed connections and server
+errors are retried with exponential backoff.
+
+Other URLs than http(s):// and file:// (e.g. ftp://) are downloaded
+with urllib every time, as there is no conditional request for them.
+
+In batch mode a list of URLs is fetched by a few threads sharing a
+pool of keep-alive connections.
+"""
+
+import argparse
+import base64
+import concurrent.futures
+import email.utils
+import fcntl
+import http.client
+import json
+import logging
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import diskimage_builder.logging_config
+
+logger = logging.getLogger(__name__)
+
+# Exit code when the server does not have the URL; hooks check for it
+NOT_FOUND_EXIT = 44
+
+MAX_REDIRECTS = 10
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+# Responses worth trying again
+RETRY_CODES = (408, 429, 500, 502, 503, 504)
+
+CHUNK_SIZE = 1024 * 1024
+USER_AGENT = 'diskimage-builder cache-url'
+
+
+class DownloadError(Exception):
+    """A download failed
+
+    :param retry: if trying again may help
+    :param exit_code: the exit code of cache-url
+    """
+
+    def __init__(self, message, retry=False, exit_code=1):
+        super(DownloadError, self).__init__(message)
+        self.retry = retry
+        self.exit_code = exit_code
+
+
+class _Redirect(Exception):
+    """An http(s) URL redirected to a URL of another scheme"""
+
+    def __init__(self, url):
+        super(_Redirect, self).__init__(url)
+        self.url = url
+
+
+def _proxy(scheme, host):
+    """The (host, port, Proxy-Authorization) of the proxy for a host"""
+    proxies = urllib.request.getproxies()
+    if scheme not in proxies or \
+            urllib.request.proxy_bypass_environment(host, proxies):
+        return None
+    proxy = urllib.parse.urlsplit(proxies[scheme])
+    auth = None
+    if proxy.username:
+        credentials = '%s:%s' % (urllib.parse.unquote(proxy.username),
+                                 urllib.parse.unquote(proxy.password or ''))
+        auth = 'Basic ' + base64.b64encode(credentials.encode()).decode()
+    return proxy.hostname, proxy.port or 8080, auth
+
+
+class ConnectionPool(object):
+    """Keep-alive HTTP(S) connections, shared by threads
+
+    A connection is taken with get() and given back with put() once
+    its response is read.
+    """
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """A connection for a URL
+
+        :return: (connection, key, path, headers, reused); path and
+                 headers are what to request on the connection, reused
+                 is True for an idle connection taken from the pool
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise DownloadError("Unsupported URL %s" % url)
+        default_port = 443 if parts.scheme == 'https' else 80
+        host, port = parts.hostname, parts.port or default_port
+        proxy = _proxy(parts.scheme, host)
+        key = (parts.scheme, host, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = {}
+        if proxy and parts.scheme == 'http':
+            # a plain proxy is sent the whole URL
+            path = urllib.parse.urlunsplit(parts._replace(fragment=''))
+            if proxy[2]:
+                headers['Proxy-Authorization'] = proxy[2]
+
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), key, path, headers, True
+
+        if parts.scheme == 'https':
+            if proxy:
+                conn = http.client.HTTPSConnection(proxy[0], proxy[1],
+                                                   timeout=self.timeout)
+                tunnel_headers = {}
+                if proxy[2]:
+                    tunnel_headers['Proxy-Authorization'] = proxy[2]
+                conn.set_tunnel(host, port, tunnel_headers)
+            else:
+                conn = http.client.HTTPSConnection(host, port,
+                                                   timeout=self.timeout)
+        else:
+            if proxy:
+                conn = http.client.HTTPConnection(proxy[0], proxy[1],
+                                                  timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(host, port,
+                                                  timeout=self.timeout)
+        if int(os.environ.get('DIB_DEBUG_TRACE', 0)) > 1:
+            conn.set_debuglevel(1)
+        return conn, key, path, headers, False
+
+    def put(self, key, conn, response):
+        """Give back a connection after its response
+
+        It is closed unless the whole response was read and the server
+        keeps the connection open.
+        """
+        if response.will_close or not response.isclosed():
+            conn.close()
+            return
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    def close(self):
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle = {}
+
+
+def _request(pool, url, headers):
+    """GET a URL, following redirects
+
+    :return: (response, release); release() gives the connection back
+             to the pool and must be called once the response is read
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        conn, key, path, extra, reused = pool.get(url)
+        try:
+            conn.request('GET', path, headers=dict(headers, **extra))
+            response = conn.getresponse()
+        except (http.client.HTTPException, OSError) as e:
+            conn.close()
+            if reused:
+                # the server closed the idle connection; try a new one
+                continue
+            raise DownloadError("Failed to connect for %s: %s" % (url, e),
+                                retry=True)
+
+        location = response.getheader('Location')
+        if response.status in REDIRECT_CODES and location:
+            response.read()
+            pool.put(key, conn, response)
+            url = urllib.parse.urljoin(url, location)
+            if urllib.parse.urlsplit(url).scheme not in ('http', 'https'):
+                raise _Redirect(url)
+            continue
+
+        def release(key=key, conn=conn, response=response):
+            pool.put(key, conn, response)
+        return response, release
+    raise DownloadError("Too many redirects for %s" % url)
+
+
+def state_paths(dest):
+    """The (metadata, partial download, lock) files of a cached file"""
+    dirname, name = os.path.split(os.path.abspath(dest))
+    base = os.path.join(dirname, '.' + name)
+    return base + '.cache-url', base + '.part', base + '.lock'
+
+
+def read_metadata(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def write_metadata(path, metadata):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(metadata, f, sort_keys=True)
+    os.rename(tmp, path)
+
+
+def _validators(response):
+    return {'etag': response.getheader('ETag'),
+            'last_modified': response.getheader('Last-Modified')}
+
+
+def _if_range(partial):
+    # a weak ETag cannot be used for a range request
+    etag = partial.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return partial.get('last_modified')
+
+
+def _read_body(response, path, mode):
+    """Write a response body to a file; the number of bytes written"""
+    written = 0
+    try:
+        with open(path, mode) as f:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                written += len(chunk)
+    except (http.client.HTTPException, OSError) as e:
+        raise DownloadError("Download interrupted: %s" % e, retry=True)
+    return written
+
+
+def _fetch_once(pool, url, dest, force):
+    """One attempt of fetch(); the message to log"""
+    meta_path, part_path, _ = state_paths(dest)
+    metadata = read_metadata(meta_path)
+    cached = os.path.isfile(dest) and os.path.getsize(dest) > 0
+
+    headers = {'User-Agent': USER_AGENT}
+    if force:
+        headers['Pragma'] = 'no-cache, must-revalidate'
+        headers['Cache-Control'] = 'no-cache, must-revalidate'
+        success = ("Downloaded and cached %s, having forced upstream "
+                   "caches to revalidate" % url)
+    elif cached:
+        if metadata.get('url') == url:
+            if metadata.get('etag'):
+                headers['If-None-Match'] = metadata['etag']
+            if metadata.get('last_modified'):
+                headers['If-Modified-Since'] = metadata['last_modified']
+        elif not metadata.get('url'):
+            # cached before there was metadata
+            headers['If-Modified-Since'] = email.utils.formatdate(
+                os.path.getmtime(dest), usegmt=True)
+        success = "Server copy has changed. Using server version of %s" % url
+    else:
+        success = "Downloaded and cached %s for the first time" % url
+
+    partial = metadata.get('partial') or {}
+    offset = 0
+    if partial.get('url') == url and os.path.exists(part_path) and \
+            _if_range(partial):
+        offset = os.path.getsize(part_path)
+    if offset:
+        headers['Range'] = 'bytes=%d-' % offset
+        headers['If-Range'] = _if_range(partial)
+
+    response, release = _request(pool, url, headers)
+    try:
+        status = response.status
+        if status == 304:
+            response.read()
+            return "Server copy has not changed. Using locally cached %s" % url
+        if status == 416 and offset:
+            # the partial download is no use; start again
+            response.read()
+            os.unlink(part_path)
+            raise DownloadError("Cannot resume %s" % url, retry=True)
+        if status not in (200, 206):
+            response.read()
+            if status == 404:
+                exit_code = NOT_FOUND_EXIT
+            else:
+                exit_code = 1
+            raise DownloadError("Server returned an unexpected response "
+                                "code. [%d]" % status,
+                                retry=status in RETRY_CODES,
+                                exit_code=exit_code)
+
+        validators = _validators(response)
+        if status == 200 and cached and not force and \
+                validators['etag'] and \
+                not validators['etag'].startswith('W/') and \
+                validators['etag'] == metadata.get('etag') and \
+                metadata.get('url') == url:
+            # the server ignored If-None-Match, but it is the same
+            return "Server copy has not changed. Using locally cached %s" % url
+
+        mode = 'wb'
+        if status == 206:
+            content_range = response.getheader('Content-Range', '')
+            if not content_range.startswith('bytes %d-' % offset):
+                os.unlink(part_path)
+                raise DownloadError("Unexpected range %s for %s" %
+                                    (content_range, url), retry=True)
+            mode = 'ab'
+            logger.info("Resuming download of %s at %d bytes", url, offset)
+            validators = {'etag': partial.get('etag'),
+                          'last_modified': partial.get('last_modified')}
+        else:
+            offset = 0
+            # recorded first, so that an interrupted download can be
+            # continued
+            metadata['partial'] = dict(validators, url=url)
+            write_metadata(meta_path, metadata)
+
+        length = response.getheader('Content-Length')
+        received = _read_body(response, part_path, mode)
+        if length is not None and received != int(length):
+            raise DownloadError("Download of %s incomplete: %d of %s bytes" %
+                                (url, received, length), retry=True)
+    finally:
+        release()
+
+    os.rename(part_path, dest)
+    write_metadata(meta_path, dict(validators, url=url))
+    return success
+
+
+def _fetch_file(url, dest):
+    path = urllib.request.url2pathname(urllib.parse.urlsplit(url).path)
+    if not os.path.exists(path):
+        raise DownloadError("%s does not exist" % path,
+                            exit_code=NOT_FOUND_EXIT)
+    tmp = state_paths(dest)[1]
+    shutil.copyfile(path, tmp)
+    os.rename(tmp, dest)
+    return "Downloaded and cached %s" % url
+
+
+def _fetch_other(url, dest, timeout):
+    """Download a URL of another scheme (ftp://...) with urllib"""
+    meta_path, part_path, _ = state_paths(dest)
+    try:
+        response = urllib.request.urlopen(url, timeout=timeout)
+    except urllib.error.URLError as e:
+        # ftp reports a missing file as "550 ..."
+        if '550' in str(e.reason):
+            raise DownloadError("%s does not exist: %s" % (url, e.reason),
+                                exit_code=NOT_FOUND_EXIT)
+        raise DownloadError("Failed to connect for %s: %s" % (url, e.reason),
+                            retry=True)
+    with response:
+        _read_body(response, part_path, 'wb')
+    os.rename(part_path, dest)
+    write_metadata(meta_path, {'url': url})
+    return "Downloaded and cached %s" % url
+
+
+def _fetch_url(pool, url, dest, force):
+    """One attempt of fetch() for a URL of any scheme but file://"""
+    if urllib.parse.urlsplit(url).scheme not in ('http', 'https'):
+        return _fetch_other(url, dest, pool.timeout)
+    try:
+        return _fetch_once(pool, url, dest, force)
+    except _Redirect as e:
+        return _fetch_other(e.url, dest, pool.timeout)
+
+
+def fetch(url, dest, pool, force=False, retries=3, retry_delay=2.0,
+          max_delay=60.0):
+    """Download a URL to a cached file, unless it has not changed
+
+    :param url: URL; only http(s):// URLs are revalidated
+    :param dest: the cached file; may be a named pipe to write to
+    :param pool: ConnectionPool to use
+    :param force: ask caches on the way to revalidate
+    :param retries: how often to try again after a failure
+    :param retry_delay: seconds to wait before the first retry; the
+                        wait doubles for each retry, up to max_delay
+    :return: the message describing what happened
+    :raises DownloadError: if the download failed
+    """
+    if os.path.exists(dest) and stat.S_ISFIFO(os.stat(dest).st_mode):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'download')
+            message = fetch(url, path, pool, force, retries, retry_delay,
+                            max_delay)
+            with open(path, 'rb') as src, open(dest, 'wb') as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        return message
+
+    os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+    with open(state_paths(dest)[2], 'w') as lock:
+        # one download of a file at a time, also across builds
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if url.startswith('file://'):
+            return _fetch_file(url, dest)
+        delay = retry_delay
+        for attempt in range(retries + 1):
+            try:
+                return _fetch_url(pool, url, dest, force)
+            except DownloadError as e:
+                if not e.retry or attempt == retries:
+                    raise
+                logger.warning("%s; retrying in %.1f seconds", e, delay)
+                time.sleep(delay)
+                delay = min(delay * 2, max_delay)
+
+
+def read_batch(path):
+    """Read a batch file: lines of "<url> <destination>"
+
+    :return: list of (url, destination)
+    """
+    f = sys.stdin if path == '-' else open(path)
+    try:
+        entries = []
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            url, dest = line.split(None, 1)
+            entries.append((url, dest))
+        return entries
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def fetch_all(entries, pool, jobs=4, **kwargs):
+    """Fetch several URLs at the same time
+
+    :param entries: list of (url, destination)
+    :param jobs: the number of downloads at the same time
+    :param kwargs: further arguments of fetch()
+    :return: list of (message or None, DownloadError or None), in the
+             order of the entries
+    """
+    def _fetch(entry):
+        try:
+            return fetch(entry[0], entry[1], pool, **kwargs), None
+        except DownloadError as e:
+            return None, e
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(_fetch, entries))
+
+
+def main():
+    diskimage_builder.logging_config.setup()
+
+    parser = argparse.ArgumentParser(
+        description="Download a URL and cache it to a specified location. "
+        "Subsequent requests will ask the server whether the file has "
+        "changed to determine whether it needs to be downloaded again.")
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='force upstream caches to fetch a new copy '
+                        'of the file')
+    parser.add_argument('--batch', metavar='FILE',
+                        help='download the URLs listed in FILE ("-" for '
+                        'stdin), one "<url> <destination_file>" per line')
+    parser.add_argument('--jobs', type=int, default=4,
+                        help='downloads at the same time in batch mode')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='how often to retry a failed download')
+    parser.add_argument('--retry-delay', type=float, default=2.0,
+                        help='seconds before the first retry; doubled '
+                        'for each further one')
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='seconds to wait for the server')
+    parser.add_argument('url', nargs='?')
+    parser.add_argument('destination_file', nargs='?')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.batch:
+        if args.url:
+            parser.error("no URL can be given with --batch")
+        entries = read_batch(args.batch)
+    elif args.url and args.destination_file:
+        entries = [(args.url, args.destination_file)]
+    else:
+        parser.error("a URL and a destination file are required")
+
+    pool = ConnectionPool(args.timeout)
+    try:
+        results = fetch_all(entries, pool, jobs=max(1, args.jobs),
+                            force=args.force, retries=args.retries,
+                            retry_delay=args.retry_delay)
+    finally:
+        pool.close()
+
+    exit_code = 0
+    for (url, _), (message, error) in zip(entries, results):
+        if error:
+            logger.error("%s: %s", url, error)
+            exit_code = exit_code or error.exit_code
+        else:
+            logger.info(message)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
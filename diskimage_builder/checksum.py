@@ -0,0 +1,121 @@
+# Copyright 2026 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Write checksum files for images
+
+All requested checksums of a file are calculated in a single read of
+it, and several files are read concurrently (hashlib releases the GIL
+while hashing).  The output files have the same format as md5sum and
+sha256sum produce, so they can be checked with "md5sum -c".
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import logging
+import sys
+
+import diskimage_builder.logging_config
+
+logger = logging.getLogger(__name__)
+
+CHECKSUMS = ("md5", "sha256")
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def parse_checksums(value):
+    """Parse the value of DIB_CHECKSUM
+
+    :param value: "1" for all checksums, or a list of them separated
+                  by commas or whitespace like "md5,sha256".  As
+                  finish_image always did, an entry naming a checksum
+                  (e.g. "sha256sum") selects it.
+    :return: list of checksum names
+    """
+    if value == "1":
+        return list(CHECKSUMS)
+    checksums = []
+    for entry in value.replace(",", " ").split():
+        names = [c for c in CHECKSUMS if c in entry]
+        if not names:
+            raise ValueError("Unknown checksum [%s]" % entry)
+        checksums.extend(c for c in names if c not in checksums)
+    return checksums
+
+
+def file_digests(path, checksums):
+    """Calculate the checksums of a file in one read
+
+    :return: dict of checksum name to hex digest
+    """
+    hashes = dict((c, hashlib.new(c)) for c in checksums)
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            for h in hashes.values():
+                h.update(block)
+    return dict((c, h.hexdigest()) for c, h in hashes.items())
+
+
+def write_checksums(path, checksums, name=None, output=None):
+    """Write <output>.<checksum> files for a file
+
+    :param path: file to checksum
+    :param checksums: list of checksum names
+    :param name: file name recorded in the checksum files; defaults
+                 to path
+    :param output: prefix of the checksum files; defaults to path
+    """
+    digests = file_digests(path, checksums)
+    for checksum, digest in digests.items():
+        with open("%s.%s" % (output or path, checksum), "w") as f:
+            f.write("%s  %s\n" % (digest, name or path))
+    return digests
+
+
+def main():
+    diskimage_builder.logging_config.setup()
+
+    parser = argparse.ArgumentParser(
+        description="Write checksum files for images")
+    parser.add_argument('--checksum', default='1',
+                        help='checksums to write, like md5,sha256 '
+                        '(default: all)')
+    parser.add_argument('--name',
+                        help='file name to record (only with one file)')
+    parser.add_argument('--output',
+                        help='prefix of the checksum files '
+                        '(only with one file)')
+    parser.add_argument('files', nargs='+', help='files to checksum')
+    args = parser.parse_args(sys.argv[1:])
+
+    if (args.name or args.output) and len(args.files) > 1:
+        parser.error("--name and --output need a single file")
+
+    checksums = parse_checksums(args.checksum)
+    with concurrent.futures.ThreadPoolExecutor(len(args.files)) as pool:
+        futures = [pool.submit(write_checksums, path, checksums,
+                               args.name, args.output)
+                   for path in args.files]
+        for future in futures:
+            future.result()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+# Copyright 2026 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Write a tree as a compressed cpio archive for an initramfs
+
+The archive is in the "newc" format the kernel unpacks.  Entries are
+written in sorted order with renumbered inodes, so the same tree
+always gives the same archive (with SOURCE_DATE_EPOCH set, newer
+modification times are clamped to it).  Hardlinked files are stored
+once.  The archive is streamed into a compressor; zstd, xz and pigz
+use all CPUs.
+
+This runs inside the chroot when building ramdisks and must only
+use the standard library.
+"""
+
+import argparse
+import os
+import shutil
+import stat
+import subprocess
+import sys
+
+# Compressors by name; the output of all of them can be unpacked by
+# the kernel (xz needs the crc32 check).  Use the first command found.
+COMPRESSORS = {
+    'gzip': [['pigz', '-c'], ['gzip', '-c']],
+    'pigz': [['pigz', '-c'], ['gzip', '-c']],
+    'zstd': [['zstd', '-c', '-q', '-T0']],
+    'xz': [['xz', '-c', '-T0', '--check=crc32']],
+    'none': [None],
+}
+
+MAGIC = b'070701'
+TRAILER = 'TRAILER!!!'
+BLOCK_SIZE = 512
+
+# newc stores sizes and times in 32 bits
+MAX_FIELD = 0xFFFFFFFF
+
+
+def compressor_cmd(name, level=None):
+    """The command compressing stdin to stdout
+
+    :param name: key of COMPRESSORS
+    :param level: compression level, None for the default
+    :return: command list, or None for no compression
+    """
+    if name not in COMPRESSORS:
+        raise ValueError("Unknown compressor [%s]" % name)
+    for cmd in COMPRESSORS[name]:
+        if cmd is None:
+            return None
+        if shutil.which(cmd[0]):
+            if level is not None:
+                cmd = cmd + ['-%d' % level]
+            return cmd
+    raise ValueError("No command found for compressor [%s]" % name)
+
+
+def walk(root):
+    """The entries of a tree, sorted, parents before their content
+
+    :return: list of (archive name, path, stat result)
+    """
+    entries = [('.', root, os.lstat(root))]
+
+    def scan(path, prefix):
+        with os.scandir(path) as it:
+            children = sorted(it, key=lambda e: e.name)
+        for entry in children:
+            name = prefix + entry.name
+            st = entry.stat(follow_symlinks=False)
+            entries.append((name, entry.path, st))
+            if stat.S_ISDIR(st.st_mode):
+                scan(entry.path, name + '/')
+
+    scan(root, '')
+    return entries
+
+
+class Writer(object):
+    """Write newc entries to a stream
+
+    :param out: binary file object
+    :param mtime: clamp modification times to this, None to keep them
+    """
+
+    def __init__(self, out, mtime=None):
+        self.out = out
+        self.mtime = mtime
+        self.written = 0
+
+    def _write(self, data):
+        self.out.write(data)
+        self.written += len(data)
+
+    def _pad(self, size):
+        if size % 4:
+            self._write(b'\0' * (4 - size % 4))
+
+    def header(self, name, ino, mode, uid, gid, nlink, mtime, size,
+               rdev=0):
+        if self.mtime is not None:
+            mtime = min(mtime, self.mtime)
+        if size > MAX_FIELD:
+            raise ValueError("[%s] is too large for cpio" % name)
+        name = os.fsencode(name) + b'\0'
+        fields = (ino, mode, uid, gid, nlink, max(0, int(mtime)), size,
+                  0, 0, os.major(rdev), os.minor(rdev), len(name), 0)
+        self._write(MAGIC + b''.join(b'%08X' % f for f in fields) + name)
+        self._pad(110 + len(name))
+
+    def blob(self, data):
+        self._write(data)
+        self._pad(len(data))
+
+    def data(self, fobj, size):
+        copied = 0
+        while copied < size:
+            block = fobj.read(min(1024 * 1024, size - copied))
+            if not block:
+                raise ValueError("File shrunk while writing the archive")
+            self._write(block)
+            copied += len(block)
+        self._pad(size)
+
+    def trailer(self):
+        self.header(TRAILER, 0, 0, 0, 0, 1, 0, 0)
+        if self.written % BLOCK_SIZE:
+            self._write(b'\0' * (BLOCK_SIZE - self.written % BLOCK_SIZE))
+
+
+def write_archive(root, out, mtime=None):
+    """Write the tree at root as a newc archive to out"""
+    entries = walk(root)
+
+    # Files with several links share an inode number in the archive;
+    # like GNU cpio the data is stored with the last of them.
+    links = {}
+    for name, path, st in entries:
+        if stat.S_ISREG(st.st_mode) and st.st_nlink > 1:
+            links.setdefault((st.st_dev, st.st_ino), []).append(name)
+
+    writer = Writer(out, mtime)
+    inodes = {}
+    for name, path, st in entries:
+        key = (st.st_dev, st.st_ino)
+        if key not in inodes:
+            inodes[key] = len(inodes) + 1
+        ino = inodes[key]
+        mode = st.st_mode
+        nlink = st.st_nlink
+        size = 0
+        if stat.S_ISREG(mode):
+            names = links.get(key, [name])
+            nlink = len(names)
+            if name == names[-1]:
+                size = st.st_size
+        elif stat.S_ISLNK(mode):
+            target = os.fsencode(os.readlink(path))
+            size = len(target)
+        writer.header(name, ino, mode, st.st_uid, st.st_gid, nlink,
+                      st.st_mtime, size, st.st_rdev)
+        if stat.S_ISLNK(mode):
+            writer.blob(target)
+        elif size:
+            with open(path, 'rb') as f:
+                writer.data(f, size)
+    writer.trailer()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write a tree as a compressed initramfs")
+    parser.add_argument('--compress', default='gzip',
+                        choices=sorted(COMPRESSORS),
+                        help='compressor (default: gzip)')
+    parser.add_argument('--level', type=int,
+                        help='compression level')
+    parser.add_argument('root', help='the tree')
+    parser.add_argument('output', help='the image file')
+    args = parser.parse_args(sys.argv[1:])
+
+    mtime = os.environ.get('SOURCE_DATE_EPOCH')
+    mtime = int(mtime) if mtime else None
+
+    cmd = compressor_cmd(args.compress, args.level)
+    with open(args.output, 'wb') as output:
+        if cmd is None:
+            write_archive(args.root, output, mtime)
+            return 0
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=output)
+        try:
+            write_archive(args.root, proc.stdin, mtime)
+        finally:
+            proc.stdin.close()
+            proc.wait()
+    if proc.returncode:
+        sys.stderr.write("%s failed with [%d]\n"
+                         % (cmd[0], proc.returncode))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
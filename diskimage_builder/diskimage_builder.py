@@ -14,16 +14,22 @@
 
 import argparse
 import collections
+import copy
 import io
 import jsonschema
 import os
 import os.path
+import platform
+import queue
 import shlex
 import subprocess
 import sys
+import tempfile
 import textwrap
+import threading
 import yaml
 
+from diskimage_builder import element_dependencies
 import diskimage_builder.paths
 
 
@@ -418,13 +424,28 @@ DIB_SCHEMA = {
 }
 
 
+# Element directories whose contents can influence the root.d phase,
+# which is the part of a build that --share-base shares between images
+BASE_SNAPSHOT_DIRS = ("root.d", "environment.d", "yum.repos.d")
+
+
 class Command(object):
     script = None
     args = None
     environ = None
+    imagename = None
+    elements = None
+    # the command building the shared base chroot this command is
+    # waiting for, see share_base_snapshots()
+    base_snapshot = None
+    # for a shared base chroot command, the commands using it
+    members = None
+    _loop_devices = None
 
     def __init__(self, script, properties, entry):
         self.script = script
+        self.imagename = entry.get("imagename", "image")
+        self.elements = list(entry.get("elements", []))
         self.args = []
         self.environ = {}
         for prop in properties:
@@ -445,6 +466,55 @@ class Command(object):
     def command(self):
         return ["bash", self.script] + self.args
 
+    def _arg_value(self, arg):
+        if arg in self.args:
+            index = self.args.index(arg)
+            if index + 1 < len(self.args):
+                return self.args[index + 1]
+        return None
+
+    def memory_needed(self):
+        """RAM in GB claimed by the tmpfs of this build
+
+        This mirrors tmpfs_check in common-functions; the build only
+        uses tmpfs when there is at least double the minimum tmpfs
+        size available, so that is what is reserved for it.
+        """
+        env = self.merged_env()
+        if "--no-tmpfs" in self.args or env.get("DIB_NO_TMPFS", "0") != "0":
+            return 0
+        min_tmpfs = self._arg_value("--min-tmpfs")
+        if min_tmpfs is None:
+            min_tmpfs = env.get("DIB_MIN_TMPFS", "2")
+        try:
+            return int(min_tmpfs) * 2
+        except ValueError:
+            raise ValueError(
+                "min-tmpfs (DIB_MIN_TMPFS) must be a number of GB, not "
+                "[%s]" % min_tmpfs
+            )
+
+    def loop_devices_needed(self):
+        """Loop devices attached by the block-device layer of this build
+
+        Each local_loop entry of DIB_BLOCK_DEVICE_CONFIG attaches one
+        loop device.  Builds using the element provided configuration
+        (or one that cannot be read) are counted as a single image.
+        """
+        if self._loop_devices is None:
+            self._loop_devices = 1
+            config = self.merged_env().get("DIB_BLOCK_DEVICE_CONFIG")
+            if config:
+                try:
+                    if config.startswith("file://"):
+                        with open(config[7:]) as f:
+                            config = f.read()
+                    count = _count_key(yaml.safe_load(config), "local_loop")
+                except (OSError, yaml.YAMLError):
+                    count = 0
+                self._loop_devices = max(count, 1)
+        return self._loop_devices
+
     def __repr__(self):
         elements = []
         for k, v in self.environ.items():
@@ -453,6 +523,17 @@ class Command(object):
         return " ".join(elements) + "\n"
 
 
+def _count_key(config, key):
+    """Count the occurrences of key in a nested YAML structure"""
+    if isinstance(config, dict):
+        return sum(
+            (k == key) + _count_key(v, key) for k, v in config.items()
+        )
+    if isinstance(config, list):
+        return sum(_count_key(v, key) for v in config)
+    return 0
+
+
 def help_properties():
     str = io.StringIO()
     for prop in PROPERTIES:
@@ -493,6 +574,36 @@ Supported entries for an image definition are:
         action="store_true",
         help="Stop building images when an image build fails",
     )
+    parser.add_argument(
+        "--parallel",
+        metavar="N",
+        type=int,
+        default=1,
+        help="Number of images to build at the same time (default 1). "
+        "Output of each build is prefixed with its imagename",
+    )
+    parser.add_argument(
+        "--parallel-memory",
+        metavar="GB",
+        type=int,
+        default=None,
+        help="RAM in GB which concurrent builds may claim for tmpfs "
+        "(default is the total RAM of the host)",
+    )
+    parser.add_argument(
+        "--share-base",
+        action="store_true",
+        help="Build the root.d chroot once for images with the same root.d "
+        "elements and environment, and start each of them from a copy",
+    )
+    parser.add_argument(
+        "--parallel-loop-devices",
+        metavar="N",
+        type=int,
+        default=None,
+        help="Maximum number of loop devices concurrent builds may use "
+        "(default is unlimited)",
+    )
     args = parser.parse_args(sys.argv[1:])
     return args
 
@@ -541,6 +652,271 @@ def build_commands(definition):
     return commands
 
 
+def image_elements(command):
+    """Expand the elements of a command the way arg_to_elements does
+
+    :return: list of (element, path) tuples
+    """
+    env = command.merged_env()
+    elements = list(command.elements)
+    arch = command._arg_value("-a") or env.get("ARCH") or platform.machine()
+    # see _arg_defaults_hack in common-functions
+    if "vm" in elements and not [
+        e for e in elements if e.startswith("block-device-")
+    ]:
+        if arch in ("arm64", "aarch64"):
+            elements.append("block-device-efi")
+        else:
+            elements.append("block-device-mbr")
+    if "-n" not in command.args:
+        elements.insert(0, "base")
+    if os.path.basename(command.script) == "ramdisk-image-create":
+        ramdisk_element = command._arg_value("--ramdisk-element")
+        elements.insert(0, ramdisk_element or "ramdisk")
+
+    paths = diskimage_builder.paths.get_path("elements")
+    if env.get("ELEMENTS_PATH"):
+        paths = "%s:%s" % (env["ELEMENTS_PATH"], paths)
+    return element_dependencies.get_elements(elements, paths)
+
+
+def base_snapshot_key(command):
+    """Key identifying commands which produce the same root.d chroot
+
+    :return: a hashable key, or None if the elements of the command
+             can not be resolved
+    """
+    try:
+        elements = image_elements(command)
+    except (
+        element_dependencies.MissingElementException,
+        element_dependencies.AlreadyProvidedException,
+        element_dependencies.MissingOSException,
+        element_dependencies.InvalidElementDir,
+    ):
+        # let the build itself report the problem
+        return None
+    early_elements = []
+    for name, path in sorted(elements):
+        for d in BASE_SNAPSHOT_DIRS:
+            if os.path.isdir(os.path.join(path, d)):
+                early_elements.append((name, path))
+                break
+    return (
+        command.script,
+        command._arg_value("-a"),
+        command._arg_value("--image-cache"),
+        "--offline" in command.args,
+        tuple(sorted(command.environ.items())),
+        tuple(early_elements),
+    )
+
+
+def share_base_snapshots(commands, snapshot_dir):
+    """Add commands building a shared base chroot for similar images
+
+    Images whose root.d phase would produce the same chroot (same
+    script, arguments, environment and elements contributing root.d,
+    environment.d or yum.repos.d files) are grouped.  For each group
+    of two or more, a command which only runs root.d and saves the
+    chroot with DIB_BASE_SNAPSHOT_SAVE is inserted before the group,
+    and the images of the group restore it with DIB_BASE_SNAPSHOT.
+
+    :param commands: list of Command objects from build_commands()
+    :param snapshot_dir: directory to save the base chroots in
+    :return: new list of commands to run in order
+    """
+    groups = collections.OrderedDict()
+    for command in commands:
+        key = base_snapshot_key(command)
+        if key is not None:
+            groups.setdefault(key, []).append(command)
+
+    bases = {}
+    for group in groups.values():
+        if len(group) < 2:
+            continue
+        first = group[0]
+        path = os.path.join(snapshot_dir, first.imagename)
+        base = copy.copy(first)
+        base.imagename = "%s-base" % first.imagename
+        base.environ = dict(first.environ, DIB_BASE_SNAPSHOT_SAVE=path)
+        # do not clobber the log of the real image build
+        base.args = list(first.args)
+        if "--logfile" in base.args:
+            index = base.args.index("--logfile")
+            del base.args[index:index + 2]
+        base.members = group
+        for command in group:
+            command.base_snapshot = base
+            command.environ["DIB_BASE_SNAPSHOT"] = path
+        bases[id(first)] = base
+
+    planned = []
+    for command in commands:
+        if id(command) in bases:
+            planned.append(bases[id(command)])
+        planned.append(command)
+    return planned
+
+
+def finish_base_snapshot(base, returncode):
+    """Release the images waiting on a shared base chroot
+
+    If the base chroot could not be built, the images fall back to
+    running root.d themselves.
+    """
+    for command in base.members:
+        command.base_snapshot = None
+        if returncode != 0:
+            del command.environ["DIB_BASE_SNAPSHOT"]
+    if returncode != 0:
+        sys.stderr.write(
+            "Building shared base %s failed, images will run root.d "
+            "themselves\n" % base.imagename
+        )
+        sys.stderr.flush()
+
+
+def host_memory():
+    """Total RAM of the host in GB, or None if it can not be determined"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) // (1024 * 1024)
+    except (IOError, ValueError):
+        pass
+    return None
+
+
+class ResourcePool(object):
+    """Bookkeeping of the resources claimed by running builds
+
+    A limit of None means the resource is not constrained.  A command
+    is always allowed to start when nothing else is running, so that
+    a build which needs more than the limit still gets its turn (it
+    will fall back to a disk based build directory on its own).
+    """
+
+    def __init__(self, jobs, memory=None, loop_devices=None):
+        self.jobs = jobs
+        self.memory = memory
+        self.loop_devices = loop_devices
+        self.running = 0
+        self.memory_used = 0
+        self.loop_devices_used = 0
+
+    def fits(self, command):
+        if self.running == 0:
+            return True
+        if self.running >= self.jobs:
+            return False
+        if (
+            self.memory is not None
+            and self.memory_used + command.memory_needed() > self.memory
+        ):
+            return False
+        if (
+            self.loop_devices is not None
+            and self.loop_devices_used + command.loop_devices_needed()
+            > self.loop_devices
+        ):
+            return False
+        return True
+
+    def claim(self, command):
+        self.running += 1
+        self.memory_used += command.memory_needed()
+        self.loop_devices_used += command.loop_devices_needed()
+
+    def release(self, command):
+        self.running -= 1
+        self.memory_used -= command.memory_needed()
+        self.loop_devices_used -= command.loop_devices_needed()
+
+
+def _prefix_output(command, stream, lock):
+    prefix = ("[%s] " % command.imagename).encode()
+    out = sys.stdout.buffer
+    for line in iter(stream.readline, b""):
+        with lock:
+            out.write(prefix + line)
+            out.flush()
+    stream.close()
+
+
+def _run_command(command, results, lock):
+    returncode = 1
+    try:
+        p = subprocess.Popen(
+            command.command(),
+            env=command.merged_env(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        _prefix_output(command, p.stdout, lock)
+        p.wait()
+        returncode = p.returncode
+    except Exception as e:
+        with lock:
+            sys.stderr.write(
+                "[%s] Failed to run build: %s\n" % (command.imagename, e)
+            )
+            sys.stderr.flush()
+    finally:
+        # always report back, run_parallel blocks until every build has
+        results.put((command, returncode))
+
+
+def run_parallel(commands, pool, stop_on_failure=False):
+    """Run commands concurrently within the limits of the pool
+
+    Commands are started in definition order whenever the pool has
+    room for them and the shared base chroot they wait on is built.
+    Once a build fails with stop_on_failure set, no further builds are
+    started but those already running are left to finish.
+
+    :return: tuple of the returncode and command of the last failure,
+             or (0, None)
+    """
+    pending = list(commands)
+    results = queue.Queue()
+    lock = threading.Lock()
+    final_returncode = 0
+    failed_command = None
+
+    while pending or pool.running:
+        for command in list(pending):
+            if command.base_snapshot is not None:
+                continue
+            if not pool.fits(command):
+                continue
+            pending.remove(command)
+            pool.claim(command)
+            with lock:
+                sys.stderr.write(str(command))
+                sys.stderr.write("\n")
+                sys.stderr.flush()
+            t = threading.Thread(
+                target=_run_command, args=(command, results, lock)
+            )
+            t.daemon = True
+            t.start()
+
+        command, returncode = results.get()
+        pool.release(command)
+        if command.members is not None:
+            finish_base_snapshot(command, returncode)
+        elif returncode != 0:
+            final_returncode = returncode
+            failed_command = command
+            if stop_on_failure:
+                pending = []
+
+    return final_returncode, failed_command
+
+
 def main():
     args = get_args()
 
@@ -553,20 +929,69 @@ def main():
         with open(file) as f:
             definitions.extend(yaml.safe_load(f))
     commands = build_commands(definitions)
+    if args.parallel > 1 and not args.dry_run:
+        # the scheduler needs these before anything is started
+        for command in commands:
+            try:
+                command.memory_needed()
+            except ValueError as e:
+                sys.stderr.write(
+                    "diskimage-builder: error: %s: %s\n"
+                    % (command.imagename, e)
+                )
+                sys.exit(2)
+    snapshot_dir = None
+    if args.share_base:
+        if args.dry_run:
+            # only shown, nothing is saved there
+            commands = share_base_snapshots(
+                commands,
+                os.path.join(
+                    os.environ.get("TMP_DIR") or tempfile.gettempdir(),
+                    "dib_base.XXXXXXXX",
+                ),
+            )
+        else:
+            snapshot_dir = tempfile.mkdtemp(
+                prefix="dib_base.", dir=os.environ.get("TMP_DIR")
+            )
+            commands = share_base_snapshots(commands, snapshot_dir)
     final_returncode = 0
     failed_command = None
-    for command in commands:
-        sys.stderr.write(str(command))
-        sys.stderr.write("\n")
-        sys.stderr.flush()
-        if not args.dry_run:
-            p = subprocess.Popen(command.command(), env=command.merged_env())
-            p.communicate()
-            if p.returncode != 0:
-                final_returncode = p.returncode
-                failed_command = command
-                if args.stop_on_failure:
-                    break
+    try:
+        if args.parallel > 1 and not args.dry_run:
+            memory = args.parallel_memory
+            if memory is None:
+                memory = host_memory()
+            pool = ResourcePool(
+                args.parallel,
+                memory=memory,
+                loop_devices=args.parallel_loop_devices,
+            )
+            final_returncode, failed_command = run_parallel(
+                commands, pool, stop_on_failure=args.stop_on_failure
+            )
+        else:
+            for command in commands:
+                sys.stderr.write(str(command))
+                sys.stderr.write("\n")
+                sys.stderr.flush()
+                if not args.dry_run:
+                    p = subprocess.Popen(
+                        command.command(), env=command.merged_env()
+                    )
+                    p.communicate()
+                    if command.members is not None:
+                        finish_base_snapshot(command, p.returncode)
+                    elif p.returncode != 0:
+                        final_returncode = p.returncode
+                        failed_command = command
+                        if args.stop_on_failure:
+                            break
+    finally:
+        if snapshot_dir:
+            # the saved chroots are owned by root
+            subprocess.call(["sudo", "rm", "-rf", snapshot_dir])
 
     if final_returncode != 0:
         raise subprocess.CalledProcessError(
@@ -15,8 +15,10 @@
 import argparse
 import collections
 import errno
+import json
 import logging
 import os
+import stat
 import sys
 import yaml
 
@@ -85,22 +87,30 @@ class Element(object):
             if self.name in element.depends:
                 self.r_depends.append(element.name)
 
-    def __init__(self, name, path):
+    def __init__(self, name, path, provides=None, depends=None):
         """A new element
 
         :param name: The element name
         :param path: Full path to element.  element-deps and
                      element-provides files will be parsed
+        :param provides: set of provided elements, if already known;
+                         element-provides will not be read
+        :param depends: set of dependencies, if already known;
+                        element-deps will not be read
         """
         self.name = name
         self.path = path
 
         # read the provides & depends files for this element into a
         # set; if the element has them.
-        self.provides = self._get_element_set(
-            os.path.join(path, 'element-provides'))
-        self.depends = self._get_element_set(
-            os.path.join(path, 'element-deps'))
+        if provides is None:
+            provides = self._get_element_set(
+                os.path.join(path, 'element-provides'))
+        if depends is None:
+            depends = self._get_element_set(
+                os.path.join(path, 'element-deps'))
+        self.provides = provides
+        self.depends = depends
 
         # Uncomment to see all elements and deps listed as they're found
         # logger.debug("New element : %s", str(self))
@@ -117,6 +127,103 @@ class Element(object):
                                      ','.join(self.depends))
 
 
+def _stat_key(path):
+    """Identify the version of a file or directory for ElementIndex
+
+    :return: list of inode, size and mtime, or None if path is missing
+    """
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+
+class ElementIndex(object):
+    """Persistent index of the elements in ELEMENTS_PATH directories
+
+    Finding all elements lists every ELEMENTS_PATH directory and reads
+    the element-deps and element-provides files of every element,
+    which is slow for large trees on network filesystems.  The index
+    keeps the listing of each directory, keyed by the inode and mtime
+    of the directory (which change when elements are added, removed
+    or renamed), and the parsed element-deps and element-provides of
+    each element, keyed by the stat of those files.  Only what changed
+    is read again.
+
+    :param path: file to keep the index in
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.changed = False
+        self.dirs = {}
+        self.elements = {}
+        try:
+            with open(path) as f:
+                index = json.load(f)
+            self.dirs = index['dirs']
+            self.elements = index['elements']
+        except (IOError, ValueError, KeyError, TypeError):
+            logger.debug("Not using element index %s", path)
+
+    def list_dir(self, path):
+        """Return a list of (name, path) of the element dirs in path"""
+        key = _stat_key(path)
+        cached = self.dirs.get(path)
+        if cached and cached['key'] == key:
+            return cached['elements']
+
+        elements = [[f, os.path.realpath(os.path.join(path, f))]
+                    for f in os.listdir(path)
+                    if os.path.isdir(os.path.join(path, f))]
+        self.dirs[path] = {'key': key, 'elements': elements}
+        self.changed = True
+        return elements
+
+    def get_element(self, name, path):
+        """Return an Element, reading its files only if they changed"""
+        deps_key = _stat_key(os.path.join(path, 'element-deps'))
+        provides_key = _stat_key(os.path.join(path, 'element-provides'))
+        cached = self.elements.get(path)
+        if (cached and cached['deps_key'] == deps_key and
+                cached['provides_key'] == provides_key):
+            return Element(name, path,
+                           provides=set(cached['provides']),
+                           depends=set(cached['depends']))
+
+        element = Element(name, path)
+        self.elements[path] = {
+            'deps_key': deps_key,
+            'provides_key': provides_key,
+            'depends': sorted(element.depends),
+            'provides': sorted(element.provides),
+        }
+        self.changed = True
+        return element
+
+    def save(self):
+        """Write the index back, if anything changed"""
+        if not self.changed:
+            return
+        # drop elements no longer in any listed directory
+        listed = set(path for d in self.dirs.values()
+                     for name, path in d['elements'])
+        self.elements = dict((k, v) for k, v in self.elements.items()
+                             if k in listed)
+        tmp = '%s.%d' % (self.path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump({'dirs': self.dirs, 'elements': self.elements}, f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            logger.debug("Can not write element index %s: %s", self.path, e)
+        self.changed = False
+
+
 def _get_elements_dir():
     if not os.environ.get('ELEMENTS_PATH'):
         raise Exception("$ELEMENTS_PATH must be set.")
@@ -191,10 +298,16 @@ def _find_all_elements(paths=None):
     :param paths: A list of paths to find elements in.  If None will
                   use ELEMENTS_PATH from environment
 
+    If DIB_ELEMENT_INDEX is set in the environment, it is the path of
+    an ElementIndex file used to avoid re-reading unchanged elements.
+
     :return: a dictionary of all elements
     """
 
     all_elements = {}
+    index = None
+    if os.environ.get('DIB_ELEMENT_INDEX'):
+        index = ElementIndex(os.environ['DIB_ELEMENT_INDEX'])
 
     # note we process the later entries *first*, so that earlier
     # entries will override later ones.  i.e. with
@@ -208,15 +321,22 @@ def _find_all_elements(paths=None):
     logger.debug("ELEMENTS_PATH is: %s", ":".join(paths))
 
     for path in paths:
-        if not os.path.isdir(path):
+        try:
+            is_dir = stat.S_ISDIR(os.stat(path).st_mode)
+        except OSError:
+            is_dir = False
+        if not is_dir:
             raise InvalidElementDir("ELEMENTS_PATH entry '%s' "
                                     "is not a directory " % path)
 
         # In words : make a list of directories in "path".  Since an
         # element is a directory, this is our list of elements.
-        elements = [os.path.realpath(os.path.join(path, f))
-                    for f in os.listdir(path)
-                    if os.path.isdir(os.path.join(path, f))]
+        if index:
+            elements = [element for name, element in index.list_dir(path)]
+        else:
+            elements = [os.path.realpath(os.path.join(path, f))
+                        for f in os.listdir(path)
+                        if os.path.isdir(os.path.join(path, f))]
 
         for element in elements:
             # the element name is the last part of the full path in
@@ -224,17 +344,28 @@ def _find_all_elements(paths=None):
             # above)
             name = os.path.basename(element)
 
-            new_element = Element(name, element)
+            if index:
+                new_element = index.get_element(name, element)
+            else:
+                new_element = Element(name, element)
             if name in all_elements:
                 logger.warning("Element <%s> overrides <%s>",
                                new_element.path, all_elements[name].path)
 
             all_elements[name] = new_element
 
-    # Now we have all the elements, make a call on each element to
-    # store it's reverse dependencies
+    if index:
+        index.save()
+
+    # Now we have all the elements, store their reverse dependencies.
+    # This is done in one pass over the dependencies rather than with
+    # Element._make_rdeps(), which would be quadratic.
+    for element in all_elements.values():
+        element.r_depends = []
     for name, element in all_elements.items():
-        element._make_rdeps(all_elements)
+        for dep in element.depends:
+            if dep in all_elements:
+                all_elements[dep].r_depends.append(name)
 
     return all_elements
 
@@ -295,21 +426,22 @@ def expand_dependencies(user_elements, element_dirs):
     return set([element.name for element in elements])
 
 
-def _output_env_vars(elements):
-    """Output eval-able bash strings for IMAGE_ELEMENT vars
+def _env_vars(elements):
+    """Return eval-able bash strings for IMAGE_ELEMENT vars
 
     :param elements: list of Element objects to represent
     """
+    lines = []
     # first the "legacy" environment variable that just lists the
     # elements
-    print("export IMAGE_ELEMENT='%s'" %
-          ' '.join([element.name for element in elements]))
+    lines.append("export IMAGE_ELEMENT='%s'" %
+                 ' '.join([element.name for element in elements]))
 
     # Then YAML
     output = {}
     for element in elements:
         output[element.name] = element.path
-    print("export IMAGE_ELEMENT_YAML='%s'" % yaml.safe_dump(output))
+    lines.append("export IMAGE_ELEMENT_YAML='%s'" % yaml.safe_dump(output))
 
     # Then bash array.  Unfortunately, bash can't export array
     # variables.  So we take a compromise and produce an exported
@@ -320,10 +452,62 @@ def _output_env_vars(elements):
     output = ""
     for element in elements:
         output += '[%s]=%s ' % (element.name, element.path)
-    print("function get_image_element_array {\n"
-          "  echo \"%s\"\n"
-          "};\n"
-          "export -f get_image_element_array;" % output)
+    lines.append("function get_image_element_array {\n"
+                 "  echo \"%s\"\n"
+                 "};\n"
+                 "export -f get_image_element_array;" % output)
+    return "\n".join(lines) + "\n"
+
+
+def _output_env_vars(elements):
+    """Output eval-able bash strings for IMAGE_ELEMENT vars
+
+    :param elements: list of Element objects to represent
+    """
+    sys.stdout.write(_env_vars(elements))
+
+
+def _hook_inventory(element):
+    """List the hook directories and files of an element
+
+    This skips the same entries generate_hooks in common-functions
+    does not copy.
+
+    :return: dict of directory name to sorted list of files, with
+             top-level files under the key "."
+    """
+    inventory = {".": []}
+    for entry in sorted(os.listdir(element.path)):
+        full = os.path.join(element.path, entry)
+        if os.path.isdir(full):
+            if entry in ("tests", "__pycache__"):
+                continue
+            inventory[entry] = sorted(os.listdir(full))
+        elif not entry.endswith(".pyc"):
+            inventory["."].append(entry)
+    return inventory
+
+
+def _element_info(elements, all_elements):
+    """Collect everything a build needs to know about its elements
+
+    :param elements: list of Element objects of the build
+    :param all_elements: dict as returned by _find_all_elements()
+    :return: dict suitable for JSON output
+    """
+    names = set(element.name for element in elements)
+    return {
+        "elements": [element.name for element in elements],
+        "paths": dict((e.name, e.path) for e in elements),
+        "depends": dict((e.name, sorted(e.depends)) for e in elements),
+        "provides": dict((e.name, sorted(e.provides)) for e in elements),
+        # reverse dependencies within the build
+        "r_depends": dict(
+            (e.name, sorted(set(all_elements[e.name].r_depends) & names))
+            for e in elements),
+        "hooks": dict((e.name, _hook_inventory(e)) for e in elements),
+        "env": _env_vars(elements),
+    }
 
 
 def main():
@@ -336,12 +520,22 @@ def main():
                         default=False,
                         help=('Output eval-able bash strings for '
                               'IMAGE_ELEMENT variables'))
+    parser.add_argument('--json', action='store_true', default=False,
+                        help=('Output a JSON document with the elements, '
+                              'their paths, dependencies, reverse '
+                              'dependencies, provides, hook files and '
+                              'the --env output'))
 
     args = parser.parse_args(sys.argv[1:])
 
-    elements = _get_elements(args.elements)
+    all_elements = _find_all_elements()
+    elements = _expand_element_dependencies(args.elements, all_elements)
 
-    if args.env:
+    if args.json:
+        info = _element_info(elements, all_elements)
+        json.dump(info, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    elif args.env:
         _output_env_vars(elements)
     else:
         # deprecated compatibility output; doesn't include paths.
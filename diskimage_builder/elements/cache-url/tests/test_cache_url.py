@@ -13,29 +13,223 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import http.server
+import io
 import os
-import tempfile
+import sys
+import threading
 import time
 
+import fixtures
+
+from diskimage_builder import cache_url
 from diskimage_builder.tests import base
 
 
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, headers=(), body=b''):
+        self.send_response(status)
+        for header in headers:
+            self.send_header(*header)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, dict(self.headers)))
+        server.clients.add(self.client_address)
+        if server.failures:
+            server.failures -= 1
+            self._send(503)
+            return
+        if self.path == '/redirect':
+            self._send(302, [('Location', '/files/a')])
+            return
+        if self.path == '/redirect-ftp':
+            self._send(302, [('Location', 'ftp://mirror/files/a')])
+            return
+        body = server.files.get(self.path)
+        if body is None:
+            self._send(404)
+            return
+        etag = '"%d"' % hash(body)
+        headers = [('ETag', etag)]
+        if self.headers.get('If-None-Match') == etag and \
+                not server.ignore_conditions:
+            self._send(304, headers)
+            return
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') == etag:
+            start = int(range_header[len('bytes='):-1])
+            headers.append(('Content-Range', 'bytes %d-%d/%d' %
+                            (start, len(body) - 1, len(body))))
+            self._send(206, headers, body[start:])
+            return
+        if server.truncate:
+            # announce the whole body, but send only the start of it
+            server.truncate = False
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self._send(200, headers, body)
+
+
 class TestCacheUrl(base.ScriptTestBase):
+
+    def setUp(self):
+        super(TestCacheUrl, self).setUp()
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      _Handler)
+        self.server.daemon_threads = True
+        self.server.files = {'/files/a': b'a' * 1000, '/files/b': b'b'}
+        self.server.requests = []
+        self.server.clients = set()
+        self.server.failures = 0
+        self.server.truncate = False
+        self.server.ignore_conditions = False
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.useFixture(fixtures.EnvironmentVariable('http_proxy'))
+        self.cache = self.useFixture(fixtures.TempDir()).path
+        self.pool = cache_url.ConnectionPool(timeout=10)
+        self.addCleanup(self.pool.close)
+
+    def _fetch(self, path, dest='a', **kwargs):
+        kwargs.setdefault('retry_delay', 0.01)
+        return cache_url.fetch(self.base_url + path,
+                               os.path.join(self.cache, dest), self.pool,
+                               **kwargs)
+
+    def _read(self, dest='a'):
+        with open(os.path.join(self.cache, dest), 'rb') as f:
+            return f.read()
+
     def test_cache_url_caches(self):
-        tempdir = tempfile.mkdtemp()
-        target = os.path.join(tempdir, 'target')
-        source = 'http://fake/url'
-        # Write fake data to the target file and return success
-        self._stub_script('curl', 'echo "test" > ${3:7:100}\necho 200')
+        target = os.path.join(self.cache, 'target')
+        self.env['DIB_PYTHON_EXEC'] = sys.executable
         self._run_command(
             ['diskimage_builder/elements/cache-url/bin/cache-url',
-             source, target])
+             self.base_url + '/files/a', target])
         self.assertTrue(os.path.exists(target))
         modification_time = os.path.getmtime(target)
         # Make sure that the timestamp would change if the file does
         time.sleep(1)
-        self._stub_script('curl', 'echo "304"')
         self._run_command(
             ['diskimage_builder/elements/cache-url/bin/cache-url',
-             source, target])
+             self.base_url + '/files/a', target])
         self.assertEqual(modification_time, os.path.getmtime(target))
+
+    def test_revalidate(self):
+        self.assertIn('for the first time', self._fetch('/files/a'))
+        self.assertIn('not changed', self._fetch('/files/a'))
+        self.assertNotIn('If-None-Match', self.server.requests[0][1])
+        self.assertEqual('"%d"' % hash(b'a' * 1000),
+                         self.server.requests[1][1]['If-None-Match'])
+
+        self.server.files['/files/a'] = b'new'
+        self.assertIn('has changed', self._fetch('/files/a'))
+        self.assertEqual(b'new', self._read())
+
+    def test_conditions_ignored(self):
+        self._fetch('/files/a')
+        mtime = os.path.getmtime(os.path.join(self.cache, 'a'))
+        self.server.ignore_conditions = True
+        self.assertIn('not changed', self._fetch('/files/a'))
+        self.assertEqual(mtime, os.path.getmtime(os.path.join(self.cache,
+                                                              'a')))
+
+    def test_force(self):
+        self._fetch('/files/a')
+        self.assertIn('forced', self._fetch('/files/a', force=True))
+        headers = self.server.requests[1][1]
+        self.assertNotIn('If-None-Match', headers)
+        self.assertEqual('no-cache, must-revalidate',
+                         headers['Cache-Control'])
+
+    def test_resume(self):
+        self.server.truncate = True
+        self._fetch('/files/a')
+        self.assertEqual(b'a' * 1000, self._read())
+        self.assertEqual(2, len(self.server.requests))
+        self.assertEqual('bytes=500-', self.server.requests[1][1]['Range'])
+        self.assertFalse(os.path.exists(
+            cache_url.state_paths(os.path.join(self.cache, 'a'))[1]))
+
+    def test_resume_changed(self):
+        self.server.truncate = True
+        self.assertRaises(cache_url.DownloadError, self._fetch, '/files/a',
+                          retries=0)
+        # the server copy changes, so it is downloaded again
+        self.server.files['/files/a'] = b'c' * 100
+        self._fetch('/files/a')
+        self.assertEqual(b'c' * 100, self._read())
+        self.assertIn('Range', self.server.requests[1][1])
+
+    def test_retry(self):
+        self.server.failures = 2
+        self._fetch('/files/b', 'b')
+        self.assertEqual(b'b', self._read('b'))
+        self.assertEqual(3, len(self.server.requests))
+
+        self.server.failures = 3
+        e = self.assertRaises(cache_url.DownloadError, self._fetch,
+                              '/files/b', 'b', retries=2)
+        self.assertEqual(1, e.exit_code)
+
+    def test_not_found(self):
+        e = self.assertRaises(cache_url.DownloadError, self._fetch,
+                              '/files/missing')
+        self.assertEqual(cache_url.NOT_FOUND_EXIT, e.exit_code)
+        # not retried
+        self.assertEqual(1, len(self.server.requests))
+        self.assertFalse(os.path.exists(os.path.join(self.cache, 'a')))
+
+    def test_redirect(self):
+        self._fetch('/redirect')
+        self.assertEqual(b'a' * 1000, self._read())
+
+    def test_other_scheme(self):
+        self.useFixture(fixtures.MockPatch(
+            'urllib.request.urlopen',
+            side_effect=lambda url, timeout: io.BytesIO(url.encode())))
+        cache_url.fetch('ftp://mirror/image', os.path.join(self.cache, 'a'),
+                        self.pool)
+        self.assertEqual(b'ftp://mirror/image', self._read())
+        self._fetch('/redirect-ftp')
+        self.assertEqual(b'ftp://mirror/files/a', self._read())
+
+    def test_batch(self):
+        entries = [(self.base_url + '/files/%s' % name,
+                    os.path.join(self.cache, '%s%d' % (name, i)))
+                   for i in range(10) for name in ('a', 'b')]
+        entries.append((self.base_url + '/files/missing',
+                        os.path.join(self.cache, 'missing')))
+        results = cache_url.fetch_all(entries, self.pool, jobs=2,
+                                      retry_delay=0.01)
+        self.assertEqual([None] * 20, [error for _, error in results[:-1]])
+        self.assertEqual(cache_url.NOT_FOUND_EXIT, results[-1][1].exit_code)
+        self.assertEqual(b'b', self._read('b9'))
+        # the connections were kept open for further requests
+        self.assertLessEqual(len(self.server.clients), 2)
+
+    def test_file_url(self):
+        source = os.path.join(self.cache, 'source')
+        with open(source, 'w') as f:
+            f.write('local')
+        cache_url.fetch('file://' + source, os.path.join(self.cache, 'a'),
+                        self.pool)
+        self.assertEqual(b'local', self._read())
@@ -0,0 +1,338 @@
+# Copyright 2026 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Find and copy the shared libraries needed by a set of binaries
+
+This replaces running ldd on every binary put into a ramdisk.  The
+ELF files are read directly: the program interpreter and the
+DT_NEEDED entries are resolved the way the dynamic loader does
+(DT_RPATH, DT_RUNPATH with $ORIGIN, the directories of ld.so.conf and
+the default directories), for all binaries at once and for the
+libraries in turn.  Every library is read and copied once.
+
+The libraries are copied to /lib of the destination, named like the
+file found; if a library is referenced by another name (or the
+interpreter by its absolute path), a symlink is added, as
+copy_required_libs in ramdisk-functions did.
+
+This runs inside the chroot when building ramdisks and must only
+use the standard library.
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import struct
+import sys
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+
+
+class NotELF(Exception):
+    pass
+
+
+class ELFFile(object):
+    """The dynamic linking information of an ELF file
+
+    :ivar elf_class: ELFCLASS32 or ELFCLASS64
+    :ivar machine: e_machine
+    :ivar interp: the program interpreter, None for libraries
+    :ivar needed: list of DT_NEEDED names
+    :ivar rpath: list of DT_RPATH directories
+    :ivar runpath: list of DT_RUNPATH directories
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.interp = None
+        self.needed = []
+        self.rpath = []
+        self.runpath = []
+        with open(path, 'rb') as f:
+            self._read(f)
+
+    def _read(self, f):
+        ident = f.read(16)
+        if len(ident) < 16 or ident[:4] != b'\x7fELF' or \
+           ident[4] not in (ELFCLASS32, ELFCLASS64):
+            raise NotELF(self.path)
+        self.elf_class = ident[4]
+        endian = '<' if ident[5] == 1 else '>'
+        if self.elf_class == ELFCLASS64:
+            header = endian + 'HHIQQQIHHHHHH'
+            phdr = endian + 'IIQQQQQQ'
+            dyn = endian + 'qQ'
+        else:
+            header = endian + 'HHIIIIIHHHHHH'
+            phdr = endian + 'IIIIIIII'
+            dyn = endian + 'iI'
+        fields = struct.unpack(header, f.read(struct.calcsize(header)))
+        self.machine = fields[1]
+        phoff, phentsize, phnum = fields[4], fields[8], fields[9]
+
+        loads = []
+        dynamic = None
+        for i in range(phnum):
+            f.seek(phoff + i * phentsize)
+            p = struct.unpack(phdr, f.read(struct.calcsize(phdr)))
+            if self.elf_class == ELFCLASS64:
+                p_type, p_offset, p_vaddr, p_filesz = p[0], p[2], p[3], p[5]
+            else:
+                p_type, p_offset, p_vaddr, p_filesz = p[0], p[1], p[2], p[4]
+            if p_type == PT_LOAD:
+                loads.append((p_vaddr, p_offset, p_filesz))
+            elif p_type == PT_DYNAMIC:
+                dynamic = (p_offset, p_filesz)
+            elif p_type == PT_INTERP:
+                f.seek(p_offset)
+                self.interp = f.read(p_filesz).rstrip(b'\0').decode()
+        if dynamic is None:
+            # statically linked
+            return
+
+        entries = []
+        size = struct.calcsize(dyn)
+        f.seek(dynamic[0])
+        data = f.read(dynamic[1])
+        for pos in range(0, len(data) - size + 1, size):
+            tag, value = struct.unpack(dyn, data[pos:pos + size])
+            if tag == DT_NULL:
+                break
+            entries.append((tag, value))
+        tags = dict(entries)
+        if DT_STRTAB not in tags:
+            return
+
+        # the string table is given by its address in memory
+        strtab = None
+        for vaddr, offset, filesz in loads:
+            if vaddr <= tags[DT_STRTAB] < vaddr + filesz:
+                strtab = tags[DT_STRTAB] - vaddr + offset
+        if strtab is None:
+            return
+        f.seek(strtab)
+        strings = f.read(tags.get(DT_STRSZ, 65536))
+
+        def string(offset):
+            return strings[offset:strings.index(b'\0', offset)].decode()
+
+        for tag, value in entries:
+            if tag == DT_NEEDED:
+                self.needed.append(string(value))
+            elif tag == DT_RPATH:
+                self.rpath.extend(string(value).split(':'))
+            elif tag == DT_RUNPATH:
+                self.runpath.extend(string(value).split(':'))
+
+
+def read_ld_so_conf(root, conf='/etc/ld.so.conf', seen=None):
+    """The library directories listed in ld.so.conf, with includes"""
+    if seen is None:
+        seen = set()
+    if conf in seen:
+        return []
+    seen.add(conf)
+    dirs = []
+    try:
+        with open(os.path.join(root, conf.lstrip('/'))) as f:
+            lines = f.readlines()
+    except (IOError, OSError):
+        return dirs
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith('include'):
+            for pattern in line.split()[1:]:
+                if not pattern.startswith('/'):
+                    pattern = os.path.join(os.path.dirname(conf), pattern)
+                for path in sorted(glob.glob(
+                        os.path.join(root, pattern.lstrip('/')))):
+                    dirs.extend(read_ld_so_conf(
+                        root, '/' + os.path.relpath(path, root), seen))
+        elif line.startswith('hwcap'):
+            continue
+        else:
+            dirs.append(line)
+    return dirs
+
+
+class Resolver(object):
+    """Resolve the libraries needed by binaries
+
+    :param root: the tree the binaries and libraries are in
+    """
+
+    DEFAULT_DIRS = {
+        ELFCLASS32: ['/lib', '/usr/lib', '/lib32', '/usr/lib32'],
+        ELFCLASS64: ['/lib64', '/usr/lib64', '/lib', '/usr/lib'],
+    }
+
+    def __init__(self, root='/'):
+        self.root = root
+        self.conf_dirs = read_ld_so_conf(root)
+        self.elfs = {}
+
+    def _path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def elf(self, path):
+        """The parsed ELF file at path in the root, None if it is not"""
+        if path not in self.elfs:
+            try:
+                self.elfs[path] = ELFFile(self._path(path))
+            except (NotELF, IOError, OSError, struct.error):
+                self.elfs[path] = None
+        return self.elfs[path]
+
+    def _expand(self, directory, origin, elf):
+        lib = 'lib64' if elf.elf_class == ELFCLASS64 else 'lib'
+        for name, value in (('ORIGIN', origin), ('LIB', lib)):
+            directory = directory.replace('${%s}' % name, value)
+            directory = directory.replace('$%s' % name, value)
+        return directory
+
+    def find(self, name, elf, path, rpath):
+        """Find a needed library like ld.so
+
+        :param name: the DT_NEEDED entry
+        :param elf: the ELF file needing it
+        :param path: its path in the root
+        :param rpath: the DT_RPATH of the objects loading it
+        :return: path of the library in the root, None if not found
+        """
+        if '/' in name:
+            candidates = [name]
+        else:
+            dirs = []
+            if not elf.runpath:
+                dirs.extend(elf.rpath + rpath)
+            dirs.extend(elf.runpath)
+            dirs.extend(self.conf_dirs)
+            dirs.extend(self.DEFAULT_DIRS[elf.elf_class])
+            origin = os.path.dirname(self._realpath(path))
+            candidates = [os.path.join(self._expand(d, origin, elf), name)
+                          for d in dirs if d]
+        for candidate in candidates:
+            lib = self.elf(os.path.normpath(candidate))
+            if lib is not None and lib.elf_class == elf.elf_class and \
+               lib.machine == elf.machine:
+                return os.path.normpath(candidate)
+        return None
+
+    def _realpath(self, path):
+        real = os.path.realpath(self._path(path))
+        return '/' + os.path.relpath(real, os.path.realpath(self.root))
+
+    def resolve(self, binaries):
+        """The libraries needed by the binaries, directly or not
+
+        :param binaries: paths of the binaries in the root
+        :return: list of (name, path) of the libraries, in the order
+                 found; name is the DT_NEEDED entry or the absolute
+                 path of the interpreter
+        """
+        result = []
+        found = set()
+        missing = set()
+        queue = [(b, []) for b in binaries]
+        done = set()
+        while queue:
+            path, rpath = queue.pop(0)
+            if path in done:
+                continue
+            done.add(path)
+            elf = self.elf(path)
+            if elf is None:
+                continue
+            if elf.interp and (elf.interp, elf.interp) not in found:
+                found.add((elf.interp, elf.interp))
+                result.append((elf.interp, elf.interp))
+            # the DT_RPATH of a loader applies to what it loads
+            rpath = elf.rpath + rpath
+            for name in elf.needed:
+                lib = self.find(name, elf, path, rpath)
+                if lib is None:
+                    if name not in missing:
+                        sys.stderr.write("%s: library %s not found\n"
+                                         % (path, name))
+                        missing.add(name)
+                    continue
+                if (name, lib) not in found:
+                    found.add((name, lib))
+                    result.append((name, lib))
+                queue.append((lib, rpath))
+        return result
+
+
+def copy_libs(root, libs, dest):
+    """Copy the libraries into dest/lib like copy_required_libs
+
+    :param root: the tree the libraries are in
+    :param libs: list of (name, path), see Resolver.resolve()
+    :param dest: the ramdisk tree
+    """
+    for name, path in libs:
+        target = '/lib/' + os.path.basename(path)
+        dest_path = os.path.join(dest, target.lstrip('/'))
+        if not os.path.lexists(dest_path):
+            shutil.copy(os.path.join(root, path.lstrip('/')), dest_path)
+        # a symbolic link if the library is referred to by a
+        # different name
+        ref = name if name.startswith('/') else '/lib/' + name
+        if ref != target:
+            link_path = os.path.join(dest, ref.lstrip('/'))
+            if not os.path.lexists(link_path):
+                os.makedirs(os.path.dirname(link_path), exist_ok=True)
+                os.symlink(target, link_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Copy the shared libraries needed by binaries")
+    parser.add_argument('--root', default='/',
+                        help='the tree the binaries are in (default: /)')
+    parser.add_argument('--dest',
+                        help='copy the libraries to DEST/lib; without '
+                        'it they are listed')
+    parser.add_argument('binaries', nargs='+',
+                        help='the binaries, as paths in the root')
+    args = parser.parse_args(sys.argv[1:])
+
+    resolver = Resolver(args.root)
+    libs = resolver.resolve(args.binaries)
+    if args.dest:
+        copy_libs(args.root, libs, args.dest)
+    else:
+        for name, path in libs:
+            print("%s => %s" % (name, path))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,333 @@
+# Copyright 2026 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Estimate the file system size needed for the built tree
+
+The tree is walked once, with directories scanned by a pool of
+threads.  For every file the space it will take in the target file
+system is estimated: data rounded up to the file system block size
+(only the allocated part of sparse files), hardlinked files once,
+directories by their entries and short symlinks stored in the inode.
+The file system overhead (inode tables, reserved blocks, metadata and
+log) is then added according to the root file system type.
+
+The same walk produces the usage report of DIB_SHOW_IMAGE_USAGE.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import logging
+import math
+import os
+import stat
+import sys
+
+import diskimage_builder.logging_config
+
+logger = logging.getLogger(__name__)
+
+KiB = 1024
+MiB = 1024 * KiB
+
+# Layout of the supported root file system types
+#  block_size: allocation unit of file data
+#  inode_size: bytes per on-disk inode
+#  bytes_per_inode: for file systems with a fixed inode table, one
+#    inode is created per this many bytes of the file system (ext4 is
+#    created with "-i 4096" by disk-image-create).  None if inodes
+#    are allocated as needed.
+#  inode_chunk: number of inodes allocated together (xfs)
+#  fast_symlink: symlinks up to this length are stored in the inode
+#  dirent: fixed part of a directory entry (the name is added,
+#    rounded up to 4 bytes)
+#  reserved: fraction of the file system reserved or used by metadata
+#    scaling with its size (reserved blocks, bitmaps, group
+#    descriptors, allocation btrees)
+#  log: fixed size metadata, mostly the journal/log, in bytes.  The
+#    ext4 journal is added by disk-image-create itself (see
+#    DIB_JOURNAL_SIZE).
+FSTYPES = {
+    'ext2': dict(block_size=4096, inode_size=256, bytes_per_inode=16384,
+                 inode_chunk=1, fast_symlink=59, dirent=8, reserved=0.06,
+                 log=0),
+    'ext3': dict(block_size=4096, inode_size=256, bytes_per_inode=16384,
+                 inode_chunk=1, fast_symlink=59, dirent=8, reserved=0.06,
+                 log=64 * MiB),
+    'ext4': dict(block_size=4096, inode_size=256, bytes_per_inode=4096,
+                 inode_chunk=1, fast_symlink=59, dirent=8, reserved=0.06,
+                 log=0),
+    'xfs': dict(block_size=4096, inode_size=512, bytes_per_inode=None,
+                inode_chunk=64, fast_symlink=300, dirent=12, reserved=0.04,
+                log=64 * MiB),
+    'btrfs': dict(block_size=4096, inode_size=320, bytes_per_inode=None,
+                  inode_chunk=1, fast_symlink=2048, dirent=30,
+                  reserved=0.10, log=256 * MiB),
+    'vfat': dict(block_size=4096, inode_size=0, bytes_per_inode=None,
+                 inode_chunk=1, fast_symlink=0, dirent=32, reserved=0.02,
+                 log=0),
+}
+
+# Space for the changes done after the size is calculated (finalise
+# hooks regenerating the initramfs, bootloader installation, ...)
+HEADROOM = 0.15
+HEADROOM_MIN = 128 * MiB
+
+# Entries smaller than this are left out of the default usage report
+REPORT_THRESHOLD = 10 * MiB
+
+
+def _round_up(value, multiple):
+    return -(-value // multiple) * multiple
+
+
+class DirStats(object):
+    """Results of scanning one directory (not recursive)"""
+
+    def __init__(self, path):
+        self.path = path
+        # estimated bytes in the target file system
+        self.fs_bytes = 0
+        # allocated bytes in the source tree, like du reports them
+        self.du_bytes = 0
+        self.inodes = 0
+        self.subdirs = []
+        # files with more than one link: (dev, ino) -> (path, fs, du)
+        self.links = {}
+        # (du bytes, path) of files for the usage report
+        self.files = []
+
+
+def scan_dir(path, dev, fstype, report_threshold):
+    """Scan a directory
+
+    :param path: directory to scan
+    :param dev: device of the tree; other file systems are skipped
+    :param fstype: entry of FSTYPES
+    :param report_threshold: collect files at least this size for the
+                             report (None: do not collect)
+    :return: DirStats
+    """
+    bs = fstype['block_size']
+    result = DirStats(path)
+    dirents = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            st = entry.stat(follow_symlinks=False)
+            dirents += _round_up(fstype['dirent'] + len(entry.name), 4)
+            if st.st_dev != dev:
+                # a mount point, like du -x only the directory counts
+                result.inodes += 1
+                continue
+            du = st.st_blocks * 512
+            if stat.S_ISDIR(st.st_mode):
+                result.subdirs.append(entry.path)
+                # the directory itself is accounted when scanning it
+                continue
+            if stat.S_ISREG(st.st_mode):
+                # only the allocated part of sparse files
+                fs = _round_up(min(st.st_size, du), bs)
+            elif stat.S_ISLNK(st.st_mode):
+                fs = 0 if st.st_size <= fstype['fast_symlink'] \
+                    else _round_up(st.st_size, bs)
+            else:
+                # devices, fifos and sockets only need the inode
+                fs = 0
+            if st.st_nlink > 1:
+                key = (st.st_dev, st.st_ino)
+                result.links[key] = (entry.path, fs, du)
+                continue
+            result.inodes += 1
+            result.fs_bytes += fs
+            result.du_bytes += du
+            if report_threshold is not None and du >= report_threshold:
+                result.files.append((du, entry.path))
+
+    st = os.lstat(path)
+    result.inodes += 1
+    result.fs_bytes += max(bs, _round_up(dirents, bs))
+    result.du_bytes += st.st_blocks * 512
+    return result
+
+
+class TreeSize(object):
+    """Size of a tree, in the source and the target file system"""
+
+    def __init__(self):
+        self.fs_bytes = 0
+        self.du_bytes = 0
+        self.inodes = 0
+        # path -> du bytes including everything below it
+        self.dirs = {}
+        # (du bytes, path) of the files in the report
+        self.files = []
+
+
+def walk(root, fstype, workers=None, report_threshold=None):
+    """Walk a tree once, scanning directories in parallel
+
+    :param root: the tree
+    :param fstype: entry of FSTYPES
+    :param workers: number of threads (default: a few per CPU, as the
+                    scans mostly wait for the file system)
+    :param report_threshold: minimum size of the report entries, None
+                             for no report
+    :return: TreeSize
+    """
+    if workers is None:
+        workers = min(32, (os.cpu_count() or 1) * 4)
+    dev = os.lstat(root).st_dev
+    total = TreeSize()
+    seen_links = set()
+    dir_bytes = collections.defaultdict(int)
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        pending = set([pool.submit(scan_dir, root, dev, fstype,
+                                   report_threshold)])
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                for subdir in result.subdirs:
+                    pending.add(pool.submit(scan_dir, subdir, dev, fstype,
+                                            report_threshold))
+                # hardlinks are counted where they are seen first
+                for key, (path, fs, du) in result.links.items():
+                    if key in seen_links:
+                        continue
+                    seen_links.add(key)
+                    result.inodes += 1
+                    result.fs_bytes += fs
+                    result.du_bytes += du
+                    if report_threshold is not None and \
+                       du >= report_threshold:
+                        result.files.append((du, path))
+                total.fs_bytes += result.fs_bytes
+                total.du_bytes += result.du_bytes
+                total.inodes += result.inodes
+                total.files.extend(result.files)
+                dir_bytes[result.path] += result.du_bytes
+
+    if report_threshold is not None:
+        # add up the directories from the deepest
+        for path in sorted(dir_bytes, key=lambda p: p.count(os.sep),
+                           reverse=True):
+            if path != root:
+                dir_bytes[os.path.dirname(path)] += dir_bytes[path]
+        total.dirs = dict((p, b) for p, b in dir_bytes.items()
+                          if b >= report_threshold)
+    return total
+
+
+def fs_size(tree, fstype):
+    """The size of a file system holding a tree, in bytes
+
+    Without any headroom for later changes; see image_size().
+    """
+    used = tree.fs_bytes + fstype['log']
+    fraction = fstype['reserved']
+    if fstype['bytes_per_inode']:
+        # a fixed inode table, taking a fraction of the file system
+        fraction += float(fstype['inode_size']) / fstype['bytes_per_inode']
+    else:
+        used += _round_up(tree.inodes, fstype['inode_chunk']) * \
+            fstype['inode_size']
+    size = used / (1 - fraction)
+    if fstype['bytes_per_inode']:
+        # and enough inodes, with some to spare
+        size = max(size, tree.inodes * fstype['bytes_per_inode'] * 1.1)
+    return int(_round_up(int(math.ceil(size)), fstype['block_size']))
+
+
+def image_size(tree, fstype):
+    """The size to create the file system with, in bytes"""
+    size = fs_size(tree, fstype)
+    size += max(HEADROOM_MIN, size * HEADROOM)
+    return int(_round_up(int(size), fstype['block_size']))
+
+
+def _iec(value):
+    """Format like numfmt --to=iec-i --suffix=B"""
+    for unit in ("", "Ki", "Mi", "Gi", "Ti"):
+        if value < 1024 or unit == "Ti":
+            break
+        value /= 1024.0
+    if unit and value < 10:
+        return "%.1f%sB" % (math.ceil(value * 10) / 10, unit)
+    return "%d%sB" % (math.ceil(value), unit)
+
+
+def format_report(tree, full=False):
+    """The usage report, largest entries first"""
+    entries = tree.files + [(b, p) for p, b in tree.dirs.items()]
+    if full:
+        title = "Image size report"
+    else:
+        title = "Image size report (files > 10MiB)"
+        entries = [e for e in entries if e[0] >= REPORT_THRESHOLD]
+    lines = ["=" * len(title), title, "=" * len(title)]
+    for size, path in sorted(entries, reverse=True):
+        lines.append("%7s\t%s" % (_iec(size), path))
+    lines.extend(["", "===== end image size report =====", ""])
+    return "\n".join(lines)
+
+
+def main():
+    diskimage_builder.logging_config.setup()
+
+    parser = argparse.ArgumentParser(
+        description="Estimate the image size needed for a tree.  The "
+        "size in KiB is printed to stdout, the usage report to stderr.")
+    parser.add_argument('--fstype', default='ext4',
+                        help='root file system type (default: ext4)')
+    parser.add_argument('--extra-size', type=int, metavar='KiB',
+                        help='add this instead of the default headroom')
+    parser.add_argument('--workers', type=int,
+                        help='number of directory scanning threads')
+    parser.add_argument('--report', action='store_true',
+                        help='show files and directories over 10MiB')
+    parser.add_argument('--report-full', action='store_true',
+                        help='show all files and directories')
+    parser.add_argument('tree', help='the built tree')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.fstype not in FSTYPES:
+        logger.warning("Unknown file system type [%s], sizing as ext4",
+                       args.fstype)
+    fstype = FSTYPES.get(args.fstype, FSTYPES['ext4'])
+
+    threshold = None
+    if args.report_full:
+        threshold = 0
+    elif args.report:
+        threshold = REPORT_THRESHOLD
+    tree = walk(args.tree, fstype, args.workers, threshold)
+    logger.debug("%d inodes, %d bytes on disk, %d bytes in the image",
+                 tree.inodes, tree.du_bytes, tree.fs_bytes)
+
+    if args.extra_size is not None:
+        size = fs_size(tree, fstype) + args.extra_size * KiB
+    else:
+        size = image_size(tree, fstype)
+    print(size // KiB)
+
+    if threshold is not None:
+        sys.stderr.write(format_report(tree, args.report_full))
+        sys.stderr.flush()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+# Copyright 2026 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Copy a selection of kernel modules and their firmware
+
+Instead of the whole module tree, only the modules matching a list of
+patterns are copied into a ramdisk, with the modules they depend on
+(modules.dep and the soft dependencies in modules.softdep) and the
+firmware files they name (modinfo -F firmware).  depmod is then run
+on the copy.
+
+A pattern is one of
+
+* a path in the kernel/ directory of the modules, e.g.
+  ``drivers/net/ethernet`` (a directory, all modules below it) or
+  ``drivers/scsi/*.ko*``
+* ``alias:`` and a modalias pattern, e.g. ``alias:pci:v00008086d*``
+  (matched against the aliases of modules.alias) or
+  ``alias:virtio:*``
+* a module name, e.g. ``e1000e`` or ``virtio_*``
+
+Framebuffer drivers (``drivers/video/*fb.ko``) are never copied, so the
+console stays in text mode.
+
+This runs inside the chroot when building ramdisks and must only
+use the standard library.
+"""
+
+import argparse
+import fnmatch
+import glob
+import os
+import shutil
+import subprocess
+import sys
+
+# Files of the module directory that are not generated by depmod
+KEEP_FILES = ('modules.order', 'modules.builtin', 'modules.builtin.modinfo')
+
+# Endings of (compressed) module and firmware files
+MODULE_SUFFIXES = ('.ko', '.ko.xz', '.ko.zst', '.ko.gz')
+FIRMWARE_SUFFIXES = ('', '.xz', '.zst')
+
+
+def module_name(path):
+    """The name of a module, as used by modprobe, from its file name"""
+    name = os.path.basename(path)
+    for suffix in MODULE_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return name.replace('-', '_')
+
+
+def _read_lines(path):
+    try:
+        with open(path) as f:
+            return [line.strip() for line in f
+                    if line.strip() and not line.startswith('#')]
+    except (IOError, OSError):
+        return []
+
+
+def read_modules_dep(module_dir):
+    """Read modules.dep
+
+    :return: dict of module path (relative to module_dir) to the
+             list of paths it depends on
+    """
+    deps = {}
+    for line in _read_lines(os.path.join(module_dir, 'modules.dep')):
+        path, _, needed = line.partition(':')
+        deps[path] = needed.split()
+    return deps
+
+
+def read_aliases(module_dir):
+    """Read modules.alias: list of (alias pattern, module name)"""
+    aliases = []
+    for line in _read_lines(os.path.join(module_dir, 'modules.alias')):
+        fields = line.split()
+        if len(fields) == 3 and fields[0] == 'alias':
+            aliases.append((fields[1], fields[2].replace('-', '_')))
+    return aliases
+
+
+def read_softdeps(module_dir):
+    """Read modules.softdep: dict of module name to the names of the
+    modules to load before and after it"""
+    softdeps = {}
+    for line in _read_lines(os.path.join(module_dir, 'modules.softdep')):
+        fields = line.split()
+        if len(fields) < 2 or fields[0] != 'softdep':
+            continue
+        names = softdeps.setdefault(fields[1].replace('-', '_'), [])
+        names.extend(f.replace('-', '_') for f in fields[2:]
+                     if f not in ('pre:', 'post:'))
+    return softdeps
+
+
+def _is_framebuffer(path):
+    return path.startswith('kernel/drivers/video/') and \
+        module_name(path).endswith('fb')
+
+
+def select_modules(module_dir, patterns):
+    """The modules matching the patterns, and what they need
+
+    :param module_dir: the /lib/modules/<version> directory
+    :param patterns: list of patterns, see the module documentation
+    :return: sorted list of module paths relative to module_dir
+    """
+    deps = read_modules_dep(module_dir)
+    by_name = {}
+    for path in deps:
+        by_name.setdefault(module_name(path), path)
+
+    wanted = set()
+    aliases = read_aliases(module_dir)
+    for pattern in patterns:
+        if pattern.startswith('alias:'):
+            alias = pattern[len('alias:'):]
+            wanted.update(name for a, name in aliases
+                          if fnmatch.fnmatch(a, alias))
+        elif '/' in pattern:
+            pattern = pattern.strip('/')
+            if not pattern.startswith('kernel/'):
+                pattern = 'kernel/' + pattern
+            wanted.update(module_name(path) for path in deps
+                          if fnmatch.fnmatch(path, pattern) or
+                          path.startswith(pattern + '/'))
+        else:
+            pattern = pattern.replace('-', '_')
+            wanted.update(name for name in by_name
+                          if fnmatch.fnmatch(name, pattern))
+
+    def lookup(name):
+        # soft dependencies can be given by an alias, e.g. crc32c
+        if name in by_name:
+            return [by_name[name]]
+        return [by_name[m] for a, m in aliases
+                if m in by_name and fnmatch.fnmatch(name, a)]
+
+    softdeps = read_softdeps(module_dir)
+    selected = set()
+    queue = sorted(by_name[name] for name in wanted if name in by_name)
+    while queue:
+        path = queue.pop()
+        if path in selected or _is_framebuffer(path):
+            continue
+        selected.add(path)
+        queue.extend(deps.get(path, []))
+        for name in softdeps.get(module_name(path), []):
+            queue.extend(lookup(name))
+    return sorted(selected)
+
+
+def module_firmware(module_dir, modules):
+    """The firmware names of the modules, with modinfo"""
+    if not modules:
+        return []
+    out = subprocess.check_output(
+        ['modinfo', '-F', 'firmware'] +
+        [os.path.join(module_dir, m) for m in modules])
+    return sorted(set(out.decode().split()))
+
+
+def find_firmware(firmware_dir, names):
+    """The files of the named firmware, relative to firmware_dir
+
+    Missing firmware is skipped: modules name all the firmware they
+    can use, distributions do not ship all of it.
+    """
+    files = set()
+    for name in names:
+        for suffix in FIRMWARE_SUFFIXES:
+            # a few modules give a glob
+            for path in glob.glob(os.path.join(firmware_dir, name + suffix)):
+                if os.path.isfile(path):
+                    files.add(os.path.relpath(path, firmware_dir))
+    return sorted(files)
+
+
+def _copy(src_dir, dest_dir, paths):
+    for path in paths:
+        dest = os.path.join(dest_dir, path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copy2(os.path.join(src_dir, path), dest)
+
+
+def copy_modules(module_dir, firmware_dir, dest, version, patterns):
+    """Copy the selected modules and firmware, and run depmod
+
+    :param module_dir: the modules to copy from
+    :param firmware_dir: the firmware to copy from
+    :param dest: the root of the ramdisk
+    :param version: the kernel version, the name of the module
+                    directory in dest/lib/modules
+    :param patterns: list of patterns, see select_modules()
+    :return: (number of modules, number of firmware files) copied
+    """
+    modules = select_modules(module_dir, patterns)
+    dest_modules = os.path.join(dest, 'lib', 'modules', version)
+    os.makedirs(dest_modules, exist_ok=True)
+    _copy(module_dir, dest_modules, modules)
+    _copy(module_dir, dest_modules,
+          [f for f in KEEP_FILES
+           if os.path.exists(os.path.join(module_dir, f))])
+
+    firmware = []
+    if firmware_dir and os.path.isdir(firmware_dir):
+        firmware = find_firmware(firmware_dir,
+                                 module_firmware(module_dir, modules))
+        _copy(firmware_dir, os.path.join(dest, 'lib', 'firmware'), firmware)
+
+    subprocess.check_call(['depmod', '-b', dest, version])
+    return len(modules), len(firmware)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Copy selected kernel modules into a ramdisk")
+    parser.add_argument('--kernel-version', required=True,
+                        help='name of the module directory to create')
+    parser.add_argument('--firmware-dir',
+                        help='directory to copy the firmware from')
+    parser.add_argument('module_dir',
+                        help='the /lib/modules/<version> to copy from')
+    parser.add_argument('dest', help='the root of the ramdisk')
+    parser.add_argument('patterns', nargs='+',
+                        help='modules to copy, see the documentation')
+    args = parser.parse_args(sys.argv[1:])
+
+    modules, firmware = copy_modules(args.module_dir, args.firmware_dir,
+                                     args.dest, args.kernel_version,
+                                     args.patterns)
+    print("Copied %d modules and %d firmware files" % (modules, firmware))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -20,13 +20,26 @@
 #
 # The overhead of running python should be less than execing `date` a million
 # times during a run.
+#
+# With --buffered, input is read and written in blocks instead of line by
+# line, which keeps up with the output of xtrace; output is delayed by at
+# most --flush-interval.  The output file can be compressed with --compress.
 
 import argparse
 import datetime
+import gzip
+import os
 import re
+import select
+import subprocess
 import sys
+import time
 
 IGNORE_LINES = re.compile(r'(set \+o|xtrace)')
+IGNORE_BYTES = re.compile(br'(set \+o|xtrace)')
+
+# Size of the reads in the buffered mode
+READ_SIZE = 1024 * 1024
 
 
 def get_options():
@@ -41,6 +54,19 @@ def get_options():
     parser.add_argument('-b', '--no-timestamp', action='store_true',
                         help='Do not prefix stdout with timestamp (bare)',
                         default=False)
+    parser.add_argument('--buffered', action='store_true',
+                        help='Read and write in blocks, flushed after '
+                        '--flush-interval or --flush-size',
+                        default=False)
+    parser.add_argument('--flush-interval', type=float, default=0.5,
+                        help='Seconds to keep output buffered '
+                        '(default: 0.5)')
+    parser.add_argument('--flush-size', type=int, default=65536,
+                        help='Bytes to keep output buffered '
+                        '(default: 65536)')
+    parser.add_argument('--compress', choices=['gzip', 'zstd'],
+                        help='Compress the output file',
+                        default=None)
     return parser.parse_args()
 
 
@@ -49,12 +75,146 @@ def skip_line(line):
     return IGNORE_LINES.search(line) is not None
 
 
-def main():
-    opts = get_options()
-    outfile = None
-    if opts.outfile:
-        outfile = open(opts.outfile, 'ab', 0)
+class Timestamp(object):
+    """The timestamp prefix of a line
+
+    Formatting the time is the most expensive part of filtering a
+    line; it is done once per millisecond.
+    """
+
+    def __init__(self):
+        self.ms = None
+        self.value = b''
+
+    def prefix(self):
+        ms = int(time.time() * 1000)
+        if ms != self.ms:
+            self.ms = ms
+            self.value = ("%s.%03d | " % (
+                time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ms // 1000)),
+                ms % 1000)).encode()
+        return self.value
+
+
+class ZstdFile(object):
+    """Append to a file through zstd"""
+
+    def __init__(self, path):
+        with open(path, 'ab') as f:
+            self.proc = subprocess.Popen(['zstd', '-q', '-c'],
+                                         stdin=subprocess.PIPE, stdout=f)
+
+    def write(self, data):
+        self.proc.stdin.write(data)
+
+    def flush(self):
+        self.proc.stdin.flush()
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+
+def open_outfile(path, compress):
+    """Open the output file for appending, compressed or not"""
+    if compress == 'gzip':
+        # a new gzip member is appended; gzip -d reads them all
+        return gzip.open(path, 'ab')
+    if compress == 'zstd':
+        return ZstdFile(path)
+    return open(path, 'ab', 0)
+
+
+def filter_lines(data):
+    """The lines of a block of complete lines to keep"""
+    lines = data.split(b'\n')
+    if IGNORE_BYTES.search(data) is not None:
+        lines = [line for line in lines
+                 if IGNORE_BYTES.search(line) is None]
+    return lines
 
+
+def run_buffered(opts, outfile):
+    """Filter stdin in blocks
+
+    stdin is read in large blocks; the complete lines of a block are
+    filtered and timestamped together.  Output is written when it has
+    waited for --flush-interval seconds or --flush-size bytes are
+    collected.
+    """
+    fd = sys.stdin.fileno()
+    stdout = sys.stdout.buffer
+    timestamp = Timestamp()
+    tail = b''
+    ts_blocks = []
+    bare_blocks = []
+    pending_size = 0
+    deadline = None
+    eof = False
+
+    def add(lines, end):
+        prefix = timestamp.prefix()
+        ts_blocks.append(prefix + (b'\n' + prefix).join(lines) + end)
+        if opts.no_timestamp:
+            bare_blocks.append(b'\n'.join(lines) + end)
+        return len(ts_blocks[-1])
+
+    def flush():
+        if opts.verbose:
+            stdout.write(b''.join(bare_blocks if opts.no_timestamp
+                                  else ts_blocks))
+            stdout.flush()
+        if outfile:
+            outfile.write(b''.join(ts_blocks))
+            outfile.flush()
+        del ts_blocks[:]
+        del bare_blocks[:]
+
+    try:
+        while not eof:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0, deadline - time.monotonic())
+            ready, _, _ = select.select([fd], [], [], timeout)
+            lines = []
+            if ready:
+                data = os.read(fd, READ_SIZE)
+                end = b'\n'
+                if not data:
+                    # the last line may have no newline
+                    eof = True
+                    if tail:
+                        lines = filter_lines(tail)
+                        tail = b''
+                        end = b''
+                else:
+                    data = tail + data
+                    split = data.rfind(b'\n')
+                    tail = data[split + 1:]
+                    if split >= 0:
+                        lines = filter_lines(data[:split])
+            if lines:
+                pending_size += add(lines, end)
+                if deadline is None:
+                    deadline = time.monotonic() + opts.flush_interval
+            if deadline is not None and (eof
+                                         or pending_size >= opts.flush_size
+                                         or time.monotonic() >= deadline):
+                flush()
+                pending_size = 0
+                deadline = None
+    finally:
+        # interrupted (e.g. ^C in select): do not lose what was
+        # already read, including an unterminated last line
+        lines = filter_lines(tail) if tail else []
+        if lines:
+            add(lines, b'')
+        if ts_blocks:
+            flush()
+
+
+def run_lines(opts, outfile):
+    """Filter stdin line by line, writing every line immediately"""
     # Otherwise fileinput reprocess args as files
     sys.argv = []
     for line in iter(sys.stdin.readline, ''):
@@ -79,6 +239,22 @@ def main():
             outfile.flush()
 
 
+def main():
+    opts = get_options()
+    outfile = None
+    if opts.outfile:
+        outfile = open_outfile(opts.outfile, opts.compress)
+
+    try:
+        if opts.buffered:
+            run_buffered(opts, outfile)
+        else:
+            run_lines(opts, outfile)
+    finally:
+        if outfile:
+            outfile.close()
+
+
 if __name__ == '__main__':
     try:
         sys.exit(main())
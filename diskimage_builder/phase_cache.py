@@ -0,0 +1,325 @@
+# Copyright 2026 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Content addressed cache of the chroot after each build phase
+
+The key of a phase is chained from the key of the previous phase, the
+hooks of the phase, the environment.d files, the other (non-phase)
+files in the hooks directory and the DIB_* environment.  Changing a
+post-install.d script therefore only invalidates the post-install
+entry, and a rebuild can restore the chroot as it was after install.d
+and continue from there.
+
+Phases can modify the hooks directory too (extra-data.d hooks write
+data files there, install-types rewrites install.d).  Each entry
+records which top-level hooks entries differed from the freshly
+generated ("pristine") tree when it was saved, together with the
+pristine hash they had.  An entry is only used if those pristine
+hashes still match, and restoring it copies the modified entries back
+over the freshly generated hooks.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import diskimage_builder.logging_config
+
+logger = logging.getLogger(__name__)
+
+# The cached phases, in build order; the hooks directory of each
+# phase is "<phase>.d"
+PHASES = ("root", "extra-data", "pre-install", "install", "post-install")
+
+# Variables which differ between otherwise identical builds
+VOLATILE_ENV = ("DIB_ARGS", "DIB_ENV", "DIB_DEBUG_TRACE", "DIB_QUIET",
+                "DIB_NO_TIMESTAMP")
+
+# Non DIB_* variables which influence the phases
+EXTRA_ENV = ("ARCH", "IMAGE_ELEMENT")
+
+
+def tree_hash(path):
+    """Hash the names, modes, link targets and content of a tree
+
+    :param path: file or directory; symlinks are not followed
+    :return: hex digest
+    """
+    h = hashlib.sha256()
+
+    def _add(full, rel):
+        st = os.lstat(full)
+        h.update(("%s\0%o\0" % (rel, st.st_mode)).encode())
+        if os.path.islink(full):
+            h.update(os.readlink(full).encode())
+        elif os.path.isfile(full):
+            with open(full, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+        h.update(b"\0")
+
+    _add(path, ".")
+    if os.path.isdir(path) and not os.path.islink(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(dirs + files):
+                full = os.path.join(root, name)
+                _add(full, os.path.relpath(full, path))
+    return h.hexdigest()
+
+
+def hooks_hashes(hooks):
+    """Map each top-level entry of the hooks directory to its tree_hash"""
+    return dict((name, tree_hash(os.path.join(hooks, name)))
+                for name in sorted(os.listdir(hooks)))
+
+
+def environment_hash(environ, extra=None):
+    """Hash the environment variables relevant to the build phases
+
+    Values referring to the per-build temporary directories are
+    skipped as they are different on every build.
+    """
+    volatile_dirs = [environ[v] for v in ("TMP_BUILD_DIR", "TMP_IMAGE_DIR")
+                     if environ.get(v)]
+    h = hashlib.sha256()
+    for k in sorted(environ):
+        if not (k.startswith("DIB_") or k in EXTRA_ENV):
+            continue
+        if k in VOLATILE_ENV or k.startswith("DIB_PHASE_CACHE"):
+            continue
+        v = environ[k]
+        if [d for d in volatile_dirs if d in v]:
+            continue
+        h.update(("%s=%s\0" % (k, v)).encode())
+    if extra:
+        h.update(extra.encode())
+    return h.hexdigest()
+
+
+def phase_keys(pristine, env_hash):
+    """Calculate the cache key of each phase
+
+    :param pristine: hooks_hashes() of the generated hooks directory
+    :param env_hash: environment_hash() of the build
+    :return: dict of phase to key
+    """
+    common = hashlib.sha256(env_hash.encode())
+    for name in sorted(pristine):
+        # every phase has its own key input, everything else
+        # (environment.d, bin/, data files) is shared by all phases
+        if name.endswith(".d") and name != "environment.d":
+            continue
+        common.update(("%s\0%s\0" % (name, pristine[name])).encode())
+
+    keys = {}
+    key = ""
+    for phase in PHASES:
+        h = hashlib.sha256()
+        for part in (key, phase, pristine.get("%s.d" % phase, ""),
+                     common.hexdigest()):
+            h.update(part.encode() + b"\0")
+        key = h.hexdigest()
+        keys[phase] = key
+    return keys
+
+
+class PhaseCache(object):
+    """Save and restore the chroot after each phase
+
+    :param cache_dir: directory holding the cache entries
+    :param state_file: file keeping the pristine hooks hashes and phase
+                       keys between invocations during one build
+    """
+
+    def __init__(self, cache_dir, state_file):
+        self.cache_dir = cache_dir
+        self.state_file = state_file
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _load_state(self):
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def plan(self, hooks, environ, extra=None):
+        """Calculate and store the keys of the freshly generated hooks"""
+        pristine = hooks_hashes(hooks)
+        state = {
+            "hooks": hooks,
+            "pristine": pristine,
+            "keys": phase_keys(pristine, environment_hash(environ, extra)),
+        }
+        with open(self.state_file, "w") as f:
+            json.dump(state, f)
+        return state
+
+    def _usable(self, meta, pristine):
+        for name, saved_hash in meta["modified"].items():
+            if pristine.get(name) != saved_hash:
+                logger.debug("Entry for %s modified %s which has changed",
+                             meta["phase"], name)
+                return False
+        return True
+
+    def restore(self, root):
+        """Restore the latest cached phase into root
+
+        :return: the restored phase, or None
+        """
+        state = self._load_state()
+        hooks = state["hooks"]
+        for phase in reversed(PHASES):
+            entry = self._entry(state["keys"][phase])
+            try:
+                with open(os.path.join(entry, "meta.json")) as f:
+                    meta = json.load(f)
+            except IOError:
+                continue
+            if not self._usable(meta, state["pristine"]):
+                continue
+
+            logger.info("Restoring chroot after %s from %s", phase, entry)
+            subprocess.check_call(["sudo", "cp", "-a", "--reflink=auto",
+                                   os.path.join(entry, "root") + "/.",
+                                   root])
+            for name in meta["modified"]:
+                path = os.path.join(hooks, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                elif os.path.lexists(path):
+                    os.unlink(path)
+                saved = os.path.join(entry, "hooks", name)
+                if os.path.lexists(saved):
+                    subprocess.check_call(["cp", "-a", "--reflink=auto",
+                                           saved, path])
+            # mark as recently used for prune()
+            os.utime(entry, None)
+            return phase
+        return None
+
+    def save(self, root, phase):
+        """Save root and the modified hooks entries after phase"""
+        state = self._load_state()
+        hooks = state["hooks"]
+        pristine = state["pristine"]
+        entry = self._entry(state["keys"][phase])
+        if os.path.exists(entry):
+            return
+
+        current = hooks_hashes(hooks)
+        modified = {}
+        for name in set(current) | set(pristine):
+            if current.get(name) != pristine.get(name):
+                modified[name] = pristine.get(name)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = "%s.tmp.%d" % (entry, os.getpid())
+        os.makedirs(os.path.join(tmp, "hooks"))
+        for name in modified:
+            if name in current:
+                subprocess.check_call(["cp", "-a", "--reflink=auto",
+                                       os.path.join(hooks, name),
+                                       os.path.join(tmp, "hooks", name)])
+        logger.info("Saving chroot after %s to %s", phase, entry)
+        # Copy through a plain (not recursive) bind mount of root, which
+        # only shows the chroot's own files.  The kernel filesystems and
+        # the host caches bind mounted by root.d hooks are not part of
+        # the chroot; "cp -x" is not enough as a bind mount from the
+        # same filesystem does not change the device.  The caches are
+        # mounted again on restore by re-running the root.d hooks
+        # marked "cache" (see remount_caches in common-functions).
+        view = tmp + ".view"
+        os.makedirs(view)
+        subprocess.check_call(["sudo", "mount", "--bind", root, view])
+        try:
+            subprocess.check_call(["sudo", "cp", "-a", "--reflink=auto",
+                                   view + "/.", os.path.join(tmp, "root")])
+        finally:
+            subprocess.check_call(["sudo", "umount", view])
+            os.rmdir(view)
+        meta = {
+            "phase": phase,
+            "modified": modified,
+        }
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # a concurrent build saved the same entry first
+            subprocess.check_call(["sudo", "rm", "-rf", tmp])
+
+    def prune(self, max_age):
+        """Remove entries not used for max_age days"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        cutoff = time.time() - max_age * 24 * 60 * 60
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if os.path.getmtime(path) < cutoff:
+                logger.info("Pruning phase cache entry %s", path)
+                subprocess.check_call(["sudo", "rm", "-rf", path])
+
+
+def main():
+    diskimage_builder.logging_config.setup()
+
+    parser = argparse.ArgumentParser(
+        description="Save and restore the chroot after each build phase")
+    parser.add_argument('--cache-dir', required=True,
+                        help='directory holding the cache entries')
+    parser.add_argument('--state', required=True,
+                        help='state file of this build')
+    subparsers = parser.add_subparsers(dest='action')
+    subparsers.required = True
+
+    restore = subparsers.add_parser(
+        'restore', help='restore the latest cached phase, and print it')
+    restore.add_argument('--hooks', required=True,
+                         help='the generated hooks directory')
+    restore.add_argument('--extra', default='',
+                         help='additional key input')
+    restore.add_argument('root', help='the chroot')
+
+    save = subparsers.add_parser('save', help='save the chroot')
+    save.add_argument('--max-age', type=int, default=7,
+                      help='prune entries unused for this many days')
+    save.add_argument('phase', choices=PHASES)
+    save.add_argument('root', help='the chroot')
+
+    args = parser.parse_args(sys.argv[1:])
+    cache = PhaseCache(args.cache_dir, args.state)
+
+    if args.action == 'restore':
+        cache.plan(args.hooks, os.environ, args.extra)
+        phase = cache.restore(args.root)
+        if phase:
+            print(phase)
+    else:
+        cache.save(args.root, args.phase)
+        cache.prune(args.max_age)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
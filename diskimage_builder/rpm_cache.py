@@ -0,0 +1,231 @@
+# Copyright 2026 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""A yum/dnf cache shared by concurrent builds
+
+Every build runs yum/dnf with a private cache directory.  Before that,
+it is populated from the shared cache of the release (the "snapshot",
+a cache directory in the layout of yum/dnf): the packages are
+hardlinked, the repository metadata is copied if it was saved less
+than --max-age seconds ago.  Afterwards, the new packages and any
+newer metadata are saved back into the snapshot.
+
+The packages are kept in a content addressed store (by their SHA-256)
+next to the snapshots; a package is hardlinked from there into the
+snapshot of every release (and architecture) that uses it, and from
+the snapshot into the builds.  The private cache must therefore be on
+the same filesystem; across filesystems, packages are copied.
+
+Populating takes a shared lock on the snapshot, saving an exclusive
+one, so builds never see a snapshot half written by another.
+"""
+
+import argparse
+import contextlib
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import time
+
+import diskimage_builder.logging_config
+
+logger = logging.getLogger(__name__)
+
+PACKAGE_SUFFIX = '.rpm'
+# The file listing the metadata of a repository
+REPOMD = os.path.join('repodata', 'repomd.xml')
+
+
+@contextlib.contextmanager
+def locked(snapshot, operation):
+    """Hold a lock (fcntl.LOCK_SH or LOCK_EX) on a snapshot"""
+    os.makedirs(os.path.dirname(os.path.abspath(snapshot)), exist_ok=True)
+    with open(snapshot + '.lock', 'a') as lock:
+        fcntl.flock(lock, operation)
+        yield
+
+
+def stamp_path(snapshot):
+    """The file whose time is when the metadata was last saved"""
+    return snapshot + '.stamp'
+
+
+def metadata_age(snapshot):
+    """Seconds since the metadata was saved, None if never"""
+    try:
+        return time.time() - os.path.getmtime(stamp_path(snapshot))
+    except OSError:
+        return None
+
+
+def is_package(path):
+    return path.endswith(PACKAGE_SUFFIX) and \
+        os.path.basename(os.path.dirname(path)) == 'packages'
+
+
+def _files(root):
+    """The files below root, relative to it"""
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            yield os.path.relpath(os.path.join(dirpath, name), root)
+
+
+def _replace(src, dest, link):
+    """Atomically replace dest by a hardlink (or copy) of src"""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = '%s.tmp.%d' % (dest, os.getpid())
+    if link:
+        try:
+            os.link(src, tmp)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM):
+                raise
+            shutil.copy2(src, tmp)
+    else:
+        shutil.copy2(src, tmp)
+    os.rename(tmp, dest)
+
+
+def _same_file(a, b):
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def store_package(store, path):
+    """Add a package to the store
+
+    :return: the path of it in the store
+    """
+    digest = file_hash(path)
+    stored = os.path.join(store, digest[:2], digest)
+    if not os.path.exists(stored):
+        _replace(path, stored, link=True)
+    return stored
+
+
+def populate(snapshot, private, max_age):
+    """Populate a private cache from the snapshot
+
+    :return: (number of packages, whether metadata was copied)
+    """
+    packages = 0
+    with locked(snapshot, fcntl.LOCK_SH):
+        if not os.path.isdir(snapshot):
+            return 0, False
+        age = metadata_age(snapshot)
+        metadata = age is not None and age < max_age
+        for rel in _files(snapshot):
+            if is_package(rel):
+                _replace(os.path.join(snapshot, rel),
+                         os.path.join(private, rel), link=True)
+                packages += 1
+            elif metadata:
+                _replace(os.path.join(snapshot, rel),
+                         os.path.join(private, rel), link=False)
+    return packages, metadata
+
+
+def _newer_metadata(snapshot, private):
+    """If the private cache has metadata newer than the snapshot"""
+    if not os.path.isdir(private):
+        return False
+    for name in os.listdir(private):
+        repomd = os.path.join(private, name, REPOMD)
+        if not os.path.exists(repomd):
+            continue
+        saved = os.path.join(snapshot, name, REPOMD)
+        if not os.path.exists(saved) or \
+                os.path.getmtime(repomd) > os.path.getmtime(saved):
+            return True
+    return False
+
+
+def save(snapshot, private, store):
+    """Save the packages and newer metadata of a private cache
+
+    :return: (number of new packages, whether metadata was saved)
+    """
+    packages = 0
+    with locked(snapshot, fcntl.LOCK_EX):
+        os.makedirs(snapshot, exist_ok=True)
+        metadata = _newer_metadata(snapshot, private)
+        for rel in _files(private):
+            path = os.path.join(private, rel)
+            saved = os.path.join(snapshot, rel)
+            if is_package(rel):
+                if _same_file(path, saved):
+                    continue
+                _replace(store_package(store, path), saved, link=True)
+                packages += 1
+            elif metadata:
+                _replace(path, saved, link=False)
+        if metadata:
+            with open(stamp_path(snapshot), 'w'):
+                pass
+    return packages, metadata
+
+
+def main():
+    diskimage_builder.logging_config.setup()
+
+    parser = argparse.ArgumentParser(
+        description="Share a yum/dnf cache between builds")
+    parser.add_argument('--store', required=True,
+                        help='the content addressed package store')
+    subparsers = parser.add_subparsers(dest='action')
+    subparsers.required = True
+
+    cmd_populate = subparsers.add_parser(
+        'populate', help='populate a private cache from the snapshot')
+    cmd_populate.add_argument('--max-age', type=int, default=21600,
+                              help='copy metadata saved at most this '
+                              'many seconds ago')
+    cmd_populate.add_argument('snapshot', help='the shared cache')
+    cmd_populate.add_argument('private', help='the cache of this build')
+
+    cmd_save = subparsers.add_parser(
+        'save', help='save a private cache into the snapshot')
+    cmd_save.add_argument('snapshot', help='the shared cache')
+    cmd_save.add_argument('private', help='the cache of this build')
+
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.action == 'populate':
+        packages, metadata = populate(args.snapshot, args.private,
+                                      args.max_age)
+        logger.info("Linked %d cached packages%s", packages,
+                    " and copied metadata" if metadata else "")
+    else:
+        packages, metadata = save(args.snapshot, args.private, args.store)
+        logger.info("Saved %d new packages%s", packages,
+                    " and metadata" if metadata else "")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
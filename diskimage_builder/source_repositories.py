@@ -0,0 +1,223 @@
+# Copyright 2026 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Update the cache of the source-repositories element
+
+The extra-data.d hook of the element parses the source-repository-*
+files of the elements into a list of repositories, one per line:
+
+  <name> <type> <destination> <location> <ref> <cache path>
+
+(with a ref of "-" for files, which have none) and runs this to bring
+the cache of each up to date, a few at a time, before copying them
+into the image.  git repositories are cached as bare clones holding
+the heads and tags of the remote (and any other ref asked for);
+tarballs and files are downloaded with cache-url.
+
+Every cache entry has its own lock (``<cache path>.lock`` for git,
+cache-url locks downloads itself), so builds sharing the cache only
+wait for each other while they update the same repository.  Builds
+copying a git repository into the image hold its lock shared, so the
+refs do not move under them.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import fcntl
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from diskimage_builder import cache_url
+import diskimage_builder.logging_config
+
+logger = logging.getLogger(__name__)
+
+Repository = collections.namedtuple(
+    'Repository', ['name', 'type', 'destination', 'location', 'ref',
+                   'cache_path'])
+
+# Attempts of a git clone or fetch, and the wait before the first retry
+GIT_ATTEMPTS = 5
+GIT_RETRY_DELAY = 5
+
+ALL_HEADS_AND_TAGS = ['+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*']
+
+
+class SourceError(Exception):
+    pass
+
+
+def read_repositories(path):
+    """Read the list of repositories written by the hook"""
+    repos = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            if len(fields) != len(Repository._fields):
+                raise SourceError("Invalid repository line: %s" % line)
+            repos.append(Repository(*fields))
+    return repos
+
+
+def _git(*args):
+    subprocess.check_call(('git',) + args)
+
+
+def _retry(what, func, attempts=GIT_ATTEMPTS, delay=GIT_RETRY_DELAY):
+    for attempt in range(1, attempts + 1):
+        try:
+            return func()
+        except subprocess.CalledProcessError:
+            if attempt == attempts:
+                raise SourceError("%s failed after %d attempts" %
+                                  (what, attempts))
+            logger.warning("%s: attempt %d failed, trying again in %d "
+                           "seconds", what, attempt, delay)
+            time.sleep(delay)
+            delay *= 2
+
+
+def has_commit(cache_path, ref):
+    return subprocess.call(
+        ['git', '-C', cache_path, 'rev-parse', '-q', '--verify',
+         '%s^{commit}' % ref], stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL) == 0
+
+
+def update_git(repo, offline=False):
+    """Bring the cache of a git repository up to date
+
+    The cache is a bare clone; a cache made by older versions (a clone
+    with a work tree) is used as it is.
+    """
+    if not os.path.exists(repo.cache_path):
+        logger.info("Caching %s from %s in %s", repo.name, repo.location,
+                    repo.cache_path)
+        tmp = repo.cache_path + '.tmp'
+
+        def clone():
+            shutil.rmtree(tmp, ignore_errors=True)
+            _git('clone', '-q', '--bare', repo.location, tmp)
+        _retry("Cloning %s" % repo.location, clone)
+        os.rename(tmp, repo.cache_path)
+
+    if offline and repo.ref != '*' and has_commit(repo.cache_path, repo.ref):
+        return
+
+    logger.info("Updating cache of %s in %s with ref %s", repo.location,
+                repo.cache_path, repo.ref)
+    fetch = ['-C', repo.cache_path, 'fetch', '-q', '--prune',
+             '--update-head-ok', repo.location]
+    # Copy named refs (which might be outside the usual heads
+    # pattern) - e.g. gerrit.  This fails if the ref is a SHA1, then
+    # all heads are fetched and the SHA1 must be reachable from one
+    # of them; git does not permit fetching arbitrary SHA1s.
+    if repo.ref == '*' or subprocess.call(
+            ['git'] + fetch + ['+%s:%s' % (repo.ref, repo.ref)]) != 0:
+        _retry("Fetching %s" % repo.location,
+               lambda: _git(*(fetch + ALL_HEADS_AND_TAGS)))
+    if repo.ref != '*' and not has_commit(repo.cache_path, repo.ref):
+        raise SourceError("Failed to find reference to %s" % repo.ref)
+
+
+def update_download(repo, pool, offline=False):
+    """Bring the cache of a tarball or file up to date"""
+    if offline and os.path.isfile(repo.cache_path):
+        return
+    logger.info("Caching %s %s from %s in %s", repo.name, repo.type,
+                repo.location, repo.cache_path)
+    logger.info(cache_url.fetch(repo.location, repo.cache_path, pool))
+
+
+def update(repos, pool, offline=False):
+    """Update one cache entry, for the repositories using it"""
+    for repo in repos:
+        if repo.type == 'git':
+            with open(repo.cache_path + '.lock', 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                update_git(repo, offline)
+        elif repo.type in ('tar', 'file'):
+            update_download(repo, pool, offline)
+        else:
+            raise SourceError("Unsupported repository type: %s" % repo.type)
+
+
+def update_all(repos, jobs=4, offline=False):
+    """Update the cache of all repositories, jobs at a time
+
+    Repositories sharing a cache entry (e.g. two refs of one git
+    repository) are updated one after the other.
+
+    :return: list of (repository name, error) of the failed updates
+    """
+    by_cache = collections.OrderedDict()
+    for repo in repos:
+        by_cache.setdefault(repo.cache_path, []).append(repo)
+
+    pool = cache_url.ConnectionPool()
+    errors = []
+    done = 0
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as ex:
+            futures = dict((ex.submit(update, entry, pool, offline), entry)
+                           for entry in by_cache.values())
+            for future in concurrent.futures.as_completed(futures):
+                entry = futures[future]
+                done += 1
+                try:
+                    future.result()
+                except (SourceError, cache_url.DownloadError,
+                        subprocess.CalledProcessError, OSError) as e:
+                    errors.append((entry[0].name, e))
+                    logger.error("(%04d / %04d) %s: %s", done, len(futures),
+                                 entry[0].name, e)
+                else:
+                    logger.info("(%04d / %04d) %s", done, len(futures),
+                                entry[0].name)
+    finally:
+        pool.close()
+    return errors
+
+
+def main():
+    diskimage_builder.logging_config.setup()
+
+    parser = argparse.ArgumentParser(
+        description="Update the source-repositories cache")
+    parser.add_argument('--jobs', type=int, default=4,
+                        help='repositories to update at the same time')
+    parser.add_argument('--offline', action='store_true',
+                        help='only fetch what is not in the cache')
+    parser.add_argument('repositories',
+                        help='the list of repositories to update')
+    args = parser.parse_args(sys.argv[1:])
+
+    errors = update_all(read_repositories(args.repositories),
+                        max(1, args.jobs), args.offline)
+    if errors:
+        logger.error("Failed to update %s",
+                     ", ".join(name for name, _ in errors))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# Copyright 2026 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import os
+from unittest import mock
+
+import fixtures
+import testtools
+
+from diskimage_builder import checksum
+
+
+class TestChecksum(testtools.TestCase):
+
+    def setUp(self):
+        super(TestChecksum, self).setUp()
+        self.tmp = self.useFixture(fixtures.TempDir()).path
+        self.data = os.urandom(1024) * 5000
+        self.image = os.path.join(self.tmp, 'image.raw')
+        with open(self.image, 'wb') as f:
+            f.write(self.data)
+
+    def _read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_parse_checksums(self):
+        self.assertEqual(['md5', 'sha256'], checksum.parse_checksums('1'))
+        self.assertEqual(['sha256'], checksum.parse_checksums('sha256'))
+        self.assertEqual(['md5', 'sha256'],
+                         checksum.parse_checksums('md5, sha256'))
+        self.assertEqual(['md5', 'sha256'],
+                         checksum.parse_checksums('md5 sha256'))
+        self.assertEqual(['sha256'], checksum.parse_checksums('sha256sum'))
+        self.assertRaises(ValueError, checksum.parse_checksums, 'crc')
+
+    def test_write_checksums(self):
+        with mock.patch('builtins.open', wraps=open) as mock_open:
+            checksum.write_checksums(self.image, ['md5', 'sha256'])
+        # the image is only opened (and read) once
+        self.assertEqual(1, [c[0][0] for c in
+                             mock_open.call_args_list].count(self.image))
+        self.assertEqual(
+            '%s  %s\n' % (hashlib.md5(self.data).hexdigest(), self.image),
+            self._read(self.image + '.md5'))
+        self.assertEqual(
+            '%s  %s\n' % (hashlib.sha256(self.data).hexdigest(),
+                          self.image),
+            self._read(self.image + '.sha256'))
+
+    def test_main_name_output(self):
+        output = os.path.join(self.tmp, 'out')
+        self.useFixture(fixtures.MonkeyPatch(
+            'sys.argv', ['image-checksum', '--checksum', 'sha256',
+                         '--name', 'final.raw', '--output', output,
+                         self.image]))
+        self.assertEqual(0, checksum.main())
+        self.assertEqual(
+            '%s  final.raw\n' % hashlib.sha256(self.data).hexdigest(),
+            self._read(output + '.sha256'))
+        self.assertFalse(os.path.exists(output + '.md5'))
+        self.assertFalse(os.path.exists(self.image + '.sha256'))
@@ -0,0 +1,123 @@
+# Copyright 2026 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import gzip
+import io
+import os
+import stat
+from unittest import mock
+
+import fixtures
+import testtools
+
+from diskimage_builder import cpio
+
+
+def _read_archive(data):
+    """Parse a newc archive: list of (name, fields dict, content)"""
+    entries = []
+    pos = 0
+    while True:
+        assert data[pos:pos + 6] == b'070701'
+        fields = [int(data[pos + 6 + i * 8:pos + 14 + i * 8], 16)
+                  for i in range(13)]
+        fields = dict(zip(('ino', 'mode', 'uid', 'gid', 'nlink', 'mtime',
+                           'size', 'devmajor', 'devminor', 'rdevmajor',
+                           'rdevminor', 'namesize', 'check'), fields))
+        pos += 110
+        name = data[pos:pos + fields['namesize'] - 1].decode()
+        pos += fields['namesize']
+        pos += -pos % 4
+        content = data[pos:pos + fields['size']]
+        pos += fields['size']
+        pos += -pos % 4
+        if name == 'TRAILER!!!':
+            assert len(data) % 512 == 0
+            return entries
+        entries.append((name, fields, content))
+
+
+class TestCpio(testtools.TestCase):
+
+    def setUp(self):
+        super(TestCpio, self).setUp()
+        self.tmp = self.useFixture(fixtures.TempDir()).path
+        self.root = os.path.join(self.tmp, 'root')
+        os.makedirs(os.path.join(self.root, 'bin'))
+        os.makedirs(os.path.join(self.root, 'lib', 'modules'))
+        with open(os.path.join(self.root, 'bin', 'busybox'), 'wb') as f:
+            f.write(b'#!busybox\n')
+        os.link(os.path.join(self.root, 'bin', 'busybox'),
+                os.path.join(self.root, 'bin', 'ash'))
+        os.symlink('bin', os.path.join(self.root, 'sbin'))
+        with open(os.path.join(self.root, 'init'), 'w') as f:
+            f.write('init')
+
+    def _archive(self, mtime=None):
+        out = io.BytesIO()
+        cpio.write_archive(self.root, out, mtime)
+        return out.getvalue()
+
+    def test_archive(self):
+        entries = _read_archive(self._archive())
+        self.assertEqual(['.', 'bin', 'bin/ash', 'bin/busybox', 'init',
+                          'lib', 'lib/modules', 'sbin'],
+                         [e[0] for e in entries])
+        by_name = dict((e[0], e) for e in entries)
+
+        # the hardlinks share the inode, the data is with the last
+        ash, busybox = by_name['bin/ash'], by_name['bin/busybox']
+        self.assertEqual(ash[1]['ino'], busybox[1]['ino'])
+        self.assertEqual(2, ash[1]['nlink'])
+        self.assertEqual(b'', ash[2])
+        self.assertEqual(b'#!busybox\n', busybox[2])
+
+        self.assertTrue(stat.S_ISLNK(by_name['sbin'][1]['mode']))
+        self.assertEqual(b'bin', by_name['sbin'][2])
+        self.assertTrue(stat.S_ISDIR(by_name['lib'][1]['mode']))
+        self.assertEqual(b'init', by_name['init'][2])
+        self.assertEqual(list(range(1, 8)),
+                         sorted(set(e[1]['ino'] for e in entries)))
+
+    def test_reproducible(self):
+        first = self._archive(mtime=1000)
+        os.utime(os.path.join(self.root, 'init'), (5000, 5000))
+        self.assertEqual(first, self._archive(mtime=1000))
+        entries = _read_archive(first)
+        self.assertEqual(set([1000]), set(e[1]['mtime'] for e in entries))
+
+    def test_compressor_cmd(self):
+        with mock.patch('shutil.which', side_effect=lambda c: c == 'gzip'):
+            self.assertEqual(['gzip', '-c', '-9'],
+                             cpio.compressor_cmd('pigz', 9))
+            self.assertRaises(ValueError, cpio.compressor_cmd, 'zstd')
+        self.assertIsNone(cpio.compressor_cmd('none'))
+        self.assertRaises(ValueError, cpio.compressor_cmd, 'lz4')
+
+    def test_main(self):
+        output = os.path.join(self.tmp, 'initrd')
+        self.useFixture(fixtures.EnvironmentVariable(
+            'SOURCE_DATE_EPOCH', '1000'))
+        self.useFixture(fixtures.MonkeyPatch(
+            'sys.argv', ['cpio', '--compress', 'gzip', self.root, output]))
+        with mock.patch('shutil.which', side_effect=lambda c: c == 'gzip'):
+            self.assertEqual(0, cpio.main())
+        with gzip.open(output) as f:
+            self.assertEqual(self._archive(mtime=1000), f.read())
+
+        self.useFixture(fixtures.MonkeyPatch(
+            'sys.argv', ['cpio', '--compress', 'none', self.root, output]))
+        self.assertEqual(0, cpio.main())
+        with open(output, 'rb') as f:
+            self.assertEqual(self._archive(mtime=1000), f.read())
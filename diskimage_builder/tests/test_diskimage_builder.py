@@ -12,11 +12,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import io
 import os
 import subprocess
 import tempfile
 from unittest import mock
 
+import fixtures
 import jsonschema
 import testtools
 import yaml
@@ -496,11 +498,36 @@ the description
     def test_main_dry_run(self, mock_popen, mock_get_args, mock_get_path):
         mock_get_path.return_value = "/lib"
         mock_get_args.return_value = mock.Mock(
-            dry_run=True, files=[self.write_image_definition()]
+            dry_run=True,
+            files=[self.write_image_definition()],
+            parallel=1,
+            share_base=False,
         )
         dib.main()
         mock_popen.assert_not_called()
 
+    @mock.patch("diskimage_builder.paths.get_path")
+    @mock.patch("diskimage_builder.diskimage_builder.get_args")
+    @mock.patch("tempfile.mkdtemp")
+    @mock.patch("subprocess.call")
+    @mock.patch("subprocess.Popen")
+    def test_main_dry_run_share_base(
+        self, mock_popen, mock_call, mock_mkdtemp, mock_get_args,
+        mock_get_path
+    ):
+        mock_get_path.return_value = "/lib"
+        mock_get_args.return_value = mock.Mock(
+            dry_run=True,
+            files=[self.write_image_definition()],
+            parallel=1,
+            share_base=True,
+        )
+        dib.main()
+        mock_popen.assert_not_called()
+        # no snapshot directory, so nothing to remove with sudo
+        mock_mkdtemp.assert_not_called()
+        mock_call.assert_not_called()
+
     @mock.patch("diskimage_builder.paths.get_path")
     @mock.patch("diskimage_builder.diskimage_builder.get_args")
     @mock.patch("subprocess.Popen")
@@ -510,6 +537,8 @@ the description
             dry_run=False,
             files=[self.write_image_definition()],
             stop_on_failure=False,
+            parallel=1,
+            share_base=False,
         )
 
         process = mock.Mock()
@@ -557,6 +586,8 @@ the description
             dry_run=False,
             files=[self.write_image_definition()],
             stop_on_failure=True,
+            parallel=1,
+            share_base=False,
         )
 
         process = mock.Mock()
@@ -578,6 +609,8 @@ the description
             dry_run=False,
             files=[self.write_image_definition()],
             stop_on_failure=False,
+            parallel=1,
+            share_base=False,
         )
 
         process = mock.Mock()
@@ -586,3 +619,272 @@ the description
 
         self.assertRaises(subprocess.CalledProcessError, dib.main)
         self.assertEqual(2, mock_popen.call_count)
+
+    def test_command_resources(self):
+        c = dib.Command("echo", dib.PROPERTIES, {"imagename": "one"})
+        self.assertEqual("one", c.imagename)
+        self.assertEqual(1, c.loop_devices_needed())
+        with mock.patch.dict(os.environ, {"DIB_MIN_TMPFS": "3"}):
+            self.assertEqual(6, c.memory_needed())
+
+        c = dib.Command("echo", dib.PROPERTIES, {"min-tmpfs": 5})
+        self.assertEqual("image", c.imagename)
+        self.assertEqual(10, c.memory_needed())
+
+        c = dib.Command("echo", dib.PROPERTIES, {"no-tmpfs": True})
+        self.assertEqual(0, c.memory_needed())
+
+        c = dib.Command(
+            "echo",
+            dib.PROPERTIES,
+            {"environment": {"DIB_NO_TMPFS": "1"}},
+        )
+        self.assertEqual(0, c.memory_needed())
+
+    @mock.patch("diskimage_builder.paths.get_path")
+    @mock.patch("diskimage_builder.diskimage_builder.get_args")
+    @mock.patch("subprocess.Popen")
+    def test_main_parallel_bad_min_tmpfs(
+        self, mock_popen, mock_get_args, mock_get_path
+    ):
+        mock_get_path.return_value = "/lib"
+        mock_get_args.return_value = mock.Mock(
+            dry_run=False,
+            files=[
+                self.write_definition(
+                    [
+                        {"imagename": "good"},
+                        {
+                            "imagename": "bad",
+                            "environment": {"DIB_MIN_TMPFS": "lots"},
+                        },
+                    ]
+                )
+            ],
+            stop_on_failure=False,
+            parallel=2,
+            share_base=False,
+        )
+        with mock.patch("sys.stderr", io.StringIO()) as stderr:
+            e = self.assertRaises(SystemExit, dib.main)
+        self.assertEqual(2, e.code)
+        self.assertIn("bad: min-tmpfs", stderr.getvalue())
+        self.assertIn("[lots]", stderr.getvalue())
+        mock_popen.assert_not_called()
+
+    def test_command_loop_devices(self):
+        config = [
+            {"local_loop": {"name": "image0"}},
+            {"local_loop": {"name": "image1", "size": "1G"}},
+            {"partitioning": {"base": "image0"}},
+        ]
+        c = dib.Command(
+            "echo",
+            dib.PROPERTIES,
+            {"environment": {"DIB_BLOCK_DEVICE_CONFIG": yaml.dump(config)}},
+        )
+        self.assertEqual(2, c.loop_devices_needed())
+
+        config_file = self.write_definition(config[:1])
+        c = dib.Command(
+            "echo",
+            dib.PROPERTIES,
+            {
+                "environment": {
+                    "DIB_BLOCK_DEVICE_CONFIG": "file://" + config_file
+                }
+            },
+        )
+        self.assertEqual(1, c.loop_devices_needed())
+
+        c = dib.Command(
+            "echo",
+            dib.PROPERTIES,
+            {"environment": {"DIB_BLOCK_DEVICE_CONFIG": "file:///missing"}},
+        )
+        self.assertEqual(1, c.loop_devices_needed())
+
+    def test_resource_pool(self):
+        small = dib.Command("echo", dib.PROPERTIES, {"min-tmpfs": 1})
+        big = dib.Command("echo", dib.PROPERTIES, {"min-tmpfs": 8})
+
+        pool = dib.ResourcePool(3, memory=10, loop_devices=2)
+        # always room for one build, even an oversized one
+        self.assertTrue(pool.fits(big))
+        pool.claim(big)
+        self.assertFalse(pool.fits(small))
+        pool.release(big)
+
+        pool.claim(small)
+        self.assertTrue(pool.fits(small))
+        pool.claim(small)
+        # out of loop devices
+        self.assertFalse(pool.fits(small))
+        pool.release(small)
+        pool.release(small)
+        self.assertEqual(0, pool.running)
+        self.assertEqual(0, pool.memory_used)
+        self.assertEqual(0, pool.loop_devices_used)
+
+        pool = dib.ResourcePool(1)
+        pool.claim(small)
+        self.assertFalse(pool.fits(small))
+
+    def write_script(self, name, content):
+        lib = self.useFixture(fixtures.TempDir()).path
+        with open(os.path.join(lib, name), "w") as f:
+            f.write(content)
+        return lib
+
+    @mock.patch("diskimage_builder.paths.get_path")
+    @mock.patch("diskimage_builder.diskimage_builder.get_args")
+    def test_main_parallel(self, mock_get_args, mock_get_path):
+        lib = self.write_script(
+            "disk-image-create", 'echo "built $DIB_TEST_NAME"\n'
+        )
+        mock_get_path.return_value = lib
+        mock_get_args.return_value = mock.Mock(
+            dry_run=False,
+            files=[
+                self.write_definition(
+                    [
+                        {
+                            "imagename": "image%d" % i,
+                            "elements": ["vm"],
+                            "environment": {"DIB_TEST_NAME": str(i)},
+                        }
+                        for i in range(4)
+                    ]
+                )
+            ],
+            stop_on_failure=False,
+            parallel=2,
+            share_base=False,
+            parallel_memory=None,
+            parallel_loop_devices=None,
+        )
+        stdout = io.BytesIO()
+        with mock.patch("sys.stdout", mock.Mock(buffer=stdout)):
+            dib.main()
+        lines = sorted(stdout.getvalue().decode().splitlines())
+        self.assertEqual(
+            [
+                "[image0] built 0",
+                "[image1] built 1",
+                "[image2] built 2",
+                "[image3] built 3",
+            ],
+            lines,
+        )
+
+    @mock.patch("diskimage_builder.paths.get_path")
+    def test_run_parallel_stop_on_failure(self, mock_get_path):
+        lib = self.write_script("disk-image-create", "exit 3\n")
+        mock_get_path.return_value = lib
+        commands = dib.build_commands(
+            [{"imagename": "image%d" % i} for i in range(3)]
+        )
+        stdout = io.BytesIO()
+        with mock.patch("sys.stdout", mock.Mock(buffer=stdout)):
+            returncode, failed = dib.run_parallel(
+                commands, dib.ResourcePool(1), stop_on_failure=True
+            )
+            self.assertEqual(3, returncode)
+            self.assertEqual("image0", failed.imagename)
+
+            returncode, failed = dib.run_parallel(
+                commands, dib.ResourcePool(2), stop_on_failure=False
+            )
+            self.assertEqual(3, returncode)
+
+    @mock.patch("diskimage_builder.paths.get_path")
+    @mock.patch("subprocess.Popen")
+    def test_run_parallel_popen_failure(self, mock_popen, mock_get_path):
+        mock_get_path.return_value = "/lib"
+        mock_popen.side_effect = OSError(24, "Too many open files")
+        commands = dib.build_commands([{"imagename": "image0"}])
+        with mock.patch("sys.stderr", io.StringIO()) as stderr:
+            returncode, failed = dib.run_parallel(
+                commands, dib.ResourcePool(1)
+            )
+        self.assertEqual(1, returncode)
+        self.assertEqual("image0", failed.imagename)
+        self.assertIn("Too many open files", stderr.getvalue())
+
+    def write_definition(self, image_def):
+        with tempfile.NamedTemporaryFile(delete=False) as deffile:
+            self.addCleanup(os.remove, deffile.name)
+            with open(deffile.name, "w") as f:
+                f.write(yaml.dump(image_def))
+        return deffile.name
+
+    def write_elements(self):
+        elements = self.useFixture(fixtures.TempDir()).path
+        for name, dirs, provides in (
+            ("distro", ["root.d"], "operating-system"),
+            ("late-one", ["install.d"], None),
+            ("late-two", ["post-install.d"], None),
+            ("early", ["environment.d"], None),
+        ):
+            for d in dirs:
+                os.makedirs(os.path.join(elements, name, d))
+            if provides:
+                with open(
+                    os.path.join(elements, name, "element-provides"), "w"
+                ) as f:
+                    f.write(provides)
+        return elements
+
+    @mock.patch("diskimage_builder.paths.get_path")
+    def test_share_base_snapshots(self, mock_get_path):
+        elements = self.write_elements()
+        mock_get_path.side_effect = lambda p: {
+            "lib": "/lib",
+            "elements": elements,
+        }[p]
+        commands = dib.build_commands(
+            [
+                {
+                    "imagename": "one",
+                    "skip-base": True,
+                    "logfile": "one.log",
+                    "elements": ["distro", "late-one"],
+                },
+                {
+                    "imagename": "two",
+                    "skip-base": True,
+                    "elements": ["distro", "early"],
+                },
+                {
+                    "imagename": "three",
+                    "skip-base": True,
+                    "elements": ["distro", "late-two"],
+                },
+                {
+                    "imagename": "four",
+                    "skip-base": True,
+                    "elements": ["missing"],
+                },
+            ]
+        )
+        planned = dib.share_base_snapshots(commands, "/snap")
+        self.assertEqual(
+            ["one-base", "one", "two", "three", "four"],
+            [c.imagename for c in planned],
+        )
+        base, one, two, three, four = planned
+        self.assertEqual([one, three], base.members)
+        self.assertEqual("/snap/one", base.environ["DIB_BASE_SNAPSHOT_SAVE"])
+        self.assertNotIn("--logfile", base.args)
+        self.assertIn("--logfile", one.args)
+        for c in (one, three):
+            self.assertIs(base, c.base_snapshot)
+            self.assertEqual("/snap/one", c.environ["DIB_BASE_SNAPSHOT"])
+        for c in (two, four):
+            self.assertIsNone(c.base_snapshot)
+            self.assertNotIn("DIB_BASE_SNAPSHOT", c.environ)
+
+        dib.finish_base_snapshot(base, 1)
+        for c in (one, three):
+            self.assertIsNone(c.base_snapshot)
+            self.assertNotIn("DIB_BASE_SNAPSHOT", c.environ)
@@ -12,8 +12,11 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import io
+import json
 import logging
 import os
+from unittest import mock
 
 import fixtures
 import testtools
@@ -218,6 +221,93 @@ class TestElementDeps(testtools.TestCase):
                                                       self.element_dirs)
         element_dependencies._output_env_vars(elements)
 
+    def test_element_info(self):
+        hooks = os.path.join(self.element_dir, 'foo', 'install.d')
+        os.mkdir(hooks)
+        open(os.path.join(hooks, '10-foo'), 'w').close()
+        os.mkdir(os.path.join(self.element_dir, 'foo', 'tests'))
+
+        all_elements = element_dependencies._find_all_elements(
+            self.element_dirs)
+        elements = element_dependencies._expand_element_dependencies(
+            ['requires-foo'], all_elements)
+        info = element_dependencies._element_info(elements, all_elements)
+
+        self.assertCountEqual(['foo', 'requires-foo'],
+                              info['elements'])
+        self.assertEqual(os.path.join(self.element_dir, 'foo'),
+                         info['paths']['foo'])
+        self.assertEqual(['foo'], info['depends']['requires-foo'])
+        self.assertEqual(['operating-system'], info['provides']['foo'])
+        # requires-requires-foo is not part of this build
+        self.assertEqual(['requires-foo'], info['r_depends']['foo'])
+        self.assertEqual([], info['r_depends']['requires-foo'])
+        self.assertEqual({'.': ['element-deps', 'element-provides'],
+                          'install.d': ['10-foo']},
+                         info['hooks']['foo'])
+        self.assertEqual(element_dependencies._env_vars(elements),
+                         info['env'])
+        json.dumps(info)
+
+    @mock.patch('sys.stdout', new_callable=io.StringIO)
+    def test_main_json(self, mock_stdout):
+        self.useFixture(
+            fixtures.EnvironmentVariable('ELEMENTS_PATH', self.element_dirs))
+        self.useFixture(fixtures.MonkeyPatch(
+            'sys.argv', ['element-info', '--json', 'requires-foo']))
+        self.assertEqual(0, element_dependencies.main())
+        info = json.loads(mock_stdout.getvalue())
+        self.assertCountEqual(['foo', 'requires-foo'], info['elements'])
+        self.assertEqual(os.path.join(self.element_dir, 'requires-foo'),
+                         info['paths']['requires-foo'])
+        self.assertIn("export IMAGE_ELEMENT='", info['env'])
+
+    def test_rdeps(self):
+        all_elements = element_dependencies._find_all_elements(
+            self.element_dirs)
+        self.assertCountEqual(['requires-foo'],
+                              all_elements['foo'].r_depends)
+        self.assertCountEqual(['requires-requires-foo'],
+                              all_elements['requires-foo'].r_depends)
+        self.assertEqual([], all_elements['requires-requires-foo'].r_depends)
+
+    def test_element_index(self):
+        index_file = os.path.join(self.element_root_dir, 'index.json')
+        self.useFixture(
+            fixtures.EnvironmentVariable('DIB_ELEMENT_INDEX', index_file))
+
+        first = element_dependencies._find_all_elements(self.element_dirs)
+        self.assertTrue(os.path.exists(index_file))
+
+        # nothing is read again from unchanged elements
+        with mock.patch.object(element_dependencies.Element,
+                               '_get_element_set') as mock_get:
+            second = element_dependencies._find_all_elements(
+                self.element_dirs)
+            mock_get.assert_not_called()
+        self.assertEqual(sorted(first), sorted(second))
+        for name in first:
+            self.assertEqual(first[name].path, second[name].path)
+            self.assertEqual(first[name].depends, second[name].depends)
+            self.assertEqual(first[name].provides, second[name].provides)
+
+        # a changed element-deps and a new element are picked up
+        with open(os.path.join(self.element_dir, 'foo',
+                               'element-deps'), 'w') as f:
+            f.write('new_element\nextra_dependency\n')
+        _populate_element(self.element_dir, 'new_element', [])
+        third = element_dependencies._find_all_elements(self.element_dirs)
+        self.assertEqual(set(['new_element', 'extra_dependency']),
+                         third['foo'].depends)
+        self.assertIn('new_element', third)
+        self.assertEqual(['foo'], third['new_element'].r_depends)
+
+        # a corrupt index is ignored
+        with open(index_file, 'w') as f:
+            f.write('{')
+        fourth = element_dependencies._find_all_elements(self.element_dirs)
+        self.assertEqual(sorted(third), sorted(fourth))
+
 
 class TestElements(testtools.TestCase):
     def test_depends_on_env(self):
@@ -0,0 +1,186 @@
+# Copyright 2026 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import struct
+
+import fixtures
+import testtools
+
+from diskimage_builder import elfdeps
+
+EM_X86_64 = 62
+EM_AARCH64 = 183
+
+
+def _make_elf(path, needed=(), interp=None, runpath=None, rpath=None,
+              machine=EM_X86_64):
+    """Write a minimal 64 bit little endian dynamic ELF file"""
+    strings = b'\0'
+    dynamic = []
+
+    def add_string(s):
+        nonlocal strings
+        offset = len(strings)
+        strings += s.encode() + b'\0'
+        return offset
+
+    for name in needed:
+        dynamic.append((elfdeps.DT_NEEDED, add_string(name)))
+    if runpath is not None:
+        dynamic.append((elfdeps.DT_RUNPATH, add_string(runpath)))
+    if rpath is not None:
+        dynamic.append((elfdeps.DT_RPATH, add_string(rpath)))
+
+    phnum = 3 if interp else 2
+    strtab = 64 + phnum * 56
+    interp_offset = strtab + len(strings)
+    interp_data = interp.encode() + b'\0' if interp else b''
+    dyn_offset = interp_offset + len(interp_data)
+    dynamic += [(elfdeps.DT_STRTAB, strtab),
+                (elfdeps.DT_STRSZ, len(strings)),
+                (elfdeps.DT_NULL, 0)]
+    dyn_data = b''.join(struct.pack('<qQ', t, v) for t, v in dynamic)
+    size = dyn_offset + len(dyn_data)
+
+    data = b'\x7fELF' + bytes([2, 1, 1]) + b'\0' * 9
+    data += struct.pack('<HHIQQQIHHHHHH', 3, machine, 1, 0, 64, 0, 0, 64,
+                        56, phnum, 64, 0, 0)
+    data += struct.pack('<IIQQQQQQ', elfdeps.PT_LOAD, 5, 0, 0, 0,
+                        size, size, 4096)
+    if interp:
+        data += struct.pack('<IIQQQQQQ', elfdeps.PT_INTERP, 4,
+                            interp_offset, interp_offset, interp_offset,
+                            len(interp_data), len(interp_data), 1)
+    data += struct.pack('<IIQQQQQQ', elfdeps.PT_DYNAMIC, 6, dyn_offset,
+                        dyn_offset, dyn_offset, len(dyn_data),
+                        len(dyn_data), 8)
+    data += strings + interp_data + dyn_data
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+class TestElfDeps(testtools.TestCase):
+
+    def setUp(self):
+        super(TestElfDeps, self).setUp()
+        self.root = self.useFixture(fixtures.TempDir()).path
+        self.interp = '/lib64/ld-linux-x86-64.so.2'
+        _make_elf(self._path(self.interp))
+        _make_elf(self._path('/usr/lib64/libc.so.6'))
+
+    def _path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def _write(self, path, content):
+        os.makedirs(os.path.dirname(self._path(path)), exist_ok=True)
+        with open(self._path(path), 'w') as f:
+            f.write(content)
+
+    def test_parse(self):
+        _make_elf(self._path('/bin/foo'), needed=['libfoo.so.1',
+                                                  'libc.so.6'],
+                  interp=self.interp, runpath='$ORIGIN/../lib:/opt')
+        elf = elfdeps.ELFFile(self._path('/bin/foo'))
+        self.assertEqual(elfdeps.ELFCLASS64, elf.elf_class)
+        self.assertEqual(EM_X86_64, elf.machine)
+        self.assertEqual(self.interp, elf.interp)
+        self.assertEqual(['libfoo.so.1', 'libc.so.6'], elf.needed)
+        self.assertEqual(['$ORIGIN/../lib', '/opt'], elf.runpath)
+        self.assertEqual([], elf.rpath)
+
+    def test_not_elf(self):
+        self._write('/bin/script', '#!/bin/sh\n')
+        self.assertRaises(elfdeps.NotELF, elfdeps.ELFFile,
+                          self._path('/bin/script'))
+        resolver = elfdeps.Resolver(self.root)
+        self.assertEqual([], resolver.resolve(['/bin/script']))
+
+    def test_closure(self):
+        # two binaries sharing libraries; every library once
+        _make_elf(self._path('/bin/a'), needed=['liba.so.1', 'libc.so.6'],
+                  interp=self.interp)
+        _make_elf(self._path('/bin/b'), needed=['liba.so.1', 'libb.so.2'],
+                  interp=self.interp)
+        _make_elf(self._path('/usr/lib64/liba.so.1'),
+                  needed=['libb.so.2', 'libc.so.6'])
+        _make_elf(self._path('/usr/lib64/libb.so.2'), needed=['libc.so.6'])
+
+        resolver = elfdeps.Resolver(self.root)
+        self.assertEqual([(self.interp, self.interp),
+                          ('liba.so.1', '/usr/lib64/liba.so.1'),
+                          ('libc.so.6', '/usr/lib64/libc.so.6'),
+                          ('libb.so.2', '/usr/lib64/libb.so.2')],
+                         resolver.resolve(['/bin/a', '/bin/b']))
+
+    def test_search_path(self):
+        self._write('/etc/ld.so.conf', 'include ld.so.conf.d/*.conf\n')
+        self._write('/etc/ld.so.conf.d/multiarch.conf',
+                    '# multiarch\n/lib/x86_64-linux-gnu\n')
+        # found by ld.so.conf before the default directories
+        _make_elf(self._path('/lib/x86_64-linux-gnu/libc.so.6'))
+        # the RUNPATH with $ORIGIN comes first; a library for another
+        # machine is skipped
+        _make_elf(self._path('/opt/app/lib/libapp.so'))
+        _make_elf(self._path('/opt/app/lib/libother.so'),
+                  machine=EM_AARCH64)
+        _make_elf(self._path('/usr/lib64/libother.so'))
+        _make_elf(self._path('/opt/app/bin/app'),
+                  needed=['libapp.so', 'libother.so', 'libc.so.6'],
+                  runpath='$ORIGIN/../lib')
+
+        resolver = elfdeps.Resolver(self.root)
+        self.assertEqual(['/lib/x86_64-linux-gnu'], resolver.conf_dirs)
+        self.assertEqual([('libapp.so', '/opt/app/lib/libapp.so'),
+                          ('libother.so', '/usr/lib64/libother.so'),
+                          ('libc.so.6', '/lib/x86_64-linux-gnu/libc.so.6')],
+                         resolver.resolve(['/opt/app/bin/app']))
+
+    def test_rpath(self):
+        # DT_RPATH is inherited by the libraries loaded, and ignored
+        # if there is a DT_RUNPATH
+        _make_elf(self._path('/opt/lib/libx.so'), needed=['liby.so'])
+        _make_elf(self._path('/opt/lib/liby.so'))
+        _make_elf(self._path('/bin/x'), needed=['libx.so'], rpath='/opt/lib')
+        _make_elf(self._path('/bin/z'), needed=['libx.so'], rpath='/opt/lib',
+                  runpath='/nowhere')
+
+        resolver = elfdeps.Resolver(self.root)
+        self.assertEqual([('libx.so', '/opt/lib/libx.so'),
+                          ('liby.so', '/opt/lib/liby.so')],
+                         resolver.resolve(['/bin/x']))
+        self.assertEqual([], elfdeps.Resolver(self.root).resolve(['/bin/z']))
+
+    def test_copy(self):
+        _make_elf(self._path('/usr/lib64/libfoo.so.1.2.3'))
+        os.symlink('libfoo.so.1.2.3', self._path('/usr/lib64/libfoo.so.1'))
+        _make_elf(self._path('/bin/foo'), needed=['libfoo.so.1'],
+                  interp=self.interp)
+        dest = self.useFixture(fixtures.TempDir()).path
+        os.mkdir(os.path.join(dest, 'lib'))
+
+        resolver = elfdeps.Resolver(self.root)
+        elfdeps.copy_libs(self.root, resolver.resolve(['/bin/foo']), dest)
+
+        # the symlinks in the tree are followed, like cp -L
+        lib = os.path.join(dest, 'lib', 'libfoo.so.1')
+        self.assertFalse(os.path.islink(lib))
+        self.assertEqual(elfdeps.ELFFile(lib).needed, [])
+        # the interpreter is linked from its absolute path
+        self.assertEqual('/lib/ld-linux-x86-64.so.2',
+                         os.readlink(os.path.join(
+                             dest, 'lib64', 'ld-linux-x86-64.so.2')))
+        self.assertEqual(['ld-linux-x86-64.so.2', 'libfoo.so.1'],
+                         sorted(os.listdir(os.path.join(dest, 'lib'))))
@@ -0,0 +1,90 @@
+# Copyright 2026 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import fixtures
+import testtools
+
+from diskimage_builder import image_size
+
+MiB = image_size.MiB
+
+
+class TestImageSize(testtools.TestCase):
+
+    def setUp(self):
+        super(TestImageSize, self).setUp()
+        self.tree = self.useFixture(fixtures.TempDir()).path
+        os.makedirs(os.path.join(self.tree, 'usr', 'lib'))
+        os.makedirs(os.path.join(self.tree, 'etc'))
+        with open(os.path.join(self.tree, 'usr', 'lib', 'big'), 'wb') as f:
+            f.write(b'x' * 12 * MiB)
+        with open(os.path.join(self.tree, 'etc', 'small'), 'w') as f:
+            f.write('small')
+        self.fstype = image_size.FSTYPES['ext4']
+
+    def test_walk(self):
+        before = image_size.walk(self.tree, self.fstype, workers=2)
+        # 4 directories, 2 files
+        self.assertEqual(6, before.inodes)
+        self.assertEqual(12 * MiB + 4096 + 4 * 4096, before.fs_bytes)
+
+        # a hardlink is only counted once, short symlinks and sparse
+        # files take no data blocks
+        os.link(os.path.join(self.tree, 'usr', 'lib', 'big'),
+                os.path.join(self.tree, 'usr', 'big'))
+        os.symlink('lib/big', os.path.join(self.tree, 'usr', 'link'))
+        with open(os.path.join(self.tree, 'sparse'), 'wb') as f:
+            f.truncate(100 * MiB)
+        after = image_size.walk(self.tree, self.fstype, workers=2)
+        self.assertEqual(8, after.inodes)
+        self.assertEqual(before.fs_bytes, after.fs_bytes)
+
+    def test_image_size(self):
+        tree = image_size.walk(self.tree, self.fstype)
+        fs_size = image_size.fs_size(tree, self.fstype)
+        # inode tables and reserved blocks
+        self.assertGreater(fs_size, tree.fs_bytes * 1.1)
+        self.assertLess(fs_size, tree.fs_bytes * 1.2)
+        self.assertEqual(fs_size + image_size.HEADROOM_MIN,
+                         image_size.image_size(tree, self.fstype))
+
+        # many small files need space for their inodes
+        tree.inodes = 100000
+        self.assertGreaterEqual(image_size.fs_size(tree, self.fstype),
+                                100000 * 4096)
+        # xfs allocates them as needed
+        xfs = image_size.FSTYPES['xfs']
+        self.assertLess(image_size.fs_size(tree, xfs), 100000 * 4096)
+
+    def test_report(self):
+        tree = image_size.walk(self.tree, self.fstype,
+                               report_threshold=image_size.REPORT_THRESHOLD)
+        report = image_size.format_report(tree).split('\n')
+        self.assertEqual('Image size report (files > 10MiB)', report[1])
+        entries = [line.split('\t') for line in report if '\t' in line]
+        # the file, usr/lib, usr and the tree, largest first
+        self.assertEqual([self.tree,
+                          os.path.join(self.tree, 'usr'),
+                          os.path.join(self.tree, 'usr', 'lib'),
+                          os.path.join(self.tree, 'usr', 'lib', 'big')],
+                         [path for size, path in entries])
+        self.assertEqual('  12MiB', entries[-1][0])
+
+    def test_iec(self):
+        self.assertEqual('512B', image_size._iec(512))
+        self.assertEqual('1.5KiB', image_size._iec(1536))
+        self.assertEqual('12MiB', image_size._iec(12 * MiB))
+        self.assertEqual('1.1GiB', image_size._iec(1025 * MiB))
@@ -0,0 +1,142 @@
+# Copyright 2026 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+from unittest import mock
+
+import fixtures
+import testtools
+
+from diskimage_builder import kmods
+
+MODULES_DEP = """\
+kernel/drivers/net/ethernet/intel/e1000e.ko.xz: kernel/net/core/ptp.ko.xz
+kernel/net/core/ptp.ko.xz: kernel/drivers/pps/pps_core.ko.xz
+kernel/drivers/pps/pps_core.ko.xz:
+kernel/drivers/net/ethernet/intel/igb.ko.xz: kernel/net/core/ptp.ko.xz
+kernel/drivers/net/virtio_net.ko.xz: kernel/net/core/net_failover.ko.xz
+kernel/net/core/net_failover.ko.xz:
+kernel/drivers/block/virtio_blk.ko.xz:
+kernel/drivers/crypto/crc32c-intel.ko.xz:
+kernel/fs/ext4/ext4.ko.xz: kernel/lib/crc16.ko.xz
+kernel/lib/crc16.ko.xz:
+kernel/drivers/video/fbdev/vfb.ko.xz:
+kernel/drivers/gpu/drm/i915/i915.ko.xz:
+"""
+
+MODULES_ALIAS = """\
+# Aliases extracted from modules themselves.
+alias pci:v00008086d000010D3sv*sd*bc*sc*i* e1000e
+alias pci:v00008086d00001533sv*sd*bc*sc*i* igb
+alias virtio:d00000001v* virtio_net
+alias virtio:d00000002v* virtio_blk
+alias pci:v00008086d*sv*sd*bc03sc*i* i915
+alias crc32c crc32c_intel
+"""
+
+MODULES_SOFTDEP = """\
+# Soft dependencies extracted from modules themselves.
+softdep ext4 pre: crc32c
+"""
+
+
+class TestKmods(testtools.TestCase):
+
+    def setUp(self):
+        super(TestKmods, self).setUp()
+        tmp = self.useFixture(fixtures.TempDir()).path
+        self.module_dir = os.path.join(tmp, 'modules', '6.1.0')
+        self.firmware_dir = os.path.join(tmp, 'firmware')
+        self.dest = os.path.join(tmp, 'ramdisk')
+        for path in MODULES_DEP.split():
+            if path.endswith(':'):
+                self._write(os.path.join(self.module_dir, path[:-1]), path)
+        self._write(os.path.join(self.module_dir, 'modules.dep'),
+                    MODULES_DEP)
+        self._write(os.path.join(self.module_dir, 'modules.alias'),
+                    MODULES_ALIAS)
+        self._write(os.path.join(self.module_dir, 'modules.softdep'),
+                    MODULES_SOFTDEP)
+        self._write(os.path.join(self.module_dir, 'modules.order'), '')
+        for path in ('e100/d101m_ucode.bin', 'i915/skl_dmc.bin.xz',
+                     'other.bin'):
+            self._write(os.path.join(self.firmware_dir, path), path)
+
+    def _write(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def _select(self, *patterns):
+        return sorted(kmods.module_name(p) for p in
+                      kmods.select_modules(self.module_dir, patterns))
+
+    def test_module_name(self):
+        self.assertEqual('crc32c_intel', kmods.module_name(
+            'kernel/drivers/crypto/crc32c-intel.ko.xz'))
+        self.assertEqual('ext4', kmods.module_name('ext4.ko'))
+
+    def test_select_name(self):
+        self.assertEqual(['e1000e', 'pps_core', 'ptp'],
+                         self._select('e1000e'))
+        self.assertEqual(['net_failover', 'virtio_blk', 'virtio_net'],
+                         self._select('virtio_*'))
+        # soft dependency given by an alias
+        self.assertEqual(['crc16', 'crc32c_intel', 'ext4'],
+                         self._select('ext4'))
+
+    def test_select_path(self):
+        self.assertEqual(['e1000e', 'igb', 'pps_core', 'ptp'],
+                         self._select('drivers/net/ethernet/'))
+        self.assertEqual(['virtio_blk'],
+                         self._select('kernel/drivers/block/*.ko*'))
+
+    def test_select_alias(self):
+        self.assertEqual(['net_failover', 'virtio_blk', 'virtio_net'],
+                         self._select('alias:virtio:*'))
+        self.assertEqual(['e1000e', 'i915', 'igb', 'pps_core', 'ptp'],
+                         self._select('alias:pci:v00008086*'))
+
+    def test_no_framebuffer(self):
+        self.assertEqual([], self._select('drivers/video'))
+
+    @mock.patch('subprocess.check_call')
+    @mock.patch('subprocess.check_output')
+    def test_copy(self, mock_output, mock_call):
+        mock_output.return_value = (b'e100/d101m_ucode.bin\n'
+                                    b'i915/skl_dmc.bin\n'
+                                    b'i915/missing.bin\n')
+
+        self.assertEqual((2, 2), kmods.copy_modules(
+            self.module_dir, self.firmware_dir, self.dest, '6.1.0-1',
+            ['i915', 'crc16']))
+
+        mock_output.assert_called_once_with(
+            ['modinfo', '-F', 'firmware',
+             os.path.join(self.module_dir,
+                          'kernel/drivers/gpu/drm/i915/i915.ko.xz'),
+             os.path.join(self.module_dir, 'kernel/lib/crc16.ko.xz')])
+        mock_call.assert_called_once_with(
+            ['depmod', '-b', self.dest, '6.1.0-1'])
+        found = []
+        for dirpath, dirnames, filenames in os.walk(self.dest):
+            found.extend(os.path.relpath(os.path.join(dirpath, f),
+                                         self.dest) for f in filenames)
+        self.assertEqual(['lib/firmware/e100/d101m_ucode.bin',
+                          'lib/firmware/i915/skl_dmc.bin.xz',
+                          'lib/modules/6.1.0-1/kernel/drivers/gpu/drm/'
+                          'i915/i915.ko.xz',
+                          'lib/modules/6.1.0-1/kernel/lib/crc16.ko.xz',
+                          'lib/modules/6.1.0-1/modules.order'],
+                         sorted(found))
@@ -0,0 +1,92 @@
+# Copyright 2026 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import gzip
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+import fixtures
+import testtools
+
+OUTFILTER = os.path.join(os.path.dirname(__file__), '..', 'lib',
+                         'outfilter.py')
+
+INPUT = b'first\n+ set +o xtrace\n\nlast without newline'
+TIMESTAMP = br'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{3} \| '
+
+
+class TestOutfilter(testtools.TestCase):
+
+    def setUp(self):
+        super(TestOutfilter, self).setUp()
+        self.tmp = self.useFixture(fixtures.TempDir()).path
+
+    def _run(self, *args):
+        return subprocess.run([sys.executable, OUTFILTER] + list(args),
+                              input=INPUT, stdout=subprocess.PIPE,
+                              check=True).stdout
+
+    def _assert_timestamped(self, output):
+        lines = output.split(b'\n')
+        self.assertEqual(3, len(lines))
+        for line, expected in zip(lines, (b'first', b'',
+                                          b'last without newline')):
+            self.assertIsNotNone(re.match(TIMESTAMP + re.escape(expected)
+                                          + b'$', line), line)
+
+    def test_buffered(self):
+        # the same output as line by line
+        for args in ([], ['--buffered']):
+            self._assert_timestamped(self._run('-v', *args))
+            self.assertEqual(b'first\n\nlast without newline',
+                             self._run('-v', '-b', *args))
+
+    def test_gzip(self):
+        logfile = os.path.join(self.tmp, 'log.gz')
+        self.assertEqual(b'', self._run('--buffered', '--compress', 'gzip',
+                                        '-o', logfile))
+        self._run('--buffered', '--compress', 'gzip', '-o', logfile)
+        with gzip.open(logfile) as f:
+            output = f.read()
+        # the second run appended the same (with other timestamps)
+        half = len(output) // 2
+        self._assert_timestamped(output[:half])
+        self._assert_timestamped(output[half:])
+
+    def test_small_flush_size(self):
+        output = self._run('-v', '-b', '--buffered', '--flush-size', '1')
+        self.assertEqual(b'first\n\nlast without newline', output)
+
+    def test_interrupted(self):
+        # pending output is written out when interrupted
+        logfile = os.path.join(self.tmp, 'log')
+        p = subprocess.Popen([sys.executable, OUTFILTER, '--buffered',
+                              '--flush-interval', '60', '-o', logfile],
+                             stdin=subprocess.PIPE)
+        p.stdin.write(b'first\nlast without newline')
+        p.stdin.flush()
+        time.sleep(1)
+        p.send_signal(signal.SIGINT)
+        self.assertEqual(1, p.wait())
+        p.stdin.close()
+        with open(logfile, 'rb') as f:
+            lines = f.read().split(b'\n')
+        self.assertEqual(2, len(lines))
+        for line, expected in zip(lines, (b'first', b'last without newline')):
+            self.assertIsNotNone(re.match(TIMESTAMP + re.escape(expected)
+                                          + b'$', line), line)
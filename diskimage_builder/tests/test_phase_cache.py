@@ -0,0 +1,171 @@
+# Copyright 2026 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import subprocess
+from unittest import mock
+
+import fixtures
+import testtools
+
+from diskimage_builder import phase_cache
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+_check_call = subprocess.check_call
+
+
+def _check_call_no_sudo(cmd):
+    if cmd[0] == "sudo":
+        cmd = cmd[1:]
+    # emulate bind mounting a directory with a symlink
+    if cmd[:2] == ["mount", "--bind"]:
+        os.rmdir(cmd[3])
+        os.symlink(cmd[2], cmd[3])
+        return 0
+    if cmd[0] == "umount":
+        os.unlink(cmd[1])
+        os.mkdir(cmd[1])
+        return 0
+    return _check_call(cmd)
+
+
+class TestPhaseCache(testtools.TestCase):
+
+    def setUp(self):
+        super(TestPhaseCache, self).setUp()
+        self.tmp = self.useFixture(fixtures.TempDir()).path
+        self.hooks = os.path.join(self.tmp, "hooks")
+        self.root = os.path.join(self.tmp, "root")
+        self.cache_dir = os.path.join(self.tmp, "cache")
+        for phase in phase_cache.PHASES:
+            _write(os.path.join(self.hooks, "%s.d" % phase, "10-hook"),
+                   "echo %s" % phase)
+        _write(os.path.join(self.hooks, "environment.d", "10-env"),
+               "export FOO=bar")
+        _write(os.path.join(self.root, "etc", "os-release"), "distro")
+        self.environ = {"DIB_RELEASE": "1", "ARCH": "amd64"}
+
+    def _keys(self):
+        return phase_cache.phase_keys(
+            phase_cache.hooks_hashes(self.hooks),
+            phase_cache.environment_hash(self.environ))
+
+    def test_tree_hash(self):
+        a = phase_cache.tree_hash(self.hooks)
+        self.assertEqual(a, phase_cache.tree_hash(self.hooks))
+        os.chmod(os.path.join(self.hooks, "root.d", "10-hook"), 0o755)
+        b = phase_cache.tree_hash(self.hooks)
+        self.assertNotEqual(a, b)
+        os.symlink("10-hook", os.path.join(self.hooks, "root.d", "20-link"))
+        self.assertNotEqual(b, phase_cache.tree_hash(self.hooks))
+
+    def test_phase_keys(self):
+        before = self._keys()
+        _write(os.path.join(self.hooks, "install.d", "10-hook"), "changed")
+        after = self._keys()
+        # only phases from install on are invalidated
+        for phase in ("root", "extra-data", "pre-install"):
+            self.assertEqual(before[phase], after[phase])
+        for phase in ("install", "post-install"):
+            self.assertNotEqual(before[phase], after[phase])
+
+        # environment.d and the environment invalidate everything
+        _write(os.path.join(self.hooks, "environment.d", "10-env"), "x")
+        changed = self._keys()
+        self.environ["DIB_RELEASE"] = "2"
+        changed_env = self._keys()
+        for phase in phase_cache.PHASES:
+            self.assertNotEqual(after[phase], changed[phase])
+            self.assertNotEqual(changed[phase], changed_env[phase])
+
+    def test_environment_hash(self):
+        environ = {
+            "TMP_BUILD_DIR": "/tmp/dib_build.1",
+            "DIB_RELEASE": "1",
+            "DIB_BLOCK_DEVICE_PARAMS_YAML": "/tmp/dib_build.1/params.yaml",
+            "DIB_ARGS": "-o one",
+            "HOME": "/home/me",
+        }
+        a = phase_cache.environment_hash(environ)
+        environ.update({
+            "TMP_BUILD_DIR": "/tmp/dib_build.2",
+            "DIB_BLOCK_DEVICE_PARAMS_YAML": "/tmp/dib_build.2/params.yaml",
+            "DIB_ARGS": "-o two",
+            "HOME": "/home/you",
+        })
+        self.assertEqual(a, phase_cache.environment_hash(environ))
+        self.assertNotEqual(a, phase_cache.environment_hash(environ, "vim"))
+
+    @mock.patch("subprocess.check_call", side_effect=_check_call_no_sudo)
+    def test_save_restore(self, mock_call):
+        state = os.path.join(self.tmp, "state.json")
+        cache = phase_cache.PhaseCache(self.cache_dir, state)
+        key = cache.plan(self.hooks, self.environ)["keys"]["extra-data"]
+        self.assertIsNone(cache.restore(self.root))
+
+        # extra-data writes into the hooks and rewrites install.d
+        _write(os.path.join(self.hooks, "ssh-authorized-keys"), "key")
+        os.symlink("10-hook", os.path.join(self.hooks, "install.d", "11"))
+        _write(os.path.join(self.root, "etc", "motd"), "hello")
+        cache.save(self.root, "extra-data")
+
+        # a fresh build with a changed post-install.d restores it
+        build = os.path.join(self.tmp, "build")
+        os.makedirs(build)
+        os.unlink(os.path.join(self.hooks, "ssh-authorized-keys"))
+        os.unlink(os.path.join(self.hooks, "install.d", "11"))
+        _write(os.path.join(self.hooks, "post-install.d", "10-hook"), "new")
+        cache.plan(self.hooks, self.environ)
+        self.assertEqual("extra-data", cache.restore(build))
+        with open(os.path.join(build, "etc", "motd")) as f:
+            self.assertEqual("hello", f.read())
+        with open(os.path.join(self.hooks, "ssh-authorized-keys")) as f:
+            self.assertEqual("key", f.read())
+        self.assertTrue(
+            os.path.islink(os.path.join(self.hooks, "install.d", "11")))
+        with open(os.path.join(self.hooks, "post-install.d", "10-hook")) as f:
+            self.assertEqual("new", f.read())
+        # saved through a bind mount, which is gone again
+        view = os.path.join(self.cache_dir,
+                            "%s.tmp.%d.view" % (key, os.getpid()))
+        mock_call.assert_any_call(["sudo", "mount", "--bind", self.root,
+                                   view])
+        mock_call.assert_any_call(["sudo", "umount", view])
+        self.assertFalse(os.path.exists(view))
+
+        # install.d was modified by extra-data, so changing it means
+        # the entry can not be used any more
+        os.unlink(os.path.join(self.hooks, "ssh-authorized-keys"))
+        os.unlink(os.path.join(self.hooks, "install.d", "11"))
+        _write(os.path.join(self.hooks, "install.d", "20-hook"), "new")
+        cache.plan(self.hooks, self.environ)
+        self.assertIsNone(cache.restore(os.path.join(self.tmp, "build2")))
+
+    @mock.patch("subprocess.check_call", side_effect=_check_call_no_sudo)
+    def test_prune(self, mock_call):
+        old = os.path.join(self.cache_dir, "old")
+        new = os.path.join(self.cache_dir, "new")
+        os.makedirs(old)
+        os.makedirs(new)
+        os.utime(old, (0, 0))
+        cache = phase_cache.PhaseCache(self.cache_dir, None)
+        cache.prune(7)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
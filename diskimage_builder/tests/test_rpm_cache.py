@@ -0,0 +1,136 @@
+# Copyright 2026 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import fcntl
+import os
+import time
+from unittest import mock
+
+import fixtures
+import testtools
+
+from diskimage_builder import rpm_cache
+
+
+class TestRpmCache(testtools.TestCase):
+
+    def setUp(self):
+        super(TestRpmCache, self).setUp()
+        self.tmp = self.useFixture(fixtures.TempDir()).path
+        self.store = os.path.join(self.tmp, 'store')
+        self.snapshot = os.path.join(self.tmp, 'x86_64', '9')
+
+    def _write(self, root, rel, content):
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def _build(self, name, packages=(), repomd=None):
+        """A private cache, as yum/dnf leaves it"""
+        private = os.path.join(self.tmp, name)
+        os.makedirs(private)
+        for package in packages:
+            self._write(private, 'base/packages/%s.rpm' % package, package)
+        if repomd is not None:
+            self._write(private, 'base/repodata/repomd.xml', repomd)
+            self._write(private, 'base/repodata/primary.xml.gz', repomd)
+        return private
+
+    def _read(self, root, rel):
+        with open(os.path.join(root, rel)) as f:
+            return f.read()
+
+    def test_save_and_populate(self):
+        build = self._build('build1', ['foo', 'bar'], repomd='1')
+        self.assertEqual((2, True),
+                         rpm_cache.save(self.snapshot, build, self.store))
+        # nothing new the second time
+        self.assertEqual((0, False),
+                         rpm_cache.save(self.snapshot, build, self.store))
+
+        private = self._build('build2')
+        self.assertEqual((2, True),
+                         rpm_cache.populate(self.snapshot, private, 3600))
+        foo = 'base/packages/foo.rpm'
+        # packages are hardlinked, metadata copied
+        self.assertTrue(os.path.samefile(os.path.join(build, foo),
+                                         os.path.join(private, foo)))
+        # the store, the snapshot and both builds
+        self.assertEqual(
+            4, os.stat(os.path.join(self.snapshot, foo)).st_nlink)
+        self.assertEqual('1', self._read(private, 'base/repodata/repomd.xml'))
+        self.assertFalse(os.path.samefile(
+            os.path.join(self.snapshot, 'base', rpm_cache.REPOMD),
+            os.path.join(private, 'base', rpm_cache.REPOMD)))
+
+    def test_populate_empty(self):
+        private = self._build('build')
+        self.assertEqual((0, False),
+                         rpm_cache.populate(self.snapshot, private, 3600))
+
+    def test_metadata_expired(self):
+        build = self._build('build1', ['foo'], repomd='1')
+        rpm_cache.save(self.snapshot, build, self.store)
+        old = time.time() - 7200
+        os.utime(rpm_cache.stamp_path(self.snapshot), (old, old))
+
+        private = self._build('build2')
+        self.assertEqual((1, False),
+                         rpm_cache.populate(self.snapshot, private, 3600))
+        self.assertFalse(os.path.exists(os.path.join(private, 'base',
+                                                     'repodata')))
+
+    def test_newer_metadata(self):
+        build = self._build('build1', repomd='1')
+        rpm_cache.save(self.snapshot, build, self.store)
+
+        private = self._build('build2')
+        rpm_cache.populate(self.snapshot, private, 3600)
+        # unchanged copies are not saved again ...
+        self.assertEqual((0, False),
+                         rpm_cache.save(self.snapshot, private, self.store))
+        # ... refreshed metadata is
+        path = self._write(private, 'base/repodata/repomd.xml', '2')
+        new = time.time() + 10
+        os.utime(path, (new, new))
+        self.assertEqual((0, True),
+                         rpm_cache.save(self.snapshot, private, self.store))
+        self.assertEqual('2', self._read(self.snapshot,
+                                         'base/repodata/repomd.xml'))
+
+    def test_store_shared_by_releases(self):
+        build = self._build('build1', ['foo'])
+        rpm_cache.save(self.snapshot, build, self.store)
+        other = os.path.join(self.tmp, 'x86_64', '10')
+        # the same package, downloaded again by another build
+        build = self._build('build2', ['foo'])
+        rpm_cache.save(other, build, self.store)
+
+        foo = 'base/packages/foo.rpm'
+        self.assertTrue(os.path.samefile(os.path.join(self.snapshot, foo),
+                                         os.path.join(other, foo)))
+        digest = rpm_cache.file_hash(os.path.join(other, foo))
+        self.assertEqual([digest],
+                         os.listdir(os.path.join(self.store, digest[:2])))
+
+    def test_locking(self):
+        build = self._build('build', ['foo'])
+        with mock.patch('fcntl.flock') as mock_flock:
+            rpm_cache.save(self.snapshot, build, self.store)
+            rpm_cache.populate(self.snapshot, build, 3600)
+        self.assertEqual([fcntl.LOCK_EX, fcntl.LOCK_SH],
+                         [c[0][1] for c in mock_flock.call_args_list])
+        self.assertTrue(os.path.exists(self.snapshot + '.lock'))
@@ -0,0 +1,124 @@
+# Copyright 2026 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import subprocess
+from unittest import mock
+
+import fixtures
+import testtools
+
+from diskimage_builder import source_repositories as sr
+
+
+class TestSourceRepositories(testtools.TestCase):
+
+    def setUp(self):
+        super(TestSourceRepositories, self).setUp()
+        self.tmp = self.useFixture(fixtures.TempDir()).path
+        for name, value in (('GIT_AUTHOR_NAME', 'dib'),
+                            ('GIT_AUTHOR_EMAIL', 'dib@example.com'),
+                            ('GIT_COMMITTER_NAME', 'dib'),
+                            ('GIT_COMMITTER_EMAIL', 'dib@example.com')):
+            self.useFixture(fixtures.EnvironmentVariable(name, value))
+        self.remote = os.path.join(self.tmp, 'remote')
+        self._git('init', '-q', '-b', 'master', self.remote)
+        self.first = self._commit('first')
+        self._git('-C', self.remote, 'tag', 'v1')
+        self.second = self._commit('second')
+        self.cache = os.path.join(self.tmp, 'cache')
+        os.makedirs(self.cache)
+
+    def _git(self, *args):
+        return subprocess.check_output(('git',) + args).decode().strip()
+
+    def _commit(self, message):
+        self._git('-C', self.remote, 'commit', '-q', '--allow-empty',
+                  '-m', message)
+        return self._git('-C', self.remote, 'rev-parse', 'HEAD')
+
+    def _repo(self, name, ref, location=None):
+        return sr.Repository(name, 'git', '/opt/' + name,
+                             location or self.remote, ref,
+                             os.path.join(self.cache, name))
+
+    def _rev(self, repo, ref):
+        return self._git('-C', repo.cache_path, 'rev-parse', ref)
+
+    def test_read_repositories(self):
+        path = os.path.join(self.tmp, 'repositories')
+        with open(path, 'w') as f:
+            f.write('foo git /opt/foo https://example.com/foo master '
+                    '/cache/foo\n\nbar file /opt/bar https://example.com/bar '
+                    '- /cache/bar\n')
+        self.assertEqual(
+            [sr.Repository('foo', 'git', '/opt/foo',
+                           'https://example.com/foo', 'master', '/cache/foo'),
+             sr.Repository('bar', 'file', '/opt/bar',
+                           'https://example.com/bar', '-', '/cache/bar')],
+            sr.read_repositories(path))
+
+    def test_update(self):
+        repos = [self._repo('foo', 'master'), self._repo('bar', 'v1'),
+                 self._repo('sha', self.first), self._repo('all', '*')]
+        self.assertEqual([], sr.update_all(repos, jobs=2))
+        for repo in repos:
+            # a bare clone
+            self.assertEqual('true', self._git(
+                '-C', repo.cache_path, 'rev-parse', '--is-bare-repository'))
+        self.assertEqual(self.second, self._rev(repos[0], 'master'))
+        self.assertEqual(self.first, self._rev(repos[1], 'v1^{commit}'))
+
+        # updated from the remote
+        third = self._commit('third')
+        self.assertEqual([], sr.update_all(repos[:1]))
+        self.assertEqual(third, self._rev(repos[0], 'master'))
+
+    def test_shared_cache(self):
+        # two refs of one repository
+        master = self._repo('foo', 'master')
+        tag = master._replace(name='foo2', ref='v1')
+        with mock.patch.object(sr, 'update_git',
+                               wraps=sr.update_git) as update_git:
+            self.assertEqual([], sr.update_all([master, tag], jobs=4))
+        self.assertEqual([mock.call(master, False), mock.call(tag, False)],
+                         update_git.call_args_list)
+
+    def test_offline(self):
+        repo = self._repo('foo', 'master')
+        sr.update_all([repo])
+        third = self._commit('third')
+        # the cache has master, so it is not updated
+        self.assertEqual([], sr.update_all([repo], offline=True))
+        self.assertEqual(self.second, self._rev(repo, 'master'))
+        # but it does not have this one
+        self.assertEqual([], sr.update_all([repo._replace(ref=third)],
+                                           offline=True))
+        self.assertTrue(sr.has_commit(repo.cache_path, third))
+
+    @mock.patch('time.sleep')
+    def test_errors(self, mock_sleep):
+        missing = self._repo('missing', 'master',
+                             location=os.path.join(self.tmp, 'nothing'))
+        bad_ref = self._repo('bad', 'does-not-exist')
+        good = self._repo('good', 'master')
+        errors = sr.update_all([missing, bad_ref, good], jobs=3)
+        self.assertEqual(['bad', 'missing'],
+                         sorted(name for name, _ in errors))
+        # the clone was retried, with a growing delay
+        self.assertEqual([mock.call(sr.GIT_RETRY_DELAY * 2 ** i)
+                          for i in range(sr.GIT_ATTEMPTS - 1)],
+                         mock_sleep.call_args_list)
+        self.assertFalse(os.path.exists(missing.cache_path))
+        self.assertTrue(os.path.exists(good.cache_path))
@@ -0,0 +1,170 @@
+# Copyright 2026 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import os
+import subprocess
+
+import fixtures
+import testtools
+
+from diskimage_builder import trace
+
+DIB_RUN_PARTS = os.path.join(os.path.dirname(__file__), '..', 'lib',
+                             'dib-run-parts')
+
+
+class TestTrace(testtools.TestCase):
+
+    def setUp(self):
+        super(TestTrace, self).setUp()
+        self.tmp = self.useFixture(fixtures.TempDir()).path
+        self.trace_file = os.path.join(self.tmp, 'trace.jsonl')
+        self.useFixture(fixtures.EnvironmentVariable(
+            'DIB_TRACE_FILE', self.trace_file))
+
+    def test_no_trace(self):
+        self.useFixture(fixtures.EnvironmentVariable('DIB_TRACE_FILE'))
+        self.assertEqual(0, trace.run(['true'], 'hook'))
+        self.assertFalse(os.path.exists(self.trace_file))
+
+    def test_run(self):
+        self.assertEqual(0, trace.run(['sh', '-c', 'echo x > /dev/null'],
+                                      'convert', 'image.qcow2'))
+        self.assertEqual(3, trace.run(['sh', '-c', 'exit 3'], 'hook',
+                                      phase='install', element='foo'))
+        self.assertEqual(127, trace.run(['/does/not/exist'], 'hook'))
+
+        records = trace.read_trace(self.trace_file)
+        self.assertEqual(3, len(records))
+        convert, hook, missing = records
+        self.assertEqual('convert', convert['type'])
+        self.assertEqual('image.qcow2', convert['name'])
+        self.assertEqual(0, convert['returncode'])
+        self.assertLessEqual(convert['start'], convert['stop'])
+        self.assertLessEqual(convert['stop'], hook['start'])
+        for field in ('utime', 'stime', 'maxrss', 'inblock', 'oublock'):
+            self.assertIn(field, convert)
+        self.assertEqual('sh -c exit 3', hook['name'])
+        self.assertEqual(3, hook['returncode'])
+        self.assertEqual('install', hook['phase'])
+        self.assertEqual('foo', hook['element'])
+        self.assertEqual(127, missing['returncode'])
+
+    def test_chrome(self):
+        trace.write_record(trace.make_record('hook', '10-a', 10.5, 12.0, 0,
+                                             pid=7, phase='install'))
+        trace.write_record(trace.make_record('sudo', 'mount x', 10.0, 10.25,
+                                             1))
+        chrome = trace.to_chrome(trace.read_trace(self.trace_file))
+        self.assertEqual([
+            {'name': 'mount x', 'cat': 'sudo', 'ph': 'X', 'ts': 10000000,
+             'dur': 250000, 'pid': 1, 'tid': 0,
+             'args': {'returncode': 1}},
+            {'name': '10-a', 'cat': 'hook', 'ph': 'X', 'ts': 10500000,
+             'dur': 1500000, 'pid': 1, 'tid': 7,
+             'args': {'returncode': 0, 'phase': 'install'}},
+        ], chrome['traceEvents'])
+
+    def _write_hook(self, path, body):
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n' + body)
+        os.chmod(path, 0o755)
+
+    def test_dib_run_parts(self):
+        hooks = os.path.join(self.tmp, 'hooks')
+        os.makedirs(os.path.join(hooks, 'install.d'))
+        for name in ('10-first', '20-second'):
+            self._write_hook(os.path.join(hooks, 'install.d', name),
+                             'echo %s\n' % name)
+        with open(os.path.join(hooks, 'hook-elements'), 'w') as f:
+            f.write('install.d/10-first foo\ninstall.d/20-second bar\n')
+
+        subprocess.check_call(['bash', DIB_RUN_PARTS,
+                               os.path.join(hooks, 'install.d')],
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+
+        with open(self.trace_file) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([('10-first', 'install', 'foo', 0),
+                          ('20-second', 'install', 'bar', 0)],
+                         [(r['name'], r['phase'], r['element'],
+                           r['returncode']) for r in records])
+
+    def test_dib_run_parts_parallel(self):
+        self.useFixture(fixtures.EnvironmentVariable(
+            'DIB_RUN_PARTS_WORKERS', '4'))
+        phase = os.path.join(self.tmp, 'install.d')
+        os.makedirs(phase)
+        safe = '# dib-run-parts: parallel-safe\n'
+        # 10-a and 10-b wait for each other, so only finish when run
+        # at the same time; 10-c and 20-d are run on their own
+        self._write_hook(os.path.join(phase, '10-a'), safe +
+                         'touch %s/a\n'
+                         'while [ ! -e %s/b ]; do sleep 0.1; done\n'
+                         'echo a\n' % (self.tmp, self.tmp))
+        self._write_hook(os.path.join(phase, '10-b'), safe +
+                         'touch %s/b\n'
+                         'while [ ! -e %s/a ]; do sleep 0.1; done\n'
+                         'echo b\n' % (self.tmp, self.tmp))
+        self._write_hook(os.path.join(phase, '10-c'), 'echo c\n')
+        self._write_hook(os.path.join(phase, '20-d'), safe + 'echo d\n')
+
+        output = subprocess.check_output(['timeout', '30', 'bash',
+                                          DIB_RUN_PARTS, phase],
+                                         stderr=subprocess.DEVNULL)
+        # the output of a concurrent hook includes the messages of
+        # dib-run-parts about it
+        self.assertEqual([b'a', b'b', b'c', b'd'],
+                         [line for line in output.splitlines()
+                          if not line.startswith(b'dib-run-parts')])
+        records = trace.read_trace(self.trace_file)
+        self.assertEqual(['10-a', '10-b', '10-c', '20-d'],
+                         sorted(r['name'] for r in records))
+        by_name = dict((r['name'], r) for r in records)
+        self.assertLess(by_name['10-b']['start'], by_name['10-a']['stop'])
+        self.assertLessEqual(max(by_name['10-a']['stop'],
+                                 by_name['10-b']['stop']),
+                             by_name['10-c']['start'])
+
+    def test_dib_run_parts_parallel_failure(self):
+        self.useFixture(fixtures.EnvironmentVariable(
+            'DIB_RUN_PARTS_WORKERS', '4'))
+        phase = os.path.join(self.tmp, 'install.d')
+        os.makedirs(phase)
+        safe = '# dib-run-parts: parallel-safe\n'
+        self._write_hook(os.path.join(phase, '10-a'), safe + 'exit 3\n')
+        self._write_hook(os.path.join(phase, '10-b'), safe + 'echo b\n')
+        self._write_hook(os.path.join(phase, '20-c'), 'echo c\n')
+
+        proc = subprocess.run(['bash', DIB_RUN_PARTS, phase],
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL)
+        self.assertEqual(3, proc.returncode)
+        self.assertNotIn(b'c\n', proc.stdout)
+
+    def test_dib_run_parts_marked(self):
+        self.useFixture(fixtures.EnvironmentVariable(
+            'DIB_RUN_PARTS_MARKED', 'cache'))
+        phase = os.path.join(self.tmp, 'root.d')
+        os.makedirs(phase)
+        self._write_hook(os.path.join(phase, '10-a'), 'echo a\n')
+        self._write_hook(os.path.join(phase, '20-b'),
+                         '# dib-run-parts: parallel-safe\n'
+                         '# dib-run-parts: cache\necho b\n')
+
+        output = subprocess.check_output(['bash', DIB_RUN_PARTS, phase],
+                                         stderr=subprocess.DEVNULL)
+        self.assertEqual(b'b\n', output)
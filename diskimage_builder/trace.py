@@ -0,0 +1,212 @@
+# Copyright 2026 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""The build trace
+
+When DIB_TRACE_FILE is set, the hooks run by dib-run-parts, the
+privileged commands of the block device layer and the image
+conversion and checksumming each append a record to it, as a line of
+JSON:
+
+  {"type": "hook", "name": "10-foo", "phase": "install",
+   "element": "bar", "start": 1700000000.123456,
+   "stop": 1700000001.5, "returncode": 0, "pid": 1234,
+   "utime": 0.8, "stime": 0.2, "maxrss": 20480,
+   "inblock": 0, "oublock": 16}
+
+Times are seconds since the epoch; utime, stime (CPU seconds), maxrss
+(kilobytes), inblock and oublock (512 byte blocks read and written)
+come from the resource usage of the command and are missing if it is
+not known.  A trace can be converted to the Chrome trace format
+(chrome://tracing, Perfetto).
+
+This is also run inside the chroot by dib-run-parts and must only use
+the standard library.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+TRACE_FILE_ENV = 'DIB_TRACE_FILE'
+
+# Fields of a record that are not arguments in a Chrome trace
+_CHROME_FIELDS = ('type', 'name', 'start', 'stop', 'pid')
+
+
+def rusage_fields(rusage):
+    """The fields of a record from a resource usage"""
+    return {
+        'utime': round(rusage.ru_utime, 6),
+        'stime': round(rusage.ru_stime, 6),
+        'maxrss': rusage.ru_maxrss,
+        'inblock': rusage.ru_inblock,
+        'oublock': rusage.ru_oublock,
+    }
+
+
+def write_record(record, path=None):
+    """Append a record to the trace
+
+    :param record: the record, a dict
+    :param path: the trace file; by default DIB_TRACE_FILE, nothing is
+                 written if that is not set
+    """
+    path = path or os.environ.get(TRACE_FILE_ENV)
+    if not path:
+        return
+    line = (json.dumps(record, sort_keys=True) + '\n').encode()
+    # one write to a file opened for appending, so concurrent
+    # writers do not mix their lines
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def make_record(type, name, start, stop, returncode, pid=None,
+                rusage=None, **fields):
+    """A trace record
+
+    :param type: what was run, e.g. "hook" or "sudo"
+    :param name: the name of it, e.g. the hook or the command line
+    :param start: the start time, seconds since the epoch
+    :param stop: the end time
+    :param returncode: the exit code
+    :param pid: the process id
+    :param rusage: a resource usage from os.wait4() or None
+    :param fields: further fields, e.g. phase and element
+    """
+    record = {'type': type, 'name': name, 'start': round(start, 6),
+              'stop': round(stop, 6), 'returncode': returncode}
+    if pid is not None:
+        record['pid'] = pid
+    if rusage is not None:
+        record.update(rusage_fields(rusage))
+    record.update(fields)
+    return record
+
+
+def exit_code(status):
+    """The exit code of a wait status; -signal if killed"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run(cmd, type, name=None, **fields):
+    """Run a command and record it in the trace
+
+    :param cmd: the command list; stdin and output are inherited
+    :param type: the type of the record
+    :param name: its name; by default the command line
+    :param fields: further fields of the record
+    :return: the exit code
+    """
+    start = time.time()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.execvp(cmd[0], cmd)
+        except OSError as e:
+            sys.stderr.write("%s: %s\n" % (cmd[0], e.strerror))
+        os._exit(127)
+    _, status, rusage = os.wait4(pid, 0)
+    returncode = exit_code(status)
+    write_record(make_record(type, name or ' '.join(cmd), start,
+                             time.time(), returncode, pid=pid,
+                             rusage=rusage, **fields))
+    return returncode
+
+
+def read_trace(path):
+    """The records of a trace file"""
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+
+def to_chrome(records):
+    """Convert records to the Chrome trace format
+
+    Each record is a complete ("X") event; events of the same process
+    are on one track.
+    """
+    events = []
+    for record in records:
+        args = dict((k, v) for k, v in record.items()
+                    if k not in _CHROME_FIELDS)
+        events.append({
+            'name': record['name'],
+            'cat': record['type'],
+            'ph': 'X',
+            'ts': int(record['start'] * 1000000),
+            'dur': int((record['stop'] - record['start']) * 1000000),
+            'pid': 1,
+            'tid': record.get('pid', 0),
+            'args': args,
+        })
+    events.sort(key=lambda e: e['ts'])
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="diskimage-builder trace")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    cmd_run = subparsers.add_parser(
+        'run', help='Run a command, recording it in DIB_TRACE_FILE')
+    cmd_run.add_argument('--type', required=True,
+                         help='type of the record, e.g. hook')
+    cmd_run.add_argument('--name', help='name of the record; by default '
+                         'the command line')
+    cmd_run.add_argument('--field', action='append', default=[],
+                         metavar='KEY=VALUE',
+                         help='further field of the record')
+    cmd_run.add_argument('cmd', nargs=argparse.REMAINDER,
+                         help='the command, after "--"')
+
+    cmd_chrome = subparsers.add_parser(
+        'chrome', help='Convert a trace to the Chrome trace format')
+    cmd_chrome.add_argument('trace', help='the trace file')
+    cmd_chrome.add_argument('output', help='the Chrome trace to write')
+
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.command == 'run':
+        cmd = args.cmd
+        if cmd and cmd[0] == '--':
+            cmd = cmd[1:]
+        if not cmd:
+            parser.error("no command given")
+        fields = dict(f.split('=', 1) for f in args.field)
+        returncode = run(cmd, args.type, args.name, **fields)
+        # like the shell does for a command killed by a signal
+        return returncode if returncode >= 0 else 128 - returncode
+
+    with open(args.output, 'w') as f:
+        json.dump(to_chrome(read_trace(args.trace)), f)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())